@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from utils import get_env_float, get_env_int
+
+def _clause_key(clauses):
+    ids = sorted(c['clause_id'] for c in clauses)
+    return hashlib.sha256('\0'.join(ids).encode('utf-8')).hexdigest()
+
+class AnswerCache:
+    """
+    Cache of generated answers so repeated questions skip generateContent.
+
+    The exact tier is keyed on the normalised question plus the set of
+    retrieved clause ids (the prompt depends on nothing else). The optional
+    semantic tier reuses an answer for a differently worded question when it
+    retrieved the same clauses and its embedding is within
+    `similarity` cosine of a cached one. Entries expire after `ttl`
+    seconds, the least recently used are evicted beyond `max_items`, and
+    a scope's entries (one scope per collection) are dropped when its index
+    generation changes.
+    """
+
+    def __init__(self, max_items=1000, ttl=3600, similarity=0.95, semantic=True):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.similarity = similarity
+        self.semantic = semantic
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    def _sync_generation(self, scope, generation):
+        if self.generations.get(scope, generation) != generation:
+            for key in [k for k in self.entries if k[0] == scope]:
+                self.entries.pop(key)
+        self.generations[scope] = generation
+
+    def _expire(self):
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        for key in [k for k, e in self.entries.items() if e['created_at'] < cutoff]:
+            self.entries.pop(key)
+
+    def get(self, question, clauses, generation, question_embedding=None, scope=None):
+        """
+        Return (answer, 'exact' | 'semantic') or (None, None).
+        """
+        clause_key = _clause_key(clauses)
+        key = (scope, normalize_text(question).lower(), clause_key)
+        with self.lock:
+            self._sync_generation(scope, generation)
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry['answer'], 'exact'
+            if self.semantic and question_embedding is not None:
+                query = np.asarray(question_embedding, dtype='float32')
+                query = query / (np.linalg.norm(query) or 1.0)
+                candidates = [(k, e) for k, e in self.entries.items()
+                              if k[0] == scope and k[2] == clause_key and e['embedding'] is not None]
+                if candidates:
+                    sims = np.stack([e['embedding'] for _, e in candidates]) @ query
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.similarity:
+                        self.entries.move_to_end(candidates[best][0])
+                        self.hits_semantic += 1
+                        return candidates[best][1]['answer'], 'semantic'
+            self.misses += 1
+            return None, None
+
+    def put(self, question, clauses, generation, answer, question_embedding=None, scope=None):
+        embedding = None
+        if question_embedding is not None:
+            embedding = np.asarray(question_embedding, dtype='float32')
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        key = (scope, normalize_text(question).lower(), _clause_key(clauses))
+        with self.lock:
+            self._sync_generation(scope, generation)
+            self.entries[key] = {'answer': answer, 'embedding': embedding, 'created_at': time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits_exact + self.hits_semantic + self.misses
+            return {
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "misses": self.misses,
+                "hit_rate": round((self.hits_exact + self.hits_semantic) / lookups, 4) if lookups else None,
+                "items": len(self.entries),
+            }
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def get_answer_cache():
+    """
+    Process-wide answer cache configured from ANSWER_CACHE_* settings.
+    Returns None when ANSWER_CACHE=0.
+    """
+    global _default_cache
+    if os.getenv('ANSWER_CACHE', '1') == '0':
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache(
+                max_items=get_env_int('ANSWER_CACHE_SIZE', 1000),
+                ttl=get_env_float('ANSWER_CACHE_TTL', 3600.0),
+                similarity=get_env_float('ANSWER_CACHE_SIMILARITY', 0.95),
+                semantic=os.getenv('ANSWER_CACHE_SEMANTIC', '1') == '1'
+            )
+        return _default_cache
@@ -1,10 +1,17 @@
 import streamlit as st
 import tempfile
+import shutil
 import os
-from parser import parse_file
-from embedding import FaissIndex, get_gemini_embedding
-from utils import format_json_response
-import requests
+from datetime import date
+from parser import iter_file
+from chunker import chunk_clauses
+from ingest import clause_hash, file_digest
+from answer_cache import get_answer_cache
+from embedding import FaissIndex, SEARCH_MODES, get_gemini_embedding, get_gemini_embeddings, search_filter
+from generation import stream_answer_sync
+from prompt_packer import pack_prompt
+from rerank import RERANK_MODES, get_rerank_mode, retrieve_reranked
+from utils import format_json_response, get_search_mode, parse_date
 
 # --- Custom CSS for hackathon-winning look ---
 st.markdown('''
@@ -119,24 +126,44 @@ uploaded_files = st.file_uploader(
 )
 
 # --- Indexing with Progress Bar ---
+EMBED_SLICE = 500
+
+def index_clauses(clauses):
+    for clause in clauses:
+        clause['hash'] = clause_hash(clause['text'])
+    embeddings = get_gemini_embeddings([clause['text'] for clause in clauses])
+    if len(embeddings):
+        if 'index' not in st.session_state:
+            st.session_state['index'] = FaissIndex(dim=len(embeddings[0]))
+        st.session_state['index'].add(embeddings, clauses)
+    return len(clauses)
+
 if uploaded_files:
     with st.spinner("Parsing and indexing documents..."):
         progress = st.progress(0, text="Indexing documents...")
         total_files = len(uploaded_files)
         for idx, uploaded_file in enumerate(uploaded_files):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp:
-                tmp.write(uploaded_file.read())
-                tmp_path = tmp.name
-            clauses = parse_file(tmp_path)
-            embeddings = []
-            for clause in clauses:
-                emb = get_gemini_embedding(clause['text'])
-                embeddings.append(emb)
-            if embeddings:
-                if 'index' not in st.session_state:
-                    st.session_state['index'] = FaissIndex(dim=len(embeddings[0]))
-                st.session_state['index'].add(embeddings, clauses)
-            os.remove(tmp_path)
+            index = st.session_state.get('index')
+            name = os.path.basename(uploaded_file.name)
+            tmp_dir = tempfile.mkdtemp()
+            # Keep the original name so clause ids and per-document hashes refer to the real file
+            tmp_path = os.path.join(tmp_dir, name)
+            with open(tmp_path, 'wb') as tmp:
+                tmp.write(uploaded_file.getvalue())
+            digest = file_digest(tmp_path)
+            # Streamlit reruns this block on every interaction: skip files already indexed unchanged
+            if index is None or index.document_hash(name) != digest:
+                # Embed and index clauses in slices while the rest of the file is still being parsed
+                clauses, indexed = [], 0
+                for clause in chunk_clauses(iter_file(tmp_path)):
+                    clauses.append(clause)
+                    if len(clauses) >= EMBED_SLICE:
+                        indexed += index_clauses(clauses)
+                        clauses = []
+                indexed += index_clauses(clauses)
+                if 'index' in st.session_state:
+                    st.session_state['index'].finish_document(name, digest, indexed)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
             progress.progress((idx + 1) / total_files, text=f"Indexed {idx + 1} of {total_files} files")
         progress.empty()
     st.success("Documents indexed!")
@@ -148,63 +175,109 @@ with st.form(key="query_form"):
         "Type your question about the uploaded documents:",
         placeholder="e.g. How many days does the breaching party have to cure the breach?"
     )
+    search_mode = st.radio(
+        "Retrieval mode",
+        SEARCH_MODES,
+        index=SEARCH_MODES.index(get_search_mode()),
+        horizontal=True,
+        help="Hybrid fuses semantic search with exact-term (BM25) matching, useful for clause numbers and day counts."
+    )
+    lexical_weight = st.slider("Exact-term weight (hybrid)", 0.0, 2.0, 1.0, 0.1)
+    rerank = st.radio(
+        "Re-ranking",
+        RERANK_MODES,
+        index=RERANK_MODES.index(get_rerank_mode()),
+        horizontal=True,
+        help="MMR drops near-duplicate clauses and diversifies the top 5; cross-encoder also re-orders them."
+    )
+    with st.expander("Filters"):
+        indexed = st.session_state.get('index')
+        filter_files = st.multiselect(
+            "Documents",
+            sorted(indexed.documents) if indexed is not None else [],
+            help="Only search these documents; leave empty to search all of them."
+        )
+        page_cols = st.columns(2)
+        page_from = page_cols[0].number_input("From page", min_value=0, value=0, step=1, help="0 means no limit")
+        page_to = page_cols[1].number_input("To page", min_value=0, value=0, step=1, help="0 means no limit")
+        filter_types = st.multiselect("Document types", ["pdf", "docx", "eml"])
+        uploaded = st.date_input("Uploaded between", value=(), max_value=date.today(),
+                                 help="Pick a start and an end date; leave empty for any upload date.")
     submit_query = st.form_submit_button("Ask")
 
 # --- Results Layout ---
 if submit_query and query:
-    with st.spinner("Retrieving answer from Gemini..."):
-        query_emb = get_gemini_embedding(query)
-        index = st.session_state.get('index', None)
-        if index is None:
-            st.error("No documents indexed yet. Please upload and index documents first.")
-        else:
-            relevant_clauses = index.search(query_emb, top_k=5)
-            context = "\n\n".join([c['text'] for c in relevant_clauses])
-            prompt = f"Context:\n{context}\n\nQuestion: {query}\n\nAnswer with rationale and cite relevant clauses."
-            api_key = os.getenv('GEMINI_API_KEY')
-            url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key=' + api_key
-            headers = {'Content-Type': 'application/json'}
-            data = {
-                "contents": [{"parts": [{"text": prompt}]}],
-                "generationConfig": {"temperature": 0.2, "maxOutputTokens": 512}
-            }
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            answer = response.json()['candidates'][0]['content']['parts'][0]['text']
-            rationale = answer
-            json_response = {
-                "query": query,
-                "answer": answer,
-                "relevant_clauses": [
-                    {
-                        "text": c['text'],
-                        "clause_id": c['clause_id'],
-                        "page": c['page'],
-                        "file": c['file']
-                    } for c in relevant_clauses
-                ],
-                "confidence_score": None,
-                "rationale": rationale
-            }
-            # --- Chat Bubble for User Query ---
-            st.markdown(f"<div class='chat-bubble'><b>You:</b> {query}</div>", unsafe_allow_html=True)
-            # --- Animated Answer Card ---
-            st.markdown(f"<div class='answer-card'><b>LexIQ:</b><br>{answer}</div>", unsafe_allow_html=True)
-            # --- Clause Highlights with Icons ---
-            st.markdown("<h5 style='margin-top:2em;'>Relevant Clauses</h5>", unsafe_allow_html=True)
-            for c in relevant_clauses:
-                st.markdown(f"""
-                    <div class='clause-card'>
-                        <span class='clause-icon'>📄</span>
-                        <div>
-                            <b>{c['file']}</b> <span style='color:#888;'>(Page: {c['page']}, ID: {c['clause_id']})</span><br>
-                            <span style='color:#333;'>{c['text']}</span>
-                        </div>
+    index = st.session_state.get('index', None)
+    if index is None:
+        st.error("No documents indexed yet. Please upload and index documents first.")
+    else:
+        uploaded = list(uploaded) if isinstance(uploaded, (list, tuple)) else [uploaded]
+        try:
+            filters = search_filter(
+                filter_files, (page_from or None, page_to or None), filter_types,
+                parse_date(uploaded[0].isoformat()) if uploaded else None,
+                parse_date(uploaded[-1].isoformat(), end=True) if uploaded else None
+            )
+        except ValueError as e:
+            st.error(str(e))
+            st.stop()
+        with st.spinner("Retrieving relevant clauses..."):
+            query_emb = get_gemini_embedding(query) if search_mode != 'lexical' else None
+            relevant_clauses = retrieve_reranked(index, [query], None if query_emb is None else [query_emb], top_k=5,
+                                                 rerank=rerank, mode=search_mode, lexical_weight=lexical_weight,
+                                                 filters=filters)[0]
+            answer_cache = get_answer_cache()
+            answer, cache_hit = None, None
+            if answer_cache is not None:
+                answer, cache_hit = answer_cache.get(query, relevant_clauses, index.generation, query_emb)
+        # --- Chat Bubble for User Query ---
+        st.markdown(f"<div class='chat-bubble'><b>You:</b> {query}</div>", unsafe_allow_html=True)
+        # --- Animated Answer Card (filled in as Gemini streams the answer) ---
+        answer_card = st.empty()
+        # --- Clause Highlights with Icons ---
+        st.markdown("<h5 style='margin-top:2em;'>Relevant Clauses</h5>", unsafe_allow_html=True)
+        for c in relevant_clauses:
+            st.markdown(f"""
+                <div class='clause-card'>
+                    <span class='clause-icon'>📄</span>
+                    <div>
+                        <b>{c['file']}</b> <span style='color:#888;'>(Page: {c['page']}, ID: {c['clause_id']})</span><br>
+                        <span style='color:#333;'>{c['text']}</span>
                     </div>
-                """, unsafe_allow_html=True)
-            # --- JSON Output ---
-            with st.expander("Show raw JSON response"):
-                st.code(format_json_response(json_response), language="json")
+                </div>
+            """, unsafe_allow_html=True)
+        usage = None
+        if answer is None:
+            parts = []
+            prompt, usage = pack_prompt(query, relevant_clauses, endpoint='streamlit')
+            answer_card.markdown("<div class='answer-card'><b>LexIQ:</b><br>▌</div>", unsafe_allow_html=True)
+            for text in stream_answer_sync(prompt):
+                parts.append(text)
+                answer_card.markdown(f"<div class='answer-card'><b>LexIQ:</b><br>{''.join(parts)}▌</div>", unsafe_allow_html=True)
+            answer = ''.join(parts)
+            if answer_cache is not None:
+                answer_cache.put(query, relevant_clauses, index.generation, answer, query_emb)
+        answer_card.markdown(f"<div class='answer-card'><b>LexIQ:</b><br>{answer}</div>", unsafe_allow_html=True)
+        rationale = answer
+        json_response = {
+            "query": query,
+            "answer": answer,
+            "relevant_clauses": [
+                {
+                    "text": c['text'],
+                    "clause_id": c['clause_id'],
+                    "page": c['page'],
+                    "file": c['file']
+                } for c in relevant_clauses
+            ],
+            "confidence_score": None,
+            "rationale": rationale,
+            "cache_hit": cache_hit,
+            "usage": usage
+        }
+        # --- JSON Output ---
+        with st.expander("Show raw JSON response"):
+            st.code(format_json_response(json_response), language="json")
 
 # --- Footer ---
 st.markdown("""
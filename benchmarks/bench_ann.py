@@ -0,0 +1,58 @@
+"""
+Recall / latency / memory benchmark for the FaissIndex index types.
+
+Builds each type from index_factory on a clustered synthetic corpus and
+compares it against exact flat search.
+
+    python -m benchmarks.bench_ann --rows 100000 --dim 128 --k 5
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from index_factory import INDEX_TYPES, build_index, set_search_params, train_index
+
+def synthetic_corpus(rows, queries, dim, clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype('float32') * 4
+    labels = rng.integers(0, clusters, rows + queries)
+    data = centers[labels] + rng.standard_normal((rows + queries, dim)).astype('float32')
+    return np.ascontiguousarray(data[:rows]), np.ascontiguousarray(data[rows:])
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=100000)
+    ap.add_argument('--queries', type=int, default=500)
+    ap.add_argument('--dim', type=int, default=128)
+    ap.add_argument('--k', type=int, default=5)
+    ap.add_argument('--types', default=','.join(INDEX_TYPES))
+    args = ap.parse_args()
+
+    corpus, queries = synthetic_corpus(args.rows, args.queries, args.dim)
+    truth = faiss.IndexFlatL2(args.dim)
+    truth.add(corpus)
+    _, expected = truth.search(queries, args.k)
+
+    print(f"{'type':>9} {'build s':>8} {'recall@' + str(args.k):>9} {'p50 ms':>7} {'p99 ms':>7} {'memory MB':>10}")
+    for index_type in args.types.split(','):
+        start = time.perf_counter()
+        index = build_index(index_type, args.dim, args.rows)
+        train_index(index, corpus)
+        index.add(corpus)
+        set_search_params(index)
+        build_s = time.perf_counter() - start
+
+        latencies, hits = [], 0
+        for q, truth_ids in zip(queries, expected):
+            start = time.perf_counter()
+            _, found = index.search(q.reshape(1, -1), args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(set(found[0]) & set(truth_ids))
+        memory_mb = faiss.serialize_index(index).nbytes / 1e6
+        print(f"{index_type:>9} {build_s:8.2f} {hits / expected.size:9.3f} "
+              f"{np.percentile(latencies, 50):7.3f} {np.percentile(latencies, 99):7.3f} {memory_mb:10.1f}")
+
+if __name__ == '__main__':
+    main()
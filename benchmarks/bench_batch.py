@@ -0,0 +1,80 @@
+"""
+One /query/batch request against the same questions sent one by one to /query.
+
+Starts benchmarks.mock_gemini (with per-call embedding and generation
+latency) and webhook_api in a scratch directory, uploads a synthetic .eml
+document, then answers `--questions` distinct questions both ways. The batch
+embeds every question in one call, searches them with one matrix search and
+generates QUERY_BATCH_CONCURRENCY answers at a time.
+
+    python -m benchmarks.bench_batch --questions 32 --embed-ms 50 --first-token-ms 300
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_streaming import ROOT, free_port, wait_until_up, write_eml
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--questions', type=int, default=32)
+    ap.add_argument('--paragraphs', type=int, default=2000)
+    ap.add_argument('--embed-ms', type=float, default=50)
+    ap.add_argument('--first-token-ms', type=float, default=300)
+    ap.add_argument('--concurrency', type=int, default=8)
+    args = ap.parse_args()
+
+    mock_port, api_port = free_port(), free_port()
+    procs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPATH=ROOT, GEMINI_API_KEY='mock', EMBEDDING_BACKEND='gemini',
+                   GEMINI_API_BASE=f"http://127.0.0.1:{mock_port}/v1beta", ANSWER_CACHE='0',
+                   EMBEDDING_CACHE='0', QUERY_BATCH_CONCURRENCY=str(args.concurrency))
+        try:
+            procs.append(subprocess.Popen([
+                sys.executable, '-m', 'benchmarks.mock_gemini', '--port', str(mock_port),
+                '--embed-ms', str(args.embed_ms), '--first-token-ms', str(args.first_token_ms), '--tokens', '1'
+            ], cwd=ROOT, env=env))
+            procs.append(subprocess.Popen([
+                sys.executable, '-m', 'uvicorn', 'webhook_api:app', '--port', str(api_port), '--log-level', 'warning'
+            ], cwd=tmp, env=env))
+            url = f"http://127.0.0.1:{api_port}"
+            wait_until_up(f"http://127.0.0.1:{mock_port}/docs")
+            wait_until_up(url + '/health')
+
+            eml = os.path.join(tmp, 'policy.eml')
+            write_eml(eml, args.paragraphs)
+            with httpx.Client(timeout=600) as client, open(eml, 'rb') as f:
+                client.post(url + '/upload', files={'files': ('policy.eml', f)}).raise_for_status()
+                client.post(url + '/query', data={'question': 'warm up'}).raise_for_status()
+                questions = [f"How many days to give notice under clause {i}.1?" for i in range(2 * args.questions)]
+
+                start = time.perf_counter()
+                for question in questions[:args.questions]:
+                    client.post(url + '/query', data={'question': question}).raise_for_status()
+                sequential = time.perf_counter() - start
+
+                start = time.perf_counter()
+                response = client.post(url + '/query/batch', data={'questions': questions[args.questions:]})
+                response.raise_for_status()
+                batched = time.perf_counter() - start
+                report = response.json()
+        finally:
+            for p in procs:
+                p.terminate()
+                p.wait()
+
+    errors = sum('error' in r for r in report['results'])
+    print(f"{args.questions} questions, mock embed {args.embed_ms:.0f} ms, "
+          f"generation {args.first_token_ms:.0f} ms, batch concurrency {args.concurrency}")
+    print(f"{'sequential /query':<20} {sequential:8.2f} s")
+    print(f"{'/query/batch':<20} {batched:8.2f} s   ({sequential / batched:.1f}x, {errors} errors)")
+    print("batch timings:", ', '.join(f"{k} {v:.1f}" for k, v in report['timings'].items()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Clause count, embedding calls, index size and retrieval quality with and
+without the chunker.
+
+The sample PDF mimics a policy document: a running header and "Page N of M"
+footer on every page, a "Section N:" heading per page, one-sentence body
+blocks, an occasional oversized block, and a fact whose sentence wraps
+across two blocks ("...waiting period for benefit BX0017" / "shall be 45 days").
+A query hits when one of its top-5 clauses contains the whole fact.
+Vector scores use the offline hashing embedder, which dilutes a single rare
+term in long chunks far more than a real embedding model would.
+
+    python -m benchmarks.bench_chunking --pages 300
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ['EMBEDDING_BACKEND'] = 'local'
+os.environ.setdefault('EMBEDDING_CACHE', '0')
+os.environ.setdefault('LOCAL_EMBEDDING_DIM', '256')
+
+import fitz
+
+from chunker import Chunker
+from embedding import FaissIndex, get_gemini_embeddings, iter_embedding_batches
+from parser import parse_file
+
+WORDS = ('party breach notice cure contract policy premium insured claim liability '
+         'termination payment coverage period insurer written consent renewal').split()
+
+def sentence(rng, words=18):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def write_pdf(path, pages, seed=0):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    facts = []
+    for p in range(1, pages + 1):
+        page = doc.new_page()
+        blocks = [f"ACME Insurance Group - Policy Wording"]
+        blocks.append(f"Section {p}: {rng.choice(WORDS).capitalize()} and {rng.choice(WORDS)}")
+        if p % 10 == 0:
+            blocks.append(' '.join(sentence(rng) for _ in range(16)))
+        else:
+            blocks.extend(sentence(rng) for _ in range(6))
+        days = rng.randint(1, 365)
+        blocks.append(f"Subject to the conditions above, the waiting period for benefit BX{p:04d}")
+        blocks.append(f"shall be {days} days from the policy start date.")
+        facts.append((p, days))
+        y = 30
+        for text in blocks:
+            height = 14 * (len(text) // 90 + 1) + 6
+            page.insert_textbox(fitz.Rect(50, y, 550, y + height), text, fontsize=9)
+            y += height + 8
+        page.insert_textbox(fitz.Rect(50, 800, 550, 820), f"Page {p} of {pages}", fontsize=8)
+    doc.save(path)
+    return facts
+
+def evaluate(name, clauses, facts, tmp):
+    texts = [c['text'] for c in clauses]
+    calls = sum(1 for _ in iter_embedding_batches(texts))
+    start = time.perf_counter()
+    embeddings = get_gemini_embeddings(texts)
+    embed_s = time.perf_counter() - start
+    index = FaissIndex(embeddings.shape[1], store_path=os.path.join(tmp, name))
+    index.add(embeddings, clauses)
+    questions = [f"What is the waiting period for benefit BX{p:04d}?" for p, _ in facts]
+    query_embeddings = get_gemini_embeddings(questions)
+    hits = {'vector': 0, 'hybrid': 0}
+    for (p, days), question, emb in zip(facts, questions, query_embeddings):
+        for mode in hits:
+            results = index.retrieve(question, emb, top_k=5, mode=mode)
+            hits[mode] += any(f"BX{p:04d}" in r['text'] and f"{days} days" in r['text'] for r in results)
+    tokens = sum(len(t) // 4 for t in texts)
+    print(f"{name:<10} {len(clauses):>8} {calls:>7} {tokens:>9} {embeddings.nbytes / 2**20:>8.1f}MB "
+          f"{embed_s:>7.2f}s {hits['vector'] / len(facts):>7.2f} {hits['hybrid'] / len(facts):>7.2f}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--pages', type=int, default=300)
+    ap.add_argument('--chunk-tokens', type=int, default=256)
+    ap.add_argument('--overlap', type=int, default=32)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'policy.pdf')
+        facts = write_pdf(path, args.pages)
+        raw = parse_file(path)
+        chunker = Chunker(target_tokens=args.chunk_tokens, overlap_tokens=args.overlap)
+        chunked = chunker.feed(raw) + chunker.finish()
+        print(f"{args.pages} pages, chunks of ~{args.chunk_tokens} tokens with {args.overlap} overlap")
+        print(f"{'':<10} {'clauses':>8} {'calls':>7} {'tokens':>9} {'vectors':>10} {'embed':>8} "
+              f"{'vec@5':>7} {'hyb@5':>7}")
+        evaluate('blocks', raw, facts, tmp)
+        evaluate('chunked', chunked, facts, tmp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Memory / latency / recall trade-offs of vector compression in FaissIndex:
+float16 and int8 codes, PCA and truncation to fewer dimensions, with and
+without full-precision rescoring (FAISS_RESCORE_FACTOR).
+
+The synthetic corpus mimics embedding vectors: unit length, clustered,
+with variance decaying over the dimensions (leading dimensions carry the
+most signal, as in Matryoshka-trained models). Queries are perturbed
+corpus rows; recall@k is against exact search on the full vectors.
+Memory is the in-memory index (FaissIndex.memory_bytes without the
+clause metadata); the full vectors stay in the on-disk segments.
+
+    python -m benchmarks.bench_compression --rows 100000 --dim 768 --reduce-dims 0,256,128
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from embedding import FaissIndex
+from index_factory import VECTOR_CODECS, index_memory_bytes
+
+def embedding_like_corpus(rows, queries, dim, clusters=512, seed=0):
+    rng = np.random.default_rng(seed)
+    scale = (1.0 / np.sqrt(1 + np.arange(dim))).astype('float32')
+    centers = rng.standard_normal((clusters, dim)).astype('float32') * scale * 3
+    data = centers[rng.integers(0, clusters, rows)] + rng.standard_normal((rows, dim)).astype('float32') * scale
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    picks = rng.integers(0, rows, queries)
+    noisy = data[picks] + 0.3 * rng.standard_normal((queries, dim)).astype('float32') * scale
+    noisy /= np.linalg.norm(noisy, axis=1, keepdims=True)
+    return np.ascontiguousarray(data), np.ascontiguousarray(noisy)
+
+def build(corpus, store, index_type, codec, reduction, reduce_dim):
+    os.environ['FAISS_REDUCTION'] = reduction
+    index = FaissIndex(corpus.shape[1], store_path=store, index_type=index_type, codec=codec,
+                       reduce_dim=reduce_dim, mmap=False)
+    metas = [{'text': '', 'clause_id': str(i), 'page': 1, 'file': 'corpus.pdf'} for i in range(len(corpus))]
+    for start in range(0, len(corpus), 20000):
+        index.add(corpus[start:start + 20000], metas[start:start + 20000])
+    index.save()
+    return index
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=100000)
+    ap.add_argument('--queries', type=int, default=500)
+    ap.add_argument('--dim', type=int, default=768)
+    ap.add_argument('--k', type=int, default=10)
+    ap.add_argument('--index-type', default='flat')
+    ap.add_argument('--codecs', default=','.join(VECTOR_CODECS))
+    ap.add_argument('--reduce-dims', default='0,256,128')
+    ap.add_argument('--reductions', default='pca,truncate')
+    ap.add_argument('--rescore', type=int, default=4, help='rescore factor compared with no rescoring')
+    args = ap.parse_args()
+
+    corpus, queries = embedding_like_corpus(args.rows, args.queries, args.dim)
+    truth = faiss.IndexFlatL2(args.dim)
+    truth.add(corpus)
+    _, expected = truth.search(queries, args.k)
+
+    variants = []
+    for reduce_dim in (int(d) for d in args.reduce_dims.split(',')):
+        for reduction in (args.reductions.split(',') if reduce_dim else ['pca']):
+            for codec in args.codecs.split(','):
+                variants.append((codec, reduction, reduce_dim))
+
+    print(f"{args.rows} x {args.dim} vectors, {args.queries} queries, {args.index_type} index")
+    print(f"{'layout':<28} {'memory MB':>10} {'build s':>8} {'rescore':>8} {'recall@' + str(args.k):>10} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    for codec, reduction, reduce_dim in variants:
+        with tempfile.TemporaryDirectory() as store:
+            start = time.perf_counter()
+            index = build(corpus, store, args.index_type, codec, reduction, reduce_dim)
+            build_s = time.perf_counter() - start
+            memory_mb = index_memory_bytes(index.index) / 2**20
+            lossy = index._lossy()
+            for factor in ([0, args.rescore] if lossy and args.rescore > 1 else [0]):
+                index.rescore_factor = factor
+                latencies, hits = [], 0
+                for q, truth_ids in zip(queries, expected):
+                    start = time.perf_counter()
+                    found = index.search(q, args.k)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    hits += len({int(c['clause_id']) for c in found} & set(truth_ids.tolist()))
+                print(f"{index.active_spec:<28} {memory_mb:10.1f} {build_s:8.2f} {factor or '-':>8} "
+                      f"{hits / expected.size:10.3f} {np.percentile(latencies, 50):8.3f} "
+                      f"{np.percentile(latencies, 99):8.3f}")
+
+if __name__ == '__main__':
+    main()
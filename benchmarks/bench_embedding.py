@@ -0,0 +1,60 @@
+"""
+Offline ingestion throughput benchmark.
+
+Runs the embedding + indexing path with the local stand-in backend so no
+Gemini quota is used, and reports how many batch API calls the same corpus
+would need against the real endpoint.
+
+    python -m benchmarks.bench_embedding --clauses 5000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ['EMBEDDING_BACKEND'] = 'local'
+os.environ.setdefault('EMBEDDING_CACHE', '0')
+
+from embedding import FaissIndex, get_gemini_embeddings, iter_embedding_batches
+
+WORDS = ('party breach notice days cure contract policy premium insured claim '
+         'liability termination clause section payment coverage period').split()
+
+def synthetic_clauses(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            'text': f"Section {i}: " + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 80))),
+            'clause_id': f"bench.pdf_p{i // 20 + 1}_b{i % 20}",
+            'page': i // 20 + 1,
+            'file': 'bench.pdf'
+        } for i in range(n)
+    ]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--clauses', type=int, default=5000)
+    args = ap.parse_args()
+
+    clauses = synthetic_clauses(args.clauses)
+    texts = [c['text'] for c in clauses]
+    batches = sum(1 for _ in iter_embedding_batches(texts))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        embeddings = get_gemini_embeddings(texts)
+        embed_s = time.perf_counter() - start
+        index = FaissIndex(embeddings.shape[1], os.path.join(tmp, 'faiss.index'), os.path.join(tmp, 'faiss_meta.pkl'))
+        start = time.perf_counter()
+        index.add(embeddings, clauses)
+        index_s = time.perf_counter() - start
+
+    print(f"clauses:            {len(clauses)}")
+    print(f"API calls (single): {len(clauses)}")
+    print(f"API calls (batched):{batches:>6}")
+    print(f"embed time:         {embed_s:.3f}s ({len(clauses) / embed_s:.0f} clauses/s)")
+    print(f"index time:         {index_s:.3f}s")
+
+if __name__ == '__main__':
+    main()
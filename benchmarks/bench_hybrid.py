@@ -0,0 +1,74 @@
+"""
+Latency and exact-term hit rate of vector, lexical (BM25) and hybrid search.
+
+Each synthetic clause carries a unique clause number and day count; queries
+ask for one of them, which is the case pure vector search tends to miss.
+
+    python -m benchmarks.bench_hybrid --clauses 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ['EMBEDDING_BACKEND'] = 'local'
+os.environ.setdefault('EMBEDDING_CACHE', '0')
+os.environ.setdefault('LOCAL_EMBEDDING_DIM', '256')
+
+import numpy as np
+
+from embedding import FaissIndex, get_gemini_embeddings
+
+WORDS = ('party breach notice cure contract policy premium insured claim liability '
+         'termination payment coverage period insurer written consent renewal').split()
+
+def synthetic_clauses(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            'text': f"Section {i}.{rng.randint(1, 9)}: " + ' '.join(rng.choice(WORDS) for _ in range(30))
+                    + f" within {rng.randint(1, 365)} days",
+            'clause_id': f"bench.pdf_p{i // 20 + 1}_b{i % 20}",
+            'page': i // 20 + 1,
+            'file': 'bench.pdf'
+        } for i in range(n)
+    ]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--clauses', type=int, default=100000)
+    ap.add_argument('--queries', type=int, default=200)
+    args = ap.parse_args()
+
+    clauses = synthetic_clauses(args.clauses)
+    rng = random.Random(1)
+    targets = [rng.randrange(args.clauses) for _ in range(args.queries)]
+    questions = [f"What does section {clauses[t]['text'].split(':')[0].split()[1]} say about the cure period?" for t in targets]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = FaissIndex(int(os.environ['LOCAL_EMBEDDING_DIM']), store_path=os.path.join(tmp, 'store'))
+        for start in range(0, len(clauses), 10000):
+            batch = clauses[start:start + 10000]
+            index.add(get_gemini_embeddings([c['text'] for c in batch]), batch)
+        start = time.perf_counter()
+        index.lexical_search('warm up', 1)
+        print(f"{len(clauses)} clauses, BM25 build {time.perf_counter() - start:.2f}s")
+
+        query_embs = get_gemini_embeddings(questions)
+        print(f"{'mode':>13} {'hit@5':>6} {'p50 ms':>7} {'p99 ms':>7}")
+        for mode, fusion in (('vector', None), ('lexical', None), ('hybrid', 'linear'), ('hybrid', 'rrf')):
+            latencies, hits = [], 0
+            for target, question, emb in zip(targets, questions, query_embs):
+                start = time.perf_counter()
+                if fusion:
+                    results = index.hybrid_search(question, emb, top_k=5, fusion=fusion)
+                else:
+                    results = index.retrieve(question, emb, top_k=5, mode=mode)
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += any(r['clause_id'] == clauses[target]['clause_id'] for r in results)
+            print(f"{mode + ('/' + fusion if fusion else ''):>13} {hits / len(targets):6.2f} {np.percentile(latencies, 50):7.2f} {np.percentile(latencies, 99):7.2f}")
+        index.wait_for_compaction()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Serial vs multi-process PDF parsing, and how soon ingestion starts writing.
+
+Generates a synthetic PDF, then reports total parse time and time to the
+first clause for parse_file, iter_pdf and iter_pdf_parallel, plus the time
+until ingest_file's first index write against its total time.
+
+    python -m benchmarks.bench_parsing --pages 2000 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ['EMBEDDING_BACKEND'] = 'local'
+os.environ.setdefault('EMBEDDING_CACHE', '0')
+os.environ.setdefault('LOCAL_EMBEDDING_DIM', '256')
+
+import fitz
+
+def write_pdf(path, pages, paragraphs=12):
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        y = 50
+        for i in range(paragraphs):
+            page.insert_textbox(fitz.Rect(50, y, 550, y + 55),
+                                f"Section {p}.{i}: The insured shall notify the insurer in writing within "
+                                f"{(p + i) % 90 + 1} days of any occurrence that may give rise to a claim.",
+                                fontsize=9)
+            y += 60
+    doc.save(path)
+
+def time_iter(clauses):
+    start = time.perf_counter()
+    first, count = None, 0
+    for _ in clauses:
+        if first is None:
+            first = time.perf_counter() - start
+        count += 1
+    return first, time.perf_counter() - start, count
+
+class TimingWriter:
+    """
+    Stands in for IndexWriter: records when the first write arrives and
+    indexes nothing (so every run sees a new document).
+    """
+
+    def __init__(self):
+        self.first_write = None
+        self.start = time.perf_counter()
+        self.lock = asyncio.Lock()
+
+    def document_lock(self, name):
+        return self.lock
+
+    def get_index(self, dim):
+        return None
+
+    async def submit(self, embeddings, clauses):
+        if self.first_write is None:
+            self.first_write = time.perf_counter() - self.start
+        return len(clauses)
+
+    async def finish_document(self, name, file_hash, clauses):
+        pass
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--pages', type=int, default=2000)
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--pages-per-task', type=int, default=50)
+    args = ap.parse_args()
+    os.environ['PARSE_WORKERS'] = str(args.workers)
+    os.environ['PARSE_PAGES_PER_TASK'] = str(args.pages_per_task)
+
+    from ingest import get_parse_pool, ingest_file, shutdown_parse_pool
+    from parser import iter_pdf, iter_pdf_parallel, parse_file
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'policy.pdf')
+        write_pdf(path, args.pages)
+        print(f"{args.pages} pages, {args.workers} workers, {args.pages_per_task} pages per task")
+
+        start = time.perf_counter()
+        clauses = parse_file(path)
+        total = time.perf_counter() - start
+        print(f"{'parse_file':<20} first clause {total:7.3f}s   total {total:7.3f}s   {len(clauses)} clauses")
+        first, total, count = time_iter(iter_pdf(path))
+        print(f"{'iter_pdf':<20} first clause {first:7.3f}s   total {total:7.3f}s   {count} clauses")
+        first, total, count = time_iter(iter_pdf_parallel(path))
+        print(f"{'iter_pdf_parallel':<20} first clause {first:7.3f}s   total {total:7.3f}s   {count} clauses")
+
+        async def ingest():
+            # Warm the pool so worker start-up is not counted
+            await asyncio.wrap_future(get_parse_pool().submit(os.getpid))
+            writer = TimingWriter()
+            count = await ingest_file(path, writer)
+            return writer.first_write, time.perf_counter() - writer.start, count
+
+        first, total, count = asyncio.run(ingest())
+        shutdown_parse_pool()
+        print(f"{'ingest_file':<20} first write  {first:7.3f}s   total {total:7.3f}s   {count} clauses")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Ingest-time benchmark for FaissIndex persistence.
+
+Compares the segment store (append per add + background compaction) with the
+previous behaviour of rewriting faiss.index and re-pickling all metadata on
+every add.
+
+    python -m benchmarks.bench_persistence --sizes 10000,100000,1000000
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from embedding import FaissIndex
+
+def make_batch(rng, start, n, dim):
+    vectors = rng.standard_normal((n, dim)).astype('float32')
+    metas = [
+        {'text': f"clause {i}", 'clause_id': f"bench.pdf_p{i // 20 + 1}_b{i % 20}", 'page': i // 20 + 1, 'file': 'bench.pdf'}
+        for i in range(start, start + n)
+    ]
+    return vectors, metas
+
+def ingest_legacy(tmp, total, batch, dim):
+    rng = np.random.default_rng(0)
+    index, meta = faiss.IndexFlatL2(dim), []
+    start = time.perf_counter()
+    for offset in range(0, total, batch):
+        vectors, metas = make_batch(rng, offset, min(batch, total - offset), dim)
+        index.add(vectors)
+        meta.extend(metas)
+        faiss.write_index(index, os.path.join(tmp, 'legacy.index'))
+        with open(os.path.join(tmp, 'legacy_meta.pkl'), 'wb') as f:
+            pickle.dump(meta, f)
+    return time.perf_counter() - start
+
+def ingest_segments(tmp, total, batch, dim):
+    rng = np.random.default_rng(0)
+    index = FaissIndex(dim, os.path.join(tmp, 'faiss.index'), os.path.join(tmp, 'faiss_meta.pkl'))
+    start = time.perf_counter()
+    for offset in range(0, total, batch):
+        index.add(*make_batch(rng, offset, min(batch, total - offset), dim))
+    ingest_s = time.perf_counter() - start
+    index.wait_for_compaction()
+    drained_s = time.perf_counter() - start
+    start = time.perf_counter()
+    FaissIndex(dim, os.path.join(tmp, 'faiss.index'), os.path.join(tmp, 'faiss_meta.pkl'))
+    return ingest_s, drained_s, time.perf_counter() - start, len(index.store.manifest['segments'])
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='10000,100000,1000000')
+    ap.add_argument('--batch', type=int, default=1000, help='clauses per add() call')
+    ap.add_argument('--dim', type=int, default=128)
+    ap.add_argument('--legacy-max', type=int, default=100000, help='skip the quadratic legacy run above this size')
+    args = ap.parse_args()
+
+    print(f"{'clauses':>9} {'legacy s':>9} {'segment s':>10} {'+compact s':>11} {'reload s':>9} {'segments':>9}")
+    for total in [int(s) for s in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy = f"{ingest_legacy(tmp, total, args.batch, args.dim):9.2f}" if total <= args.legacy_max else f"{'skipped':>9}"
+            ingest_s, drained_s, reload_s, segments = ingest_segments(tmp, total, args.batch, args.dim)
+        print(f"{total:>9} {legacy} {ingest_s:10.2f} {drained_s:11.2f} {reload_s:9.2f} {segments:>9}")
+
+if __name__ == '__main__':
+    main()
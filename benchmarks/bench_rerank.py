@@ -0,0 +1,118 @@
+"""
+Retrieval quality and latency of the re-ranking stage (RERANK=none / mmr /
+cross-encoder).
+
+Builds a synthetic corpus where every topic has `--facts` distinct clauses,
+each repeated `--copies` times with small edits (as when amended versions of
+a contract are indexed side by side), plus unrelated filler. For one question
+per topic it reports how many of the top_k clauses are distinct facts of that
+topic, how many slots went to near-duplicates, and the per-question latency
+of retrieval plus re-ranking. The cross-encoder row needs
+sentence-transformers (and the RERANK_MODEL download).
+
+It then checks that MMR keeps a hybrid-search hit found only by BM25 (an
+exact term whose vector is far from the question's) and exits with status 1
+if re-ranking drops it.
+
+    python -m benchmarks.bench_rerank --topics 200 --copies 3
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from embedding import FaissIndex, get_local_embeddings
+from rerank import RERANK_MODES, get_reranker, retrieve_reranked
+
+ASPECTS = ['written notice', 'payment of the premium', 'termination for cause', 'renewal of cover',
+           'assignment of rights', 'limitation of liability', 'audit of records', 'dispute resolution']
+
+def topic_word(t):
+    return f"plan{t}x"
+
+def corpus(topics, facts, copies, filler):
+    texts, fact_of = [], []
+    for t in range(topics):
+        for f in range(facts):
+            for c in range(copies):
+                edit = f" v{c + 1}" if c else ""
+                texts.append(f"Under the {topic_word(t)} policy {ASPECTS[f % len(ASPECTS)]} is required "
+                             f"within {t + f + 5} days{edit}.")
+                fact_of.append((t, f))
+    for i in range(filler):
+        texts.append(f"Filler clause {i} about general definitions and headings of schedule {i % 50}.")
+        fact_of.append(None)
+    return texts, fact_of
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--topics', type=int, default=200)
+    ap.add_argument('--facts', type=int, default=5)
+    ap.add_argument('--copies', type=int, default=3)
+    ap.add_argument('--filler', type=int, default=5000)
+    ap.add_argument('--top-k', type=int, default=5)
+    ap.add_argument('--dim', type=int, default=256)
+    args = ap.parse_args()
+
+    texts, fact_of = corpus(args.topics, args.facts, args.copies, args.filler)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = FaissIndex(args.dim, store_path=tmp)
+        metas = [{'text': t, 'clause_id': str(i), 'page': 1, 'file': 'policy.pdf'} for i, t in enumerate(texts)]
+        index.add(get_local_embeddings(texts, dim=args.dim), metas)
+        questions = [f"What is required under the {topic_word(t)} policy?"
+                     for t in range(args.topics)]
+        embeddings = get_local_embeddings(questions, dim=args.dim)
+
+        print(f"{len(texts)} clauses, {args.topics} questions, {args.facts} facts x {args.copies} copies per topic, "
+              f"top_k {args.top_k}, {get_reranker().candidates} candidates")
+        print(f"{'rerank':<14} {'distinct facts':>15} {'dup slots':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for mode in RERANK_MODES:
+            latencies, distinct, duplicates = [], 0, 0
+            for t, (question, embedding) in enumerate(zip(questions, embeddings)):
+                start = time.perf_counter()
+                clauses = retrieve_reranked(index, [question], [embedding], top_k=args.top_k, rerank=mode,
+                                            started=start, mode='vector')[0]
+                latencies.append(time.perf_counter() - start)
+                facts = [fact_of[int(c['clause_id'])] for c in clauses]
+                relevant = [f for f in facts if f is not None and f[0] == t]
+                distinct += len(set(relevant))
+                duplicates += len(relevant) - len(set(relevant))
+            stats = get_reranker().stats()
+            if mode == 'cross-encoder' and stats['cross_encoder_error']:
+                print(f"{mode:<14} unavailable ({stats['cross_encoder_error']})")
+                continue
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            print(f"{mode:<14} {distinct / (args.topics * min(args.facts, args.top_k)):>14.1%} "
+                  f"{duplicates / (args.topics * args.top_k):>10.1%} {statistics.median(latencies) * 1000:>8.2f} "
+                  f"{p95 * 1000:>8.2f}")
+
+def lexical_hit_kept(top_k=3):
+    """
+    True when MMR keeps a hybrid hit that only BM25 found: near-identical
+    vector neighbours of the question must not push it out of top_k.
+    """
+    dim = 8
+    unit = np.eye(dim, dtype='float32')
+    # Vector neighbours at cosine 0.78-0.96 to the question and below 0.95 to
+    # each other, so none is deduplicated; the exact-term clause is orthogonal
+    vectors = [unit[0] + (0.3 + 0.1 * i) * unit[2 + i] for i in range(6)] + [unit[1]]
+    # Clause 5 shares one query term so BM25 has a second, weaker match
+    texts = ([f"General wording clause {i} on definitions." for i in range(5)]
+             + ["General wording of an endorsement.", "Endorsement zx4471 cancels cover."])
+    with tempfile.TemporaryDirectory() as tmp:
+        index = FaissIndex(dim, store_path=tmp)
+        index.add(np.stack(vectors), [{'text': t, 'clause_id': str(i), 'page': 1, 'file': 'policy.pdf'}
+                                      for i, t in enumerate(texts)])
+        clauses = retrieve_reranked(index, ["What does endorsement zx4471 do?"], unit[:1], top_k=top_k,
+                                    rerank='mmr', mode='hybrid')[0]
+    return '6' in [c['clause_id'] for c in clauses]
+
+if __name__ == '__main__':
+    main()
+    kept = lexical_hit_kept()
+    print(f"hybrid lexical-only hit kept by mmr: {'yes' if kept else 'NO'}")
+    sys.exit(0 if kept else 1)
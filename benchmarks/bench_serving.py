@@ -0,0 +1,128 @@
+"""
+Query throughput of `python webhook_api.py --workers N` as N grows.
+
+Starts benchmarks.mock_gemini (fast generation, so retrieval and request
+handling dominate) and the API with one writer process plus N query
+workers in a scratch directory, indexes a synthetic corpus through the
+writer, then keeps `--concurrency` clients posting /query for
+`--duration` seconds. Halfway through each run another document is
+uploaded, so the workers hot-swap to a new index version under load;
+errors are counted across the swap.
+
+    python -m benchmarks.bench_serving --workers 1,2,4 --concurrency 32 --duration 15
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_streaming import ROOT, free_port, wait_until_up
+
+def write_eml(path, name, paragraphs):
+    body = '\n\n'.join(f"Section {i}: under {name} the insured must give written notice within {i % 90 + 5} "
+                       f"days of any claim under clause {i}.1 and keep records for {i % 7 + 1} years."
+                       for i in range(paragraphs))
+    with open(path, 'w') as f:
+        f.write(f"From: a@example.com\nTo: b@example.com\nSubject: {name}\n\n{body}\n")
+
+async def load(url, concurrency, duration, swap_upload):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client(n):
+        nonlocal errors
+        async with httpx.AsyncClient(timeout=60) as http:
+            i = n
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await http.post(url + '/query', data={
+                        'question': f"How many days to give notice under clause {i % 1000}.1?"})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+                i += concurrency
+
+    async def swap():
+        await asyncio.sleep(duration / 2)
+        return await asyncio.to_thread(swap_upload)
+
+    start = time.perf_counter()
+    *_, swap_seconds = await asyncio.gather(*[client(n) for n in range(concurrency)], swap())
+    return latencies, errors, time.perf_counter() - start, swap_seconds
+
+def run(args, workers, tmp, env, first):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'webhook_api.py'), '--port', str(port),
+                               '--workers', str(workers)], cwd=tmp, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(url + '/health')
+        if first:
+            for i in range(args.documents):
+                path = os.path.join(tmp, f"policy{i}.eml")
+                write_eml(path, f"policy{i}", args.paragraphs)
+                with open(path, 'rb') as f:
+                    httpx.post(url + '/upload', files={'files': (f"policy{i}.eml", f)}, timeout=600).raise_for_status()
+
+        def swap_upload():
+            path = os.path.join(tmp, f"update{workers}.eml")
+            write_eml(path, f"update{workers}", 50)
+            start = time.perf_counter()
+            with open(path, 'rb') as f:
+                httpx.post(url + '/upload', files={'files': (os.path.basename(path), f)}, timeout=600).raise_for_status()
+            return time.perf_counter() - start
+
+        # Warm every worker's view and BM25/embedding paths before timing
+        for _ in range(4 * workers):
+            httpx.post(url + '/query', data={'question': 'warm up'}, timeout=60)
+        latencies, errors, elapsed, swap_seconds = asyncio.run(
+            load(url, args.concurrency, args.duration, swap_upload))
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else float('nan')
+    print(f"{workers:>7} {len(latencies) / elapsed:>8.1f} {statistics.median(latencies) * 1000:>9.1f} "
+          f"{p95 * 1000:>9.1f} {errors:>7} {swap_seconds:>9.2f}s")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--workers', default='1,2,4')
+    ap.add_argument('--concurrency', type=int, default=32)
+    ap.add_argument('--duration', type=float, default=15)
+    ap.add_argument('--documents', type=int, default=4)
+    ap.add_argument('--paragraphs', type=int, default=2000)
+    ap.add_argument('--generate-ms', type=float, default=5)
+    args = ap.parse_args()
+
+    mock_port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPATH=ROOT, GEMINI_API_KEY='mock', EMBEDDING_BACKEND='local',
+                   EMBEDDING_CACHE='0', ANSWER_CACHE='0', SEARCH_MODE=os.getenv('SEARCH_MODE', 'vector'),
+                   GEMINI_API_BASE=f"http://127.0.0.1:{mock_port}/v1beta")
+        mock = subprocess.Popen([
+            sys.executable, '-m', 'benchmarks.mock_gemini', '--port', str(mock_port),
+            '--first-token-ms', str(args.generate_ms), '--tokens', '1'
+        ], cwd=ROOT, env=env)
+        try:
+            wait_until_up(f"http://127.0.0.1:{mock_port}/docs")
+            print(f"{args.documents * args.paragraphs} clauses, {args.concurrency} concurrent clients, "
+                  f"{args.duration:.0f}s per run, {os.cpu_count()} CPUs")
+            print(f"{'workers':>7} {'QPS':>8} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7} {'swap':>10}")
+            for n, workers in enumerate(int(w) for w in args.workers.split(',')):
+                run(args, workers, tmp, env, first=n == 0)
+        finally:
+            mock.terminate()
+            mock.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Cold-start time and per-worker memory of FaissIndex with and without mmap.
+
+Builds a compacted store per index type, then starts N worker processes per
+mode that load it concurrently (like uvicorn workers) and report load time,
+RSS and PSS (proportional set size, which splits shared pages between
+processes). Each worker also searches a fixed query; mapped and read loads
+must return the same rows.
+
+    python -m benchmarks.bench_startup --rows 200000 --dim 768 --workers 4 --index-types flat,ivf_flat,ivf_pq
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+def read_memory_mb():
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                values[key.lower()] = int(rest.split()[0]) / 1024
+    return values
+
+def worker(store_path, dim, mmap, index_type):
+    from embedding import FaissIndex
+    start = time.perf_counter()
+    index = FaissIndex(dim, store_path=store_path, index_type=index_type, mmap=mmap)
+    found = index.search(np.random.default_rng(1).standard_normal(dim).astype('float32'), 5)
+    load_s = time.perf_counter() - start
+    print('ready', flush=True)
+    sys.stdin.readline()
+    print(json.dumps(dict(read_memory_mb(), load_s=load_s, active=index.active_type,
+                          hits=[c['clause_id'] for c in found])), flush=True)
+
+def build(store_path, rows, dim, index_type):
+    from embedding import FaissIndex
+    rng = np.random.default_rng(0)
+    index = FaissIndex(dim, store_path=store_path, index_type=index_type, mmap=False)
+    for start in range(0, rows, 10000):
+        n = min(10000, rows - start)
+        index.add(rng.standard_normal((n, dim)).astype('float32'), [
+            {'text': f"Section {i}: synthetic clause text " * 4, 'clause_id': f"bench.pdf_p{i}_b0", 'page': i, 'file': 'bench.pdf'}
+            for i in range(start, start + n)
+        ])
+    index.save()
+
+def run_mode(store_path, dim, mmap, workers, index_type):
+    cmd = [sys.executable, '-m', 'benchmarks.bench_startup', '--worker', store_path, '--dim', str(dim),
+           '--index-types', index_type]
+    if mmap:
+        cmd.append('--mmap')
+    procs = [subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True) for _ in range(workers)]
+    for p in procs:
+        p.stdout.readline()
+    reports = []
+    for p in procs:
+        p.stdin.write('\n')
+        p.stdin.flush()
+        reports.append(json.loads(p.stdout.readline()))
+        p.wait()
+    return reports
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=200000)
+    ap.add_argument('--dim', type=int, default=768)
+    ap.add_argument('--workers', type=int, default=4)
+    ap.add_argument('--index-types', default='flat,ivf_flat,ivf_pq')
+    ap.add_argument('--worker', help=argparse.SUPPRESS)
+    ap.add_argument('--mmap', action='store_true', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.worker:
+        return worker(args.worker, args.dim, args.mmap, args.index_types)
+
+    print(f"{args.rows} clauses x {args.dim} dims, {args.workers} workers")
+    print(f"{'index':>9} {'mode':>6} {'cold start s':>13} {'RSS MB/worker':>14} {'PSS MB/worker':>14}")
+    failed = False
+    for index_type in args.index_types.split(','):
+        with tempfile.TemporaryDirectory() as tmp:
+            store_path = os.path.join(tmp, 'store')
+            build(store_path, args.rows, args.dim, index_type)
+            hits = {}
+            for mmap in (False, True):
+                reports = run_mode(store_path, args.dim, mmap, args.workers, index_type)
+                hits[mmap] = {tuple(r['hits']) for r in reports}
+                print(f"{reports[0]['active']:>9} {'mmap' if mmap else 'read':>6} "
+                      f"{np.mean([r['load_s'] for r in reports]):13.2f} "
+                      f"{np.mean([r['rss'] for r in reports]):14.1f} {np.mean([r['pss'] for r in reports]):14.1f}")
+            if len(hits[False] | hits[True]) != 1:
+                print(f"{index_type}: mapped and read snapshots returned different results")
+                failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
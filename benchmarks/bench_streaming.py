@@ -0,0 +1,124 @@
+"""
+Time to first byte / first token of /query/stream against the full-response
+latency of /query.
+
+Starts benchmarks.mock_gemini and webhook_api as subprocesses (the API in a
+scratch directory, pointed at the mock through GEMINI_API_BASE), uploads a
+synthetic .eml document and times distinct questions on both endpoints.
+
+    python -m benchmarks.bench_streaming --queries 20 --first-token-ms 400 --token-ms 25
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_until_up(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+def write_eml(path, paragraphs):
+    body = '\n\n'.join(f"Section {i}: the insured must give written notice within {i + 5} days "
+                       f"of any claim under clause {i}.1." for i in range(paragraphs))
+    with open(path, 'w') as f:
+        f.write(f"From: a@example.com\nTo: b@example.com\nSubject: Policy\n\n{body}\n")
+
+def time_query(client, url, question):
+    start = time.perf_counter()
+    response = client.post(url + '/query', data={'question': question})
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+def time_stream(client, url, question):
+    """
+    Return (first byte, first token, complete) in seconds.
+    """
+    start = time.perf_counter()
+    first_byte = first_token = None
+    event = None
+    with client.stream('POST', url + '/query/stream', data={'question': question}) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            now = time.perf_counter() - start
+            if first_byte is None:
+                first_byte = now
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:') and event == 'token' and first_token is None:
+                first_token = now
+            elif line.startswith('data:') and event == 'error':
+                raise RuntimeError(line)
+    return first_byte, first_token, time.perf_counter() - start
+
+def summarize(label, values):
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+    print(f"{label:<24} p50 {statistics.median(values) * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--queries', type=int, default=20)
+    ap.add_argument('--paragraphs', type=int, default=200)
+    ap.add_argument('--first-token-ms', type=float, default=400)
+    ap.add_argument('--token-ms', type=float, default=25)
+    ap.add_argument('--tokens', type=int, default=60)
+    args = ap.parse_args()
+
+    mock_port, api_port = free_port(), free_port()
+    procs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPATH=ROOT, GEMINI_API_KEY='mock', EMBEDDING_BACKEND='gemini',
+                   GEMINI_API_BASE=f"http://127.0.0.1:{mock_port}/v1beta", ANSWER_CACHE='0')
+        try:
+            procs.append(subprocess.Popen([
+                sys.executable, '-m', 'benchmarks.mock_gemini', '--port', str(mock_port),
+                '--first-token-ms', str(args.first_token_ms), '--token-ms', str(args.token_ms),
+                '--tokens', str(args.tokens)
+            ], cwd=ROOT, env=env))
+            procs.append(subprocess.Popen([
+                sys.executable, '-m', 'uvicorn', 'webhook_api:app', '--port', str(api_port), '--log-level', 'warning'
+            ], cwd=tmp, env=env))
+            url = f"http://127.0.0.1:{api_port}"
+            wait_until_up(f"http://127.0.0.1:{mock_port}/docs")
+            wait_until_up(url + '/health')
+
+            eml = os.path.join(tmp, 'policy.eml')
+            write_eml(eml, args.paragraphs)
+            with httpx.Client(timeout=60) as client, open(eml, 'rb') as f:
+                client.post(url + '/upload', files={'files': ('policy.eml', f)}).raise_for_status()
+                questions = [f"How many days to give notice under clause {i}.1?" for i in range(2 * args.queries)]
+                full = [time_query(client, url, q) for q in questions[:args.queries]]
+                streamed = [time_stream(client, url, q) for q in questions[args.queries:]]
+        finally:
+            for p in procs:
+                p.terminate()
+                p.wait()
+
+    print(f"{args.queries} queries, mock first token {args.first_token_ms:.0f} ms + "
+          f"{args.tokens} tokens x {args.token_ms:.0f} ms")
+    summarize('/query complete', full)
+    summarize('/query/stream 1st byte', [s[0] for s in streamed])
+    summarize('/query/stream 1st token', [s[1] for s in streamed])
+    summarize('/query/stream complete', [s[2] for s in streamed])
+
+if __name__ == '__main__':
+    main()
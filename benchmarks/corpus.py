@@ -0,0 +1,111 @@
+"""
+Synthetic PDF / DOCX / EML corpora for benchmarks.
+
+Each document is a short policy wording: a title, `--sections` sections with
+a "Section N:" heading, filler sentences and one fact sentence giving a
+notice period that only this document and section contain, so generated
+questions have a single right clause. Output is deterministic for a seed
+(each document has its own random stream, so files can be written by
+several processes); formats are assigned round-robin.
+
+    python -m benchmarks.corpus --documents 10000 --formats pdf,docx,eml --workers 8 --out corpus/
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+WORDS = ('party breach notice cure contract policy premium insured claim liability '
+         'termination payment coverage period insurer written consent renewal').split()
+FORMATS = ('pdf', 'docx', 'eml')
+
+def _sentence(rng, words=16):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def document_text(doc, sections, rng):
+    """
+    (title, [(heading, [paragraphs])], [(question, days)]) of one document.
+    """
+    title = f"Policy Wording PW{doc:05d}"
+    body, questions = [], []
+    for s in range(1, sections + 1):
+        days = rng.randint(5, 365)
+        paragraphs = [_sentence(rng) for _ in range(3)]
+        paragraphs.insert(rng.randint(0, 3), f"Under policy PW{doc:05d} section {s}, the insured must give "
+                                             f"written notice of a claim within {days} days.")
+        body.append((f"Section {s}: {rng.choice(WORDS).capitalize()} and {rng.choice(WORDS)}", paragraphs))
+        questions.append((f"Within how many days must notice be given under policy PW{doc:05d} section {s}?", days))
+    return title, body, questions
+
+def write_pdf(path, title, body):
+    import fitz
+    pdf = fitz.open()
+    page, y = pdf.new_page(), 40
+    page.insert_textbox(fitz.Rect(50, y, 550, y + 24), title, fontsize=12)
+    y += 30
+    for heading, paragraphs in body:
+        for text, size in [(heading, 10)] + [(p, 9) for p in paragraphs]:
+            height = 14 * (len(text) // 90 + 1) + 4
+            if y + height > 800:
+                page, y = pdf.new_page(), 40
+            page.insert_textbox(fitz.Rect(50, y, 550, y + height), text, fontsize=size)
+            y += height + 6
+    pdf.save(path)
+    pdf.close()
+
+def write_docx(path, title, body):
+    import docx
+    document = docx.Document()
+    document.add_heading(title, level=1)
+    for heading, paragraphs in body:
+        document.add_paragraph(heading)
+        for text in paragraphs:
+            document.add_paragraph(text)
+    document.save(path)
+
+def write_eml(path, title, body):
+    text = '\n\n'.join(heading + '\n\n' + '\n\n'.join(paragraphs) for heading, paragraphs in body)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"From: underwriting@example.com\nTo: broker@example.com\nSubject: {title}\n\n{text}\n")
+
+WRITERS = {'pdf': write_pdf, 'docx': write_docx, 'eml': write_eml}
+
+def _write_document(directory, doc, fmt, sections, seed):
+    title, body, questions = document_text(doc, sections, random.Random(seed * 1000003 + doc))
+    path = os.path.join(directory, f"doc{doc:05d}.{fmt}")
+    WRITERS[fmt](path, title, body)
+    return path, questions
+
+def write_corpus(directory, documents, formats=FORMATS, sections=4, seed=0, workers=1):
+    """
+    Write `documents` files into directory. Returns (paths, questions) with
+    questions a list of (question, days) over all documents.
+    """
+    os.makedirs(directory, exist_ok=True)
+    jobs = [(directory, doc, formats[doc % len(formats)], sections, seed) for doc in range(documents)]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            written = list(pool.map(_write_document, *zip(*jobs), chunksize=32))
+    else:
+        written = [_write_document(*job) for job in jobs]
+    return [path for path, _ in written], [q for _, questions in written for q in questions]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--documents', type=int, default=100)
+    ap.add_argument('--formats', default=','.join(FORMATS))
+    ap.add_argument('--sections', type=int, default=4)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--out', default='corpus')
+    args = ap.parse_args()
+    start = time.perf_counter()
+    paths, questions = write_corpus(args.out, args.documents, args.formats.split(','), args.sections, args.seed,
+                                    args.workers)
+    size = sum(os.path.getsize(p) for p in paths)
+    print(f"{len(paths)} documents, {len(questions)} facts, {size / 2**20:.1f} MB in {args.out} "
+          f"({time.perf_counter() - start:.1f}s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Local stand-in for the Gemini REST API, for offline runs and benchmarks.
+
+Serves embedContent / batchEmbedContents (deterministic hashing embeddings)
+and generateContent / streamGenerateContent (a canned answer emitted token
+by token) with configurable latency, embedding size (--dim) and a fraction
+of calls (--error-rate) failed with --error-status, which the client
+retries. Point the app at it with GEMINI_API_BASE:
+
+    python -m benchmarks.mock_gemini --port 8001 --first-token-ms 400 --token-ms 25 --error-rate 0.01
+    GEMINI_API_BASE=http://127.0.0.1:8001/v1beta python webhook_api.py
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from embedding import get_local_embeddings
+
+CONFIG = {
+    'first_token_ms': 400.0,
+    'token_ms': 25.0,
+    'tokens': 60,
+    'embed_ms': 0.0,
+    'dim': 768,
+    'error_rate': 0.0,
+    'error_status': 503,
+}
+
+app = FastAPI(title="Mock Gemini API")
+
+def _answer_tokens(prompt):
+    # Echo the question back so answers differ per request
+    question = prompt.rsplit('Question:', 1)[-1].split('\n', 1)[0].split() or ['answer']
+    return [question[i % len(question)] + ' ' for i in range(CONFIG['tokens'])]
+
+def _candidate(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+def _prompt(body):
+    return ''.join(p.get('text', '') for c in body.get('contents', []) for p in c.get('parts', []))
+
+def _embed(texts):
+    return get_local_embeddings(texts, dim=CONFIG['dim']).tolist()
+
+@app.post("/v1beta/models/{target}")
+async def models(target: str, request: Request):
+    model, _, method = target.partition(':')
+    body = await request.json()
+    if random.random() < CONFIG['error_rate']:
+        return JSONResponse({"error": {"code": CONFIG['error_status'], "message": "Injected mock failure"}},
+                            status_code=CONFIG['error_status'])
+    if method in ('embedContent', 'batchEmbedContents'):
+        await asyncio.sleep(CONFIG['embed_ms'] / 1000)
+        if method == 'embedContent':
+            return {"embedding": {"values": _embed([_prompt({'contents': [body['content']]})])[0]}}
+        texts = [_prompt({'contents': [r['content']]}) for r in body['requests']]
+        return {"embeddings": [{"values": v} for v in _embed(texts)]}
+    if method == 'generateContent':
+        tokens = _answer_tokens(_prompt(body))
+        await asyncio.sleep((CONFIG['first_token_ms'] + CONFIG['token_ms'] * (len(tokens) - 1)) / 1000)
+        return _candidate(''.join(tokens))
+    if method == 'streamGenerateContent':
+        tokens = _answer_tokens(_prompt(body))
+
+        async def chunks():
+            await asyncio.sleep(CONFIG['first_token_ms'] / 1000)
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(CONFIG['token_ms'] / 1000)
+                yield f"data: {json.dumps(_candidate(token))}\r\n\r\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+    raise HTTPException(status_code=404, detail=f"Unsupported method: {method}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8001)
+    ap.add_argument('--first-token-ms', type=float, default=CONFIG['first_token_ms'])
+    ap.add_argument('--token-ms', type=float, default=CONFIG['token_ms'])
+    ap.add_argument('--tokens', type=int, default=CONFIG['tokens'])
+    ap.add_argument('--embed-ms', type=float, default=CONFIG['embed_ms'])
+    ap.add_argument('--dim', type=int, default=CONFIG['dim'])
+    ap.add_argument('--error-rate', type=float, default=CONFIG['error_rate'])
+    ap.add_argument('--error-status', type=int, default=CONFIG['error_status'])
+    ap.add_argument('--seed', type=int)
+    args = ap.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    CONFIG.update(first_token_ms=args.first_token_ms, token_ms=args.token_ms, tokens=args.tokens,
+                  embed_ms=args.embed_ms, dim=args.dim, error_rate=args.error_rate, error_status=args.error_status)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+End-to-end benchmark suite for webhook_api: ingestion throughput, query
+latency under concurrent load, startup time and memory.
+
+For each corpus size the suite writes a synthetic PDF/DOCX/EML corpus
+(benchmarks.corpus) and starts the API in a scratch directory against
+benchmarks.mock_gemini. The mock has configurable latency, embedding size
+and error rate. The suite then:
+- uploads the corpus in batches;
+- sends `--queries` questions from `--concurrency` clients, checking whether
+  the clause holding each answer was retrieved;
+- restarts the server on the same data to time startup and the first query.
+
+Memory is the server's resident set size, read from /proc on Linux. The
+JSON report (--out) is keyed by corpus size. --baseline prints every
+numeric change against an earlier report.
+
+    python -m benchmarks.suite --sizes 10,100,1000 --out report.json
+    python -m benchmarks.suite --sizes 10,100,1000 --error-rate 0.01 --baseline report.json --out new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmarks.bench_streaming import ROOT, free_port, wait_until_up
+from benchmarks.corpus import FORMATS, write_corpus
+
+def rss_bytes(pid):
+    """
+    (current, peak) resident set size of a process, or (None, None) off Linux.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Server:
+    """
+    webhook_api under uvicorn in a workspace directory, logging to server.log there.
+    """
+
+    def __init__(self, workspace, env):
+        self.workspace = workspace
+        self.env = env
+        self.process = None
+        self.url = None
+
+    def start(self):
+        port = free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        log = open(os.path.join(self.workspace, 'server.log'), 'a')
+        start = time.perf_counter()
+        self.process = subprocess.Popen([
+            sys.executable, '-m', 'uvicorn', 'webhook_api:app', '--port', str(port), '--log-level', 'warning'
+        ], cwd=self.workspace, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+        wait_until_up(self.url + '/health', timeout=120)
+        return time.perf_counter() - start
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    def rss(self):
+        return rss_bytes(self.process.pid)
+
+    def status(self):
+        return httpx.get(self.url + '/status', timeout=60).json()
+
+def gemini_retries(status):
+    return sum(m['retries'] for m in status['gemini']['methods'].values())
+
+def ingest(server, paths, batch, concurrency):
+    batches = [paths[i:i + batch] for i in range(0, len(paths), batch)]
+    retries_before = gemini_retries(server.status())
+
+    def upload(chunk):
+        files = [('files', (os.path.basename(p), open(p, 'rb'))) for p in chunk]
+        try:
+            response = httpx.post(server.url + '/upload', files=files, timeout=None)
+            response.raise_for_status()
+            return sum(response.json()['clauses'].values()), False
+        except httpx.HTTPError:
+            return 0, True
+        finally:
+            for _, (_, f) in files:
+                f.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(upload, batches))
+    elapsed = time.perf_counter() - start
+    size = sum(os.path.getsize(p) for p in paths)
+    clauses = sum(n for n, _ in results)
+    return {
+        'seconds': round(elapsed, 3),
+        'documents_per_s': round(len(paths) / elapsed, 2),
+        'clauses': clauses,
+        'clauses_per_s': round(clauses / elapsed, 2),
+        'mb_per_s': round(size / 2**20 / elapsed, 3),
+        'failed_batches': sum(failed for _, failed in results),
+        'gemini_retries': gemini_retries(server.status()) - retries_before,
+    }
+
+async def _query_load(url, questions, concurrency):
+    latencies, errors, hits = [], 0, 0
+    queue = list(reversed(questions))
+
+    async def client():
+        nonlocal errors, hits
+        async with httpx.AsyncClient(timeout=120) as http:
+            while queue:
+                question, days = queue.pop()
+                start = time.perf_counter()
+                try:
+                    response = await http.post(url + '/query', data={'question': question})
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                fact = f"within {days} days"
+                policy = question.split('policy ', 1)[1].split(' ', 1)[0]
+                hits += any(fact in c['text'] and policy in c['text'] for c in response.json()['relevant_clauses'])
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies, errors, hits, time.perf_counter() - start
+
+def query(server, questions, concurrency):
+    retries_before = gemini_retries(server.status())
+    for question, _ in questions[:concurrency]:
+        httpx.post(server.url + '/query', data={'question': question}, timeout=120)
+    latencies, errors, hits, elapsed = asyncio.run(_query_load(server.url, questions, concurrency))
+    return {
+        'queries': len(questions),
+        'concurrency': concurrency,
+        'qps': round(len(latencies) / elapsed, 2),
+        'p50_ms': ms(percentile(latencies, 0.5)),
+        'p90_ms': ms(percentile(latencies, 0.9)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(max(latencies) if latencies else None),
+        'errors': errors,
+        'retrieval_hit_rate': round(hits / len(latencies), 4) if latencies else None,
+        'gemini_retries': gemini_retries(server.status()) - retries_before,
+    }
+
+def run_size(args, documents, env, tmp):
+    corpus_dir = os.path.join(tmp, f"corpus{documents}")
+    workspace = os.path.join(tmp, f"workspace{documents}")
+    os.makedirs(workspace)
+    start = time.perf_counter()
+    paths, facts = write_corpus(corpus_dir, documents, args.formats.split(','), args.sections, args.seed,
+                                args.corpus_workers)
+    generated = time.perf_counter() - start
+    step = max(1, len(facts) // args.queries)
+    questions = (facts[::step] * (args.queries // max(1, len(facts[::step])) + 1))[:args.queries]
+
+    server = Server(workspace, env)
+    try:
+        boot = server.start()
+        idle_rss, _ = server.rss()
+        ingest_report = ingest(server, paths, args.upload_batch, args.upload_concurrency)
+        ingested_rss, ingest_peak = server.rss()
+        index_mb = server.status()['collections']['memory_mb']
+        query_report = query(server, questions, args.concurrency)
+        queried_rss, query_peak = server.rss()
+        server.stop()
+
+        ready = server.start()
+        start = time.perf_counter()
+        httpx.post(server.url + '/query', data={'question': questions[0][0]}, timeout=120).raise_for_status()
+        first_query = time.perf_counter() - start
+        restarted_rss, _ = server.rss()
+    finally:
+        server.stop()
+    return {
+        'documents': documents,
+        'corpus_mb': round(sum(os.path.getsize(p) for p in paths) / 2**20, 3),
+        'corpus_generation_s': round(generated, 3),
+        'ingest': ingest_report,
+        'query': query_report,
+        'startup': {
+            'empty_ready_s': round(boot, 3),
+            'ready_s': round(ready, 3),
+            'first_query_s': round(first_query, 3),
+        },
+        'memory': {
+            'idle_rss_mb': _mb(idle_rss),
+            'after_ingest_rss_mb': _mb(ingested_rss),
+            'ingest_peak_rss_mb': _mb(ingest_peak),
+            'after_queries_rss_mb': _mb(queried_rss),
+            'query_peak_rss_mb': _mb(query_peak),
+            'restarted_rss_mb': _mb(restarted_rss),
+            'index_estimate_mb': index_mb,
+        },
+    }
+
+def _mb(value):
+    return None if value is None else round(value / 2**20, 1)
+
+def flatten(report, prefix=''):
+    out = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[path] = value
+    return out
+
+def compare(baseline, report):
+    old, new = flatten(baseline['runs'], 'runs.'), flatten(report['runs'], 'runs.')
+    print(f"\nagainst {baseline.get('git_commit') or 'baseline'} ({baseline.get('created_at')})")
+    for key in sorted(set(old) & set(new)):
+        change = f"{(new[key] - old[key]) / old[key]:+.1%}" if old[key] else ''
+        print(f"{key:<50} {old[key]:>12} -> {new[key]:>12} {change:>8}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='10,100')
+    ap.add_argument('--formats', default=','.join(FORMATS))
+    ap.add_argument('--sections', type=int, default=4)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--corpus-workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--upload-batch', type=int, default=20)
+    ap.add_argument('--upload-concurrency', type=int, default=2)
+    ap.add_argument('--queries', type=int, default=200)
+    ap.add_argument('--concurrency', type=int, default=16)
+    ap.add_argument('--dim', type=int, default=768)
+    ap.add_argument('--embed-ms', type=float, default=20)
+    ap.add_argument('--first-token-ms', type=float, default=200)
+    ap.add_argument('--token-ms', type=float, default=5)
+    ap.add_argument('--tokens', type=int, default=20)
+    ap.add_argument('--error-rate', type=float, default=0.0)
+    ap.add_argument('--out', default='benchmark_report.json')
+    ap.add_argument('--baseline')
+    args = ap.parse_args()
+
+    report = {
+        'suite': 'lexiq-e2e',
+        'format': 1,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': vars(args),
+        'runs': {},
+    }
+    mock_port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPATH=ROOT, GEMINI_API_KEY='mock', EMBEDDING_BACKEND='gemini',
+                   GEMINI_API_BASE=f"http://127.0.0.1:{mock_port}/v1beta", EMBEDDING_CACHE='0', ANSWER_CACHE='0')
+        mock = subprocess.Popen([
+            sys.executable, '-m', 'benchmarks.mock_gemini', '--port', str(mock_port), '--dim', str(args.dim),
+            '--embed-ms', str(args.embed_ms), '--first-token-ms', str(args.first_token_ms),
+            '--token-ms', str(args.token_ms), '--tokens', str(args.tokens),
+            '--error-rate', str(args.error_rate), '--seed', str(args.seed)
+        ], cwd=ROOT, env=env)
+        try:
+            wait_until_up(f"http://127.0.0.1:{mock_port}/docs")
+            for documents in (int(s) for s in args.sizes.split(',')):
+                run = run_size(args, documents, env, tmp)
+                report['runs'][str(documents)] = run
+                i, q, s, m = run['ingest'], run['query'], run['startup'], run['memory']
+                print(f"{documents:>6} docs  ingest {i['documents_per_s']:>7.1f} docs/s {i['clauses_per_s']:>8.1f} "
+                      f"clauses/s | query {q['qps']:>6.1f} QPS p50 {q['p50_ms']} ms p99 {q['p99_ms']} ms "
+                      f"hits {q['retrieval_hit_rate']} errors {q['errors']} | ready {s['ready_s']}s "
+                      f"first query {s['first_query_s']}s | RSS {m['after_queries_rss_mb']} MB")
+        finally:
+            mock.terminate()
+            mock.wait()
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
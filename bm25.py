@@ -0,0 +1,127 @@
+import math
+import re
+from array import array
+
+import numpy as np
+
+# Keep clause numbers like "4.2.1" and amounts like "15" as single terms
+TOKEN_RE = re.compile(r'\d+(?:\.\d+)*|\w+')
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+class BM25Index:
+    """
+    Incremental inverted index with Okapi BM25 scoring. Documents are the
+    FaissIndex row numbers, added in order, so postings stay sorted and a
+    query scores into one dense array without any per-document dicts.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = array('i')
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, texts):
+        for text in texts:
+            doc_id = len(self.doc_lengths)
+            tokens = tokenize(text)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                posting = self.postings.get(token)
+                if posting is None:
+                    posting = self.postings[token] = (array('i'), array('i'))
+                posting[0].append(doc_id)
+                posting[1].append(tf)
+            self.doc_lengths.append(len(tokens))
+            self.total_length += len(tokens)
+
+    def memory_bytes(self):
+        """
+        Approximate size: 8 bytes per posting plus per-term overhead.
+        """
+        postings = sum(len(ids) for ids, _ in self.postings.values())
+        return 8 * postings + 200 * len(self.postings) + 4 * len(self.doc_lengths)
+
+    def scores(self, query):
+        """
+        Dense float32 BM25 scores for every document.
+        """
+        n = len(self.doc_lengths)
+        scores = np.zeros(n, dtype='float32')
+        if not n:
+            return scores
+        lengths = np.frombuffer(self.doc_lengths, dtype='int32')
+        avg_length = self.total_length / n or 1.0
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            ids = np.frombuffer(posting[0], dtype='int32')
+            tf = np.frombuffer(posting[1], dtype='int32').astype('float32')
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[ids] / avg_length)
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, top_k=5, exclude=None, include=None):
+        """
+        Return up to top_k (doc_id, score) pairs with a positive score, best first.
+        exclude is an array of doc ids never to return (deleted rows); include,
+        when given, the only doc ids that may be returned.
+        """
+        scores = self.scores(query)
+        if include is not None:
+            kept = np.zeros_like(scores)
+            include = include[include < len(scores)]
+            kept[include] = scores[include]
+            scores = kept
+        if exclude is not None and len(exclude):
+            scores[exclude[exclude < len(scores)]] = 0
+        k = min(top_k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(i), float(scores[i])) for i in top]
+
+def reciprocal_rank_fusion(rankings, weights, k=60):
+    """
+    Fuse several ranked id lists: score(id) = sum(weight / (k + rank)).
+    Returns ids ordered by fused score.
+    """
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        if not weight:
+            continue
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
+
+def _min_max(scores):
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    span = (high - low) or 1.0
+    return {k: (v - low) / span for k, v in scores.items()}
+
+def linear_fusion(score_maps, weights):
+    """
+    Fuse {id: score} maps (higher is better) by a weighted sum of min-max
+    normalised scores. Unlike RRF this keeps the margin of a decisive
+    exact-term match. Returns ids ordered by fused score.
+    """
+    fused = {}
+    for scores, weight in zip(score_maps, weights):
+        if not weight:
+            continue
+        for doc_id, score in _min_max(scores).items():
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight * score
+    return sorted(fused, key=fused.get, reverse=True)
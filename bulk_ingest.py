@@ -0,0 +1,279 @@
+"""
+Offline bulk ingestion: build a collection's index from a directory tree
+(or a manifest listing files) without going through the API.
+
+Files are hashed, then parsed and chunked across a process pool while
+earlier files are embedded in large batches. Chunks are appended to the
+FaissIndex --flush-clauses at a time, whole files per flush, so the index
+gets one segment per flush instead of one per file; at the end segments
+are merged and a faiss snapshot is written, so the result is ready to
+serve (and memory-map) as is.
+
+Each flush also records its files in the store's document registry, which
+is the checkpoint: running the same command again skips files already
+indexed from the same content, re-indexes changed ones and discards rows
+an interrupted run appended for files it never registered. Files are
+keyed by base name, as with /upload.
+
+The output directory has the layout of a collection (collection.json and
+store/). POST /collections/{name}/import hot-loads it into a running server
+that can see the same filesystem (--publish does that); the directory is
+moved into place.
+
+    python bulk_ingest.py contracts/ --collection contracts --out builds/contracts --publish http://localhost:8000
+    python bulk_ingest.py --manifest files.txt --out builds/contracts
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+import numpy as np
+
+from chunker import chunk_clauses
+from collection_manager import CONFIG_FILE, DEFAULT_COLLECTION, validate_collection_name
+from embedding import FaissIndex, aget_gemini_embeddings, embedding_model_name
+from gemini_client import close_gemini_client
+from ingest import SUPPORTED_EXTENSIONS, clause_hash, file_digest
+from parser import parse_file
+
+def find_documents(root):
+    """
+    Supported files under root, in a stable order.
+    """
+    paths = []
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        paths.extend(os.path.join(directory, f) for f in sorted(files) if f.lower().endswith(SUPPORTED_EXTENSIONS))
+    return paths
+
+def read_manifest(path):
+    """
+    File paths listed one per line, relative to the manifest's directory;
+    blank lines and # comments are skipped.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+def parse_document(path):
+    # Top-level so process pool workers can run it
+    clauses = list(chunk_clauses(parse_file(path)))
+    for c in clauses:
+        c['hash'] = clause_hash(c['text'])
+    return clauses
+
+class BulkIngester:
+    """
+    Builds the index of one collection directory from many files. One run
+    at a time per directory.
+    """
+
+    def __init__(self, out, index_type=None, search_mode=None, rerank=None, flush_clauses=5000, workers=None,
+                 codec=None, reduce_dim=None):
+        self.out = out
+        self.flush_clauses = flush_clauses
+        self.workers = workers or os.cpu_count() or 1
+        self.index = None
+        config_path = os.path.join(out, CONFIG_FILE)
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                self.config = json.load(f)
+            model = self.config.get('embedding_model')
+            if model and model != embedding_model_name():
+                raise ValueError(f"{out} was built with {model}, not {embedding_model_name()}; use a new --out")
+        else:
+            self.config = {'index_type': None, 'codec': None, 'reduce_dim': None, 'mmap': None, 'search_mode': None,
+                           'rerank': None, 'dim': None, 'created_at': time.time()}
+        settings = {'index_type': index_type, 'codec': codec, 'reduce_dim': reduce_dim, 'search_mode': search_mode,
+                    'rerank': rerank}
+        self.config.update({k: v for k, v in settings.items() if v is not None})
+        self.config['embedding_model'] = embedding_model_name()
+        self.counts = {'indexed': 0, 'skipped': 0, 'failed': 0, 'clauses': 0, 'discarded_rows': 0}
+        self.errors = {}
+
+    def _open_index(self, dim):
+        self.index = FaissIndex(dim, index_path=os.path.join(self.out, 'faiss.index'),
+                                meta_path=os.path.join(self.out, 'faiss_meta.pkl'),
+                                store_path=os.path.join(self.out, 'store'),
+                                index_type=self.config['index_type'], mmap=False, codec=self.config.get('codec'),
+                                reduce_dim=self.config.get('reduce_dim'))
+        self.config['dim'] = self.index.dim
+        self._write_config()
+
+    def _write_config(self):
+        os.makedirs(self.out, exist_ok=True)
+        tmp = os.path.join(self.out, CONFIG_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.config, f, indent=2)
+        os.replace(tmp, os.path.join(self.out, CONFIG_FILE))
+
+    def _discard_unregistered(self):
+        """
+        Tombstone rows of files an interrupted run appended but never registered.
+        """
+        names = [name for name in self.index.meta.file_counts if name not in self.index.documents]
+        if names:
+            self.counts['discarded_rows'] += self.index.delete_rows(
+                np.concatenate([self.index.live_rows_for_file(name) for name in names]))
+
+    def _write(self, files, embeddings, clauses):
+        """
+        Append one flush as a single segment, then register its files and
+        retire the rows of their previous versions in one manifest commit.
+        """
+        if clauses:
+            self.index.add(embeddings, clauses)
+        now = time.time()
+        # add() may start a vacuum that renumbers rows, so find the old ones
+        # under the same lock hold as the delete
+        with self.index.lock:
+            old_rows = [self.index.previous_rows(name, len(chunks)) for name, _, chunks in files]
+            self.index.delete_rows(np.concatenate(old_rows) if old_rows else np.zeros(0, dtype='int64'), documents={
+                name: {"hash": digest, "clauses": len(chunks), "indexed_at": now} for name, digest, chunks in files
+            })
+
+    async def _flush(self, files):
+        """
+        Embed and write the chunks of complete files. Returns the files that
+        could not be registered yet (only empty ones before the index exists).
+        """
+        clauses = [c for _, _, chunks in files for c in chunks]
+        embeddings = None
+        if clauses:
+            embeddings = await aget_gemini_embeddings([c['text'] for c in clauses])
+            if self.index is None:
+                await asyncio.to_thread(self._open_index, embeddings.shape[1])
+        if self.index is None:
+            return files
+        await asyncio.to_thread(self._write, files, embeddings, clauses)
+        self.counts['indexed'] += len(files)
+        self.counts['clauses'] += len(clauses)
+        return []
+
+    async def run(self, paths, progress=None):
+        """
+        Index paths into the output directory. Returns a summary with the
+        counts and per-file errors. progress(summary) is called after each flush.
+        """
+        start = time.perf_counter()
+        if self.config['dim']:
+            await asyncio.to_thread(self._open_index, self.config['dim'])
+            await asyncio.to_thread(self._discard_unregistered)
+        loop = asyncio.get_running_loop()
+        pending, in_flight = [], deque()
+
+        def summary():
+            elapsed = time.perf_counter() - start
+            return dict(self.counts, files=len(paths), seconds=round(elapsed, 2),
+                        clauses_per_second=round(self.counts['clauses'] / elapsed, 1) if elapsed else None,
+                        errors=self.errors)
+
+        async def collect():
+            nonlocal pending
+            path, name, digest, future = in_flight.popleft()
+            try:
+                pending.append((name, digest, await future))
+            except Exception as e:
+                self.errors[path] = str(e)
+                self.counts['failed'] += 1
+            if sum(len(chunks) for _, _, chunks in pending) >= self.flush_clauses:
+                pending = await self._flush(pending)
+                if progress:
+                    progress(summary())
+
+        names = set()
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for path in paths:
+                name = os.path.basename(path)
+                if name in names:
+                    self.errors[path] = f"Duplicate file name: {name}"
+                    self.counts['failed'] += 1
+                    continue
+                names.add(name)
+                try:
+                    digest = await asyncio.to_thread(file_digest, path)
+                except OSError as e:
+                    self.errors[path] = str(e)
+                    self.counts['failed'] += 1
+                    continue
+                if self.index is not None and self.index.document_hash(name) == digest:
+                    self.counts['skipped'] += 1
+                    continue
+                in_flight.append((path, name, digest, loop.run_in_executor(pool, parse_document, path)))
+                if len(in_flight) >= 2 * self.workers:
+                    await collect()
+            while in_flight:
+                await collect()
+        if pending:
+            await self._flush(pending)
+        if self.index is not None:
+            # Merge the segments and write the snapshot servers load
+            await asyncio.to_thread(self.index.save)
+            await asyncio.to_thread(self._write_config)
+        if progress:
+            progress(summary())
+        return summary()
+
+def publish(url, collection, out):
+    """
+    Ask the server at url to hot-load the build as collection. Returns its response.
+    """
+    response = httpx.post(f"{url.rstrip('/')}/collections/{collection}/import",
+                          data={'path': os.path.abspath(out)}, timeout=None)
+    if response.status_code >= 400:
+        raise RuntimeError(f"Import failed ({response.status_code}): {response.text}")
+    return response.json()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a collection index from a directory of documents")
+    parser.add_argument('source', nargs='?', help='directory searched recursively for PDF, DOCX and EML files')
+    parser.add_argument('--manifest', help='file listing the documents to ingest, one path per line')
+    parser.add_argument('--out', required=True, help='build directory (resumed if it exists)')
+    parser.add_argument('--collection', default=DEFAULT_COLLECTION, help='collection name used by --publish')
+    parser.add_argument('--index-type', help='FAISS index type (default FAISS_INDEX_TYPE)')
+    parser.add_argument('--codec', help='vector codes: float32, float16 or int8 (default FAISS_VECTOR_CODEC)')
+    parser.add_argument('--reduce-dim', type=int, help='index vectors reduced to this many dimensions')
+    parser.add_argument('--search-mode', help='default search mode stored in collection.json')
+    parser.add_argument('--rerank', help='default re-ranking stored in collection.json')
+    parser.add_argument('--workers', type=int, help='parse processes (default: CPU count)')
+    parser.add_argument('--flush-clauses', type=int, default=5000, help='chunks per embedding batch and segment')
+    parser.add_argument('--publish', metavar='URL', help='server to hot-load the build into when done')
+    args = parser.parse_args()
+    if not args.source and not args.manifest:
+        parser.error('give a source directory or --manifest')
+    validate_collection_name(args.collection)
+
+    paths = read_manifest(args.manifest) if args.manifest else find_documents(args.source)
+    ingester = BulkIngester(args.out, args.index_type, args.search_mode, args.rerank, args.flush_clauses,
+                            args.workers, args.codec, args.reduce_dim)
+
+    def progress(summary):
+        print(f"{summary['indexed'] + summary['skipped'] + summary['failed']}/{summary['files']} files, "
+              f"{summary['clauses']} chunks, {summary['clauses_per_second']} chunks/s", flush=True)
+
+    async def build():
+        try:
+            return await ingester.run(paths, progress)
+        finally:
+            await close_gemini_client()
+
+    summary = asyncio.run(build())
+    print(f"indexed {summary['indexed']}, skipped {summary['skipped']} unchanged, {summary['failed']} failed "
+          f"in {summary['seconds']}s")
+    for path, error in summary['errors'].items():
+        print(f"  {path}: {error}", file=sys.stderr)
+    if args.publish and ingester.index is not None:
+        result = publish(args.publish, args.collection, args.out)
+        print(f"published as {result['collection']}: {result['documents']} documents, {result['clauses']} chunks")
+    sys.exit(1 if summary['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
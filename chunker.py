@@ -0,0 +1,161 @@
+import os
+import re
+
+from utils import estimate_tokens, get_env_int
+
+# "Section 4:", "SECTION 4.2 -", "Article 7.", "Clause 12.1" or "4.2 Termination"
+HEADING_RE = re.compile(r'^\s*(?:(?:section|article|clause|part|schedule)\s+[\dIVXLC]+(?:\.\d+)*\b'
+                        r'|\d+(?:\.\d+)+\s+(?-i:[A-Z]))', re.IGNORECASE)
+# Page numbers, "Page 3 of 40", bare punctuation and common footer lines
+BOILERPLATE_RE = re.compile(r'^\s*(?:(?:page\s*)?\d+(?:\s*(?:of|/)\s*\d+)?|[\W_]*'
+                            r'|(?:©|\(c\)|copyright).*|.*all rights reserved\.?'
+                            r'|(?:strictly\s+)?(?:private\s+(?:and|&)\s+)?confidential\.?)\s*$', re.IGNORECASE)
+SENTENCE_RE = re.compile(r'(?<=[.;:!?])\s+')
+# Where a running header/footer carries its page number: line start/end or after "page"
+PAGE_NUMBER_RE = re.compile(r'^\d+\b|\b\d+$|(?<=page )\d+\b')
+
+class Chunker:
+    """
+    Turns parser output (one clause per PDF block / paragraph) into chunks
+    of about `target_tokens`. Small blocks are merged, oversized ones split
+    at sentence (then word) boundaries, and consecutive chunks of the same
+    section share `overlap_tokens` of text. A heading such as "Section 4:"
+    always starts a new chunk without overlap from the previous section.
+    Page numbers, copyright/confidentiality footers and short lines repeated
+    on `repeat_pages` or more pages (running headers) are dropped.
+
+    Chunks keep the parser's keys: clause_id and page come from the first
+    source clause (suffixed #2, #3... when a clause is split), and `sources`,
+    `page_end` and `section` record the rest of the provenance.
+
+    Streaming: feed() clauses of one file in order and collect the chunks it
+    returns, then finish().
+    """
+
+    def __init__(self, target_tokens=256, overlap_tokens=32, repeat_pages=3):
+        self.target_tokens = target_tokens
+        self.overlap_tokens = overlap_tokens
+        self.repeat_pages = repeat_pages
+        self.units = []
+        self.tokens = 0
+        self.section = None
+        self.short_lines = {}
+        self.id_counts = {}
+
+    def _is_boilerplate(self, clause):
+        text = clause['text']
+        tokens = estimate_tokens(text)
+        if tokens <= 30 and BOILERPLATE_RE.match(text):
+            return True
+        if tokens > 12 or clause.get('page') is None:
+            return False
+        # Headings can carry their own page number ("Section 3" on page 3) and
+        # would collapse to one masked key, so they never count as running headers
+        if HEADING_RE.match(text):
+            return False
+        # Running headers/footers: the same short line (its page number masked) on many pages
+        page = str(clause['page'])
+        key = PAGE_NUMBER_RE.sub(lambda m: '#' if m.group() == page else m.group(), ' '.join(text.lower().split()))
+        pages = self.short_lines.setdefault(key, set())
+        pages.add(clause['page'])
+        return len(pages) >= self.repeat_pages
+
+    def _split(self, text):
+        """
+        Sentence-sized pieces of at most target_tokens.
+        """
+        for sentence in SENTENCE_RE.split(text):
+            if estimate_tokens(sentence) <= self.target_tokens:
+                yield sentence
+                continue
+            words, piece = sentence.split(), []
+            for word in words:
+                piece.append(word)
+                if estimate_tokens(' '.join(piece)) >= self.target_tokens:
+                    yield ' '.join(piece)
+                    piece = []
+            if piece:
+                yield ' '.join(piece)
+
+    def _emit(self, overlap):
+        units = self.units
+        if not any(not u['overlap'] for u in units):
+            return []
+        parts, previous = [], None
+        for u in units:
+            parts.append(('\n' if previous is not None and u['source'] is not previous else ' ') + u['text'])
+            previous = u['source']
+        first = next(u['source'] for u in units if not u['overlap'])
+        count = self.id_counts.get(first['clause_id'], 0) + 1
+        self.id_counts[first['clause_id']] = count
+        chunk = {
+            'text': ''.join(parts).strip(),
+            'clause_id': first['clause_id'] if count == 1 else f"{first['clause_id']}#{count}",
+            'page': first.get('page'),
+            'file': first['file'],
+        }
+        sources = list(dict.fromkeys(u['source']['clause_id'] for u in units))
+        if len(sources) > 1:
+            chunk['sources'] = sources
+        last_page = units[-1]['source'].get('page')
+        if last_page is not None and last_page != chunk['page']:
+            chunk['page_end'] = last_page
+        if self.section:
+            chunk['section'] = self.section
+        self.units, self.tokens = [], 0
+        if overlap and self.overlap_tokens:
+            kept = []
+            for u in reversed(units):
+                if self.tokens + u['tokens'] > self.overlap_tokens:
+                    break
+                kept.append(dict(u, overlap=True))
+                self.tokens += u['tokens']
+            self.units = kept[::-1]
+        return [chunk]
+
+    def feed(self, clauses):
+        chunks = []
+        for clause in clauses:
+            if self._is_boilerplate(clause):
+                continue
+            heading = HEADING_RE.match(clause['text'])
+            if heading:
+                chunks.extend(self._emit(overlap=False))
+                self.units, self.tokens = [], 0
+                self.section = clause['text'].split('\n', 1)[0][:80]
+            for piece in self._split(clause['text']):
+                tokens = estimate_tokens(piece)
+                if self.tokens + tokens > self.target_tokens and any(not u['overlap'] for u in self.units):
+                    chunks.extend(self._emit(overlap=True))
+                self.units.append({'text': piece, 'tokens': tokens, 'source': clause, 'overlap': False})
+                self.tokens += tokens
+        return chunks
+
+    def finish(self):
+        return self._emit(overlap=False)
+
+def get_chunker():
+    """
+    A fresh Chunker for one file, configured from CHUNK_* settings.
+    Returns None when CHUNKING=0 (index parser blocks as-is).
+    """
+    if os.getenv('CHUNKING', '1') == '0':
+        return None
+    return Chunker(
+        target_tokens=get_env_int('CHUNK_TOKENS', 256),
+        overlap_tokens=get_env_int('CHUNK_OVERLAP', 32),
+        repeat_pages=get_env_int('CHUNK_REPEAT_PAGES', 3)
+    )
+
+def chunk_clauses(clauses, chunker=None):
+    """
+    Generator form for one file's clauses; passes them through unchanged
+    when chunking is disabled.
+    """
+    chunker = chunker or get_chunker()
+    if chunker is None:
+        yield from clauses
+        return
+    for clause in clauses:
+        yield from chunker.feed([clause])
+    yield from chunker.finish()
@@ -0,0 +1,297 @@
+import json
+import os
+import struct
+from array import array
+
+import numpy as np
+
+MAGIC = b'LEXIQCLS'
+ALIGN = 64
+CORE_KEYS = ('text', 'clause_id', 'page', 'file')
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def _encode_strings(values):
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype='int64')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype='uint8')
+
+def write_clause_columns(path, metas):
+    """
+    Write clause metadata in a columnar, memory-mappable layout:
+    a JSON header (file table + column offsets) followed by 64-byte aligned
+    arrays. Texts, clause ids and any non-core keys (as JSON) are stored as
+    one UTF-8 buffer plus int64 offsets; pages and file codes as int32.
+    """
+    files, file_codes = [], {}
+    codes = np.empty(len(metas), dtype='int32')
+    pages = np.empty(len(metas), dtype='int32')
+    texts, clause_ids, extras = [], [], []
+    for i, m in enumerate(metas):
+        code = file_codes.get(m['file'])
+        if code is None:
+            code = file_codes[m['file']] = len(files)
+            files.append(m['file'])
+        codes[i] = code
+        pages[i] = -1 if m.get('page') is None else m['page']
+        texts.append(m['text'])
+        clause_ids.append(m['clause_id'])
+        extra = {k: v for k, v in m.items() if k not in CORE_KEYS}
+        extras.append(json.dumps(extra, ensure_ascii=False) if extra else '')
+    text_offsets, text_data = _encode_strings(texts)
+    id_offsets, id_data = _encode_strings(clause_ids)
+    extra_offsets, extra_data = _encode_strings(extras)
+    arrays = {
+        'text_offsets': text_offsets, 'text_data': text_data,
+        'id_offsets': id_offsets, 'id_data': id_data,
+        'extra_offsets': extra_offsets, 'extra_data': extra_data,
+        'page': pages, 'file': codes,
+    }
+    columns, offset = {}, 0
+    for name, array in arrays.items():
+        columns[name] = [array.dtype.str, offset, len(array)]
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({"rows": len(metas), "files": files, "columns": columns}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + columns[name][1])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+
+class _ClauseRows:
+    """
+    Row access shared by the columnar clause containers. Subclasses provide
+    self.columns (text/id/extra offset+data pairs, page, file) and self.files.
+    """
+
+    def _string(self, column, i):
+        offsets = self.columns[column + '_offsets']
+        return bytes(self.columns[column + '_data'][offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+    def text(self, i):
+        return self._string('text', i)
+
+    def clause_id(self, i):
+        return self._string('id', i)
+
+    def page(self, i):
+        page = int(self.columns['page'][i])
+        return None if page < 0 else page
+
+    def file(self, i):
+        return self.files[self.columns['file'][i]]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        meta = {'text': self.text(i), 'clause_id': self.clause_id(i), 'page': self.page(i), 'file': self.file(i)}
+        extra = self._string('extra', i)
+        if extra:
+            meta.update(json.loads(extra))
+        return meta
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def file_codes(self):
+        return np.asarray(self.columns['file'], dtype='int32')
+
+    def pages(self):
+        return np.asarray(self.columns['page'], dtype='int32')
+
+    def memory_bytes(self):
+        """
+        Bytes held in process memory; memory-mapped columns are page cache
+        and not counted.
+        """
+        return sum(len(c) * getattr(c, 'itemsize', 1) for c in self.columns.values()
+                   if not isinstance(c, np.memmap))
+
+class ClauseColumns(_ClauseRows):
+    """
+    Read side of write_clause_columns. With mmap=True the arrays are views
+    of the page cache, so processes opening the same file share memory and
+    nothing is decoded until a row is accessed.
+    """
+
+    def __init__(self, path, mmap=True):
+        with open(path, 'rb') as f:
+            magic, header_len = f.read(len(MAGIC)), struct.unpack('<Q', f.read(8))[0]
+            if magic != MAGIC:
+                raise ValueError(f"Not a clause column file: {path}")
+            header = json.loads(f.read(header_len))
+        data_start = _align(len(MAGIC) + 8 + header_len)
+        self.rows = header['rows']
+        self.files = header['files']
+        self.columns = {}
+        for name, (dtype, offset, count) in header['columns'].items():
+            if count == 0:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+            elif mmap:
+                self.columns[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + offset, shape=(count,))
+            else:
+                self.columns[name] = np.fromfile(path, dtype=dtype, count=count, offset=data_start + offset)
+
+    def __len__(self):
+        return self.rows
+
+class ClauseBuffer(_ClauseRows):
+    """
+    Growable in-memory counterpart of ClauseColumns: typed arrays for pages
+    and interned file codes, one bytearray per string column plus offsets.
+    Roughly the size of the raw UTF-8 text instead of a dict per clause.
+    """
+
+    def __init__(self, metas=()):
+        self.files, self._file_codes = [], {}
+        self.columns = {'page': array('i'), 'file': array('i')}
+        for column in ('text', 'id', 'extra'):
+            self.columns[column + '_offsets'] = array('q', [0])
+            self.columns[column + '_data'] = bytearray()
+        self.extend(metas)
+
+    def __len__(self):
+        return len(self.columns['page'])
+
+    def _push(self, column, value):
+        data = self.columns[column + '_data']
+        data += value.encode('utf-8')
+        self.columns[column + '_offsets'].append(len(data))
+
+    def append(self, meta):
+        code = self._file_codes.get(meta['file'])
+        if code is None:
+            code = self._file_codes[meta['file']] = len(self.files)
+            self.files.append(meta['file'])
+        self.columns['file'].append(code)
+        self.columns['page'].append(-1 if meta.get('page') is None else meta['page'])
+        self._push('text', meta['text'])
+        self._push('id', meta['clause_id'])
+        extra = {k: v for k, v in meta.items() if k not in CORE_KEYS}
+        self._push('extra', json.dumps(extra, ensure_ascii=False) if extra else '')
+
+    def extend(self, metas):
+        for meta in metas:
+            self.append(meta)
+
+    def file_codes(self):
+        return np.frombuffer(self.columns['file'], dtype='int32') if len(self) else np.zeros(0, dtype='int32')
+
+    def pages(self):
+        return np.frombuffer(self.columns['page'], dtype='int32') if len(self) else np.zeros(0, dtype='int32')
+
+class ClauseStore:
+    """
+    Clause metadata for FaissIndex: an ordered list of columnar parts
+    (memory-mapped segment files, then an in-memory ClauseBuffer that takes
+    new rows). Indexing builds a dict only for the row asked for, so search
+    materialises just its top-k hits, and clauses per file are counted
+    incrementally instead of scanning the corpus.
+    """
+
+    def __init__(self, parts=None):
+        self.parts = [p if isinstance(p, _ClauseRows) else ClauseBuffer(p) for p in (parts or []) if len(p)]
+        if not self.parts or not isinstance(self.parts[-1], ClauseBuffer):
+            self.parts.append(ClauseBuffer())
+        self.starts = np.cumsum([0] + [len(p) for p in self.parts[:-1]])
+        self.file_counts = {}
+        for part in self.parts:
+            for code, count in enumerate(np.bincount(part.file_codes(), minlength=len(part.files))):
+                if count:
+                    name = part.files[code]
+                    self.file_counts[name] = self.file_counts.get(name, 0) + int(count)
+
+    @property
+    def tail(self):
+        return self.parts[-1]
+
+    def __len__(self):
+        return int(self.starts[-1]) + len(self.tail)
+
+    def extend(self, metas):
+        for meta in metas:
+            self.tail.append(meta)
+            self.file_counts[meta['file']] = self.file_counts.get(meta['file'], 0) + 1
+
+    def locate(self, i):
+        """
+        Return (part, row within part) for a global row number.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        part = int(np.searchsorted(self.starts, i, side='right')) - 1
+        return self.parts[part], i - int(self.starts[part])
+
+    def __getitem__(self, i):
+        part, row = self.locate(i)
+        return part[row]
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+    def rows_for_file(self, name):
+        """
+        Global row numbers of every clause of one file, in order.
+        """
+        rows = []
+        for start, part in zip(self.starts, self.parts):
+            if name in part.files:
+                codes = part.file_codes()
+                rows.append(np.flatnonzero(codes == part.files.index(name)) + int(start))
+        return np.concatenate(rows).astype('int64') if rows else np.zeros(0, dtype='int64')
+
+    def rows_matching(self, names, pages=None):
+        """
+        Global row numbers of the clauses of the given files, in order; with
+        pages (first, last), only those on pages first..last inclusive
+        (either end None). Clauses without a page never match a range.
+        """
+        rows = []
+        for start, part in zip(self.starts, self.parts):
+            codes = [code for code, name in enumerate(part.files) if name in names]
+            if not codes:
+                continue
+            mask = np.isin(part.file_codes(), codes)
+            if pages is not None:
+                first, last = pages
+                page = part.pages()
+                mask &= page >= (0 if first is None else first)
+                if last is not None:
+                    mask &= page <= last
+            rows.append(np.flatnonzero(mask) + int(start))
+        return np.concatenate(rows).astype('int64') if rows else np.zeros(0, dtype='int64')
+
+    def discount(self, rows):
+        """
+        Drop deleted rows from the per-file clause counts.
+        """
+        for i in rows:
+            part, row = self.locate(int(i))
+            name = part.file(row)
+            self.file_counts[name] -= 1
+            if not self.file_counts[name]:
+                del self.file_counts[name]
+
+    def memory_bytes(self):
+        return sum(part.memory_bytes() for part in self.parts)
+
+    def texts(self):
+        for part in self.parts:
+            for i in range(len(part)):
+                yield part.text(i)
+
+    @property
+    def document_count(self):
+        return len(self.file_counts)
@@ -0,0 +1,512 @@
+import faiss
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process serving only
+    fcntl = None
+
+from embedding import FaissIndex, SEARCH_MODES, embedding_model_name
+from index_factory import INDEX_TYPES, VECTOR_CODECS
+from ingest import IndexWriter
+from rerank import RERANK_MODES
+from segment_store import MANIFEST
+from utils import get_env_float, get_env_int
+
+DEFAULT_COLLECTION = 'default'
+COLLECTION_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+CONFIG_FILE = 'collection.json'
+COLLECTION_BUSY = "Collection is being written to"
+COLLECTION_EXISTS = "Collection already exists"
+
+def validate_collection_name(name):
+    if not COLLECTION_NAME_RE.match(name or '') or name in ('.', '..'):
+        raise ValueError(f"Invalid collection name: {name!r} (letters, digits, '_', '-' and '.', up to 64)")
+    return name
+
+class CollectionManager:
+    """
+    Named collections, each with its own FaissIndex (segment store, clause
+    metadata) and collection.json config (index_type, codec, reduce_dim,
+    mmap, search_mode, rerank),
+    stored under COLLECTIONS_DIR/<name>/. 'default' keeps the original
+    faiss_store/ location so existing data stays in place.
+
+    Collections are opened on first use. When the loaded ones exceed
+    COLLECTIONS_MAX_MEMORY_MB, the least recently used collections that are
+    idle (no request or ingestion holding them via using(), no compaction
+    running) are unloaded; their data stays on disk and loads again on the
+    next request. Each collection has its own IndexWriter.
+
+    With read_only=True (query workers of a multi-process server) indexes
+    are opened as memory-mapped read-only views and nothing is written; the
+    writer process owns all changes. A watcher thread notices when a loaded
+    collection's manifest is replaced, opens a fresh view off the query
+    path and swaps it in. Requests already holding the old view finish on
+    it, so queries never wait for a reload.
+    """
+
+    def __init__(self, root=None, memory_budget_mb=None, read_only=False):
+        self.root = root or os.getenv('COLLECTIONS_DIR', 'collections')
+        if memory_budget_mb is None:
+            memory_budget_mb = get_env_int('COLLECTIONS_MAX_MEMORY_MB', 2048)
+        self.memory_budget = memory_budget_mb * 2**20
+        self.loaded = OrderedDict()  # least recently used first
+        self.in_use = {}
+        self.writers = {}
+        self.load_locks = {}
+        self.configs = {}
+        self.read_only = read_only
+        self.stamps = {}
+        self.lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+        self.swaps = 0
+        self.refresh_errors = 0
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        self._writer_lock = None
+
+    def _dir(self, name):
+        return os.path.join(self.root, validate_collection_name(name))
+
+    def _index_paths(self, name):
+        if name == DEFAULT_COLLECTION:
+            return {}
+        path = self._dir(name)
+        return {
+            'index_path': os.path.join(path, 'faiss.index'),
+            'meta_path': os.path.join(path, 'faiss_meta.pkl'),
+            'store_path': os.path.join(path, 'store'),
+        }
+
+    def config(self, name):
+        config = self.configs.get(name)
+        if config is None:
+            path = os.path.join(self._dir(name), CONFIG_FILE)
+            if not os.path.exists(path):
+                return {}
+            with open(path) as f:
+                config = self.configs[name] = json.load(f)
+        return config
+
+    def _write_config(self, name, config):
+        path = self._dir(name)
+        os.makedirs(path, exist_ok=True)
+        tmp = os.path.join(path, CONFIG_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(config, f, indent=2)
+        os.replace(tmp, os.path.join(path, CONFIG_FILE))
+        self.configs[name] = config
+
+    def exists(self, name):
+        if os.path.exists(os.path.join(self._dir(name), CONFIG_FILE)):
+            return True
+        return name == DEFAULT_COLLECTION and self._stored_dim(name) is not None
+
+    def _stored_dim(self, name):
+        """
+        Vector dimension of data already on disk (segment manifest or a
+        legacy faiss.index), else None.
+        """
+        paths = self._index_paths(name)
+        manifest = os.path.join(paths.get('store_path', 'faiss_store'), MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                dim = json.load(f)['dim']
+            if dim:
+                return dim
+        legacy = paths.get('index_path', 'faiss.index')
+        if os.path.exists(legacy):
+            return faiss.read_index(legacy, faiss.IO_FLAG_MMAP).d
+        return None
+
+    def _manifest_stamp(self, name):
+        """
+        Identity of the current manifest file (replaced atomically on every
+        commit), or None if the collection has no store.
+        """
+        path = os.path.join(self._index_paths(name).get('store_path', 'faiss_store'), MANIFEST)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def create(self, name, index_type=None, mmap=None, search_mode=None, rerank=None, codec=None, reduce_dim=None):
+        """
+        Register a collection and its config; its index is created by the
+        first upload. Raises ValueError for a bad name or setting and
+        FileExistsError if the collection exists.
+        """
+        if self.read_only:
+            raise RuntimeError("Collections are created by the writer process")
+        validate_collection_name(name)
+        if index_type is not None and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index_type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+        if search_mode is not None and search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unsupported search_mode: {search_mode}")
+        if rerank is not None and rerank not in RERANK_MODES:
+            raise ValueError(f"Unsupported rerank: {rerank}")
+        if codec is not None and codec not in VECTOR_CODECS:
+            raise ValueError(f"Unsupported codec: {codec} (expected one of {', '.join(VECTOR_CODECS)})")
+        if reduce_dim is not None and reduce_dim < 0:
+            raise ValueError(f"Invalid reduce_dim: {reduce_dim}")
+        with self.lock:
+            if self.exists(name):
+                raise FileExistsError(f"{COLLECTION_EXISTS}: {name}")
+            config = {'index_type': index_type, 'codec': codec, 'reduce_dim': reduce_dim, 'mmap': mmap,
+                      'search_mode': search_mode, 'rerank': rerank, 'dim': None, 'created_at': time.time()}
+            self._write_config(name, config)
+            return config
+
+    def list(self):
+        names = set()
+        if os.path.isdir(self.root):
+            names.update(n for n in os.listdir(self.root)
+                         if os.path.exists(os.path.join(self.root, n, CONFIG_FILE)))
+        if self.exists(DEFAULT_COLLECTION):
+            names.add(DEFAULT_COLLECTION)
+        with self.lock:
+            loaded = set(self.loaded)
+        return [{'name': n, 'loaded': n in loaded, **self.config(n)} for n in sorted(names)]
+
+    def get(self, name, dim=None):
+        """
+        The collection's FaissIndex, loading it if needed. An unknown
+        collection is created when dim is given, otherwise None is returned.
+        """
+        with self.lock:
+            index = self.loaded.get(name)
+            if index is not None:
+                self.loaded.move_to_end(name)
+                return index
+            load_lock = self.load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            with self.lock:
+                index = self.loaded.get(name)
+            if index is None:
+                index = self._open(name, dim)
+                if index is None:
+                    return None
+                with self.lock:
+                    self.loaded[name] = index
+                    self.loads += 1
+        self.enforce_budget(keep=name)
+        return index
+
+    def _open(self, name, dim):
+        if self.read_only:
+            return self._open_view(name)
+        exists = self.exists(name)
+        if not exists and dim is None:
+            return None
+        config = self.config(name)
+        dim = dim or config.get('dim') or self._stored_dim(name)
+        if dim is None:
+            # Registered but never written to
+            return None
+        index = FaissIndex(dim, index_type=config.get('index_type'), mmap=config.get('mmap'),
+                           codec=config.get('codec'), reduce_dim=config.get('reduce_dim'), **self._index_paths(name))
+        if not exists or config.get('dim') != index.dim:
+            defaults = {'index_type': None, 'mmap': None, 'search_mode': None, 'created_at': time.time()}
+            self._write_config(name, {**defaults, **config, 'dim': index.dim})
+        return index
+
+    def _open_view(self, name, attempts=3):
+        # Stamp first: a commit landing during the open is picked up next poll
+        stamp = self._manifest_stamp(name)
+        if stamp is None:
+            return None
+        for attempt in range(attempts):
+            try:
+                dim = self.config(name).get('dim') or self._stored_dim(name)
+                if dim is None:
+                    return None
+                config = self.config(name)
+                index = FaissIndex(dim, index_type=config.get('index_type'), mmap=True, read_only=True,
+                                   codec=config.get('codec'), reduce_dim=config.get('reduce_dim'),
+                                   **self._index_paths(name))
+                break
+            except FileNotFoundError:
+                # The writer removed files of the manifest we read; read the new one
+                if attempt == attempts - 1:
+                    raise
+                stamp = self._manifest_stamp(name)
+        with self.lock:
+            self.stamps[name] = stamp
+        return index
+
+    def refresh(self, name):
+        """
+        Read-only mode: swap in a fresh view if the collection changed on
+        disk (unload it if it was dropped). Returns True if anything changed.
+        """
+        with self.lock:
+            old = self.loaded.get(name)
+            load_lock = self.load_locks.setdefault(name, threading.Lock())
+        if old is None or self._manifest_stamp(name) == self.stamps.get(name):
+            return False
+        with load_lock:
+            with self.lock:
+                # An import may have replaced the config along with the data
+                self.configs.pop(name, None)
+            view = self._open_view(name)
+            if view is None:
+                self.unload(name)
+                with self.lock:
+                    self.configs.pop(name, None)
+                return True
+            if old.bm25 is not None:
+                # Keep lexical queries off the rebuild path
+                view.build_lexical_index()
+            with self.lock:
+                if name in self.loaded:
+                    self.loaded[name] = view
+                    self.swaps += 1
+        self.enforce_budget()
+        return True
+
+    def start_watcher(self, interval=None):
+        """
+        Poll loaded collections every INDEX_REFRESH_INTERVAL seconds and
+        hot-swap the ones whose manifest changed.
+        """
+        if self._watcher is not None:
+            return
+        interval = interval or get_env_float('INDEX_REFRESH_INTERVAL', 0.5)
+
+        def watch():
+            while not self._stop_watching.wait(interval):
+                with self.lock:
+                    names = list(self.loaded)
+                for name in names:
+                    try:
+                        self.refresh(name)
+                    except Exception:
+                        # Keep serving the current view; retried on the next poll
+                        self.refresh_errors += 1
+
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def acquire_writer_lock(self):
+        """
+        Take the exclusive lock that makes this process the only writer of
+        the collections under root. Raises RuntimeError if another process
+        holds it.
+        """
+        if fcntl is None or self._writer_lock is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        handle = open(os.path.join(self.root, '.writer.lock'), 'w')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            raise RuntimeError(f"Another process is already writing to {self.root}; start extra workers "
+                               f"with `python webhook_api.py --workers N` (INDEX_ROLE=reader) instead")
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._writer_lock = handle
+
+    def writer(self, name):
+        """
+        The IndexWriter that owns writes to this collection.
+        """
+        validate_collection_name(name)
+        with self.lock:
+            writer = self.writers.get(name)
+            if writer is None:
+                writer = self.writers[name] = IndexWriter(lambda dim: self.get(name, dim))
+            return writer
+
+    @contextmanager
+    def using(self, name):
+        """
+        Pin a collection in memory for the duration of a request or ingestion.
+        """
+        validate_collection_name(name)
+        with self.lock:
+            self.in_use[name] = self.in_use.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_use[name] -= 1
+                if not self.in_use[name]:
+                    del self.in_use[name]
+            self.enforce_budget()
+
+    def enforce_budget(self, keep=None):
+        """
+        Unload least recently used idle collections until the loaded ones
+        fit the memory budget (or only busy ones are left).
+        """
+        with self.lock:
+            sizes = {name: index.memory_bytes() for name, index in self.loaded.items()}
+            total = sum(sizes.values())
+            for name in list(self.loaded):
+                if total <= self.memory_budget:
+                    break
+                if name == keep or name in self.in_use or self.loaded[name].compacting:
+                    continue
+                del self.loaded[name]
+                total -= sizes[name]
+                self.evictions += 1
+
+    def unload(self, name):
+        with self.lock:
+            self.stamps.pop(name, None)
+            return self.loaded.pop(name, None) is not None
+
+    def drop(self, name):
+        """
+        Unload a collection and delete its data from disk.
+        """
+        self._delete(name, keep_config=False)
+
+    def clear(self, name):
+        """
+        Unload a collection and delete its indexed data, keeping its settings
+        (index type, codec, search mode...) for the next upload.
+        """
+        self._delete(name, keep_config=True)
+
+    def _delete(self, name, keep_config):
+        if self.read_only:
+            raise RuntimeError("Collections are dropped by the writer process")
+        with self.lock:
+            if name in self.in_use:
+                raise RuntimeError(f"Collection is busy: {name}")
+            index = self.loaded.pop(name, None)
+            self.stamps.pop(name, None)
+        if index is not None:
+            index.wait_for_compaction()
+        config = self.config(name)
+        self.configs.pop(name, None)
+        if name == DEFAULT_COLLECTION:
+            for path in ('faiss_store', 'faiss.index', 'faiss_meta.pkl'):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+        if not keep_config or not config:
+            shutil.rmtree(self._dir(name), ignore_errors=True)
+            return
+        for path in self._index_paths(name).values():
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        # Without a dim the collection counts as never written to until the next upload
+        self._write_config(name, {k: v for k, v in config.items() if k != 'dim'})
+
+    def _build_path(self, path):
+        """
+        Resolved build directory, which must lie under BULK_BUILD_DIR and
+        hold no collection data (imports move and delete it).
+        """
+        builds = os.path.realpath(os.getenv('BULK_BUILD_DIR', 'builds'))
+        resolved = os.path.realpath(path)
+        inside = lambda child, parent: os.path.commonpath([child, parent]) == parent
+        if resolved == builds or not inside(resolved, builds):
+            raise ValueError(f"Build directories must be under BULK_BUILD_DIR ({builds}): {path}")
+        for data in (os.path.realpath(self.root), os.path.realpath('faiss_store')):
+            if inside(resolved, data) or inside(data, resolved):
+                raise ValueError(f"Not a build directory, it holds collection data: {path}")
+        return resolved
+
+    def import_build(self, name, path):
+        """
+        Replace a collection's data with a directory written by bulk_ingest.py
+        (collection.json and store/), load it and return its index. The store
+        is moved into place, so the build directory is consumed; it must be
+        under BULK_BUILD_DIR. Requests already holding the old index finish
+        on it; read-only workers swap to the new store through the watcher.
+        Raises ValueError for an invalid build and RuntimeError if the
+        collection is being written to.
+        """
+        if self.read_only:
+            raise RuntimeError("Collections are imported by the writer process")
+        validate_collection_name(name)
+        path = self._build_path(path)
+        store = os.path.join(path, 'store')
+        if not os.path.exists(os.path.join(path, CONFIG_FILE)) or not os.path.exists(os.path.join(store, MANIFEST)):
+            raise ValueError(f"Not a bulk_ingest build directory: {path}")
+        with open(os.path.join(path, CONFIG_FILE)) as f:
+            config = json.load(f)
+        model = config.get('embedding_model')
+        if model and model != embedding_model_name():
+            raise ValueError(f"Build was embedded with {model}, this server uses {embedding_model_name()}")
+        with self.lock:
+            writer = self.writers.get(name)
+            if writer is not None and writer.busy:
+                raise RuntimeError(f"{COLLECTION_BUSY}: {name}")
+            load_lock = self.load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            with self.lock:
+                old = self.loaded.pop(name, None)
+                self.stamps.pop(name, None)
+            if old is not None:
+                old.wait_for_compaction()
+            target = os.path.abspath(self._index_paths(name).get('store_path', 'faiss_store'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Stage next to the target (copying across filesystems) so the swap is two renames
+            staging = tempfile.mkdtemp(prefix='.import-', dir=os.path.dirname(target))
+            try:
+                shutil.move(store, os.path.join(staging, 'store'))
+                retired = f"{target}.retired-{uuid.uuid4().hex[:8]}"
+                if os.path.exists(target):
+                    os.rename(target, retired)
+                os.rename(os.path.join(staging, 'store'), target)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+            with self.lock:
+                self._write_config(name, dict(config, imported_at=time.time()))
+            shutil.rmtree(retired, ignore_errors=True)
+            shutil.rmtree(path, ignore_errors=True)
+        return self.get(name)
+
+    async def stop(self):
+        for writer in list(self.writers.values()):
+            await writer.stop()
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+        if self._writer_lock is not None:
+            self._writer_lock.close()
+            self._writer_lock = None
+
+    def loaded_indexes(self):
+        """
+        (name, index) of the collections currently in memory.
+        """
+        with self.lock:
+            return list(self.loaded.items())
+
+    def stats(self):
+        with self.lock:
+            loaded = {name: round(index.memory_bytes() / 2**20, 2) for name, index in self.loaded.items()}
+            return {
+                'loaded': len(loaded),
+                'memory_mb': round(sum(loaded.values()), 2),
+                'memory_budget_mb': round(self.memory_budget / 2**20, 2),
+                'read_only': self.read_only,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'swaps': self.swaps,
+                'refresh_errors': self.refresh_errors,
+                'collections_mb': loaded,
+            }
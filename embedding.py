@@ -1,58 +1,986 @@
+import asyncio
 import faiss
+import hashlib
 import numpy as np
 import os
 import pickle
-import requests
-from utils import get_gemini_api_key
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from bm25 import BM25Index, linear_fusion, reciprocal_rank_fusion
+from embedding_cache import get_embedding_cache
+from gemini_client import get_gemini_client
+from metrics import span
+from index_factory import (build_index, empty_flat_like, get_index_type, get_reduction, get_vector_codec, index_spec,
+                           index_memory_bytes, index_type_of, needs_training, min_training_rows, search_params,
+                           set_search_params, spec_of, train_index)
+from segment_store import SegmentStore
+from utils import get_embedding_backend, get_search_mode, get_env_float, get_env_int, estimate_tokens
+
+SEARCH_MODES = ('vector', 'lexical', 'hybrid')
+
+def search_filter(files=None, pages=None, doc_types=None, uploaded_after=None, uploaded_before=None):
+    """
+    Restriction for FaissIndex searches, or None when nothing is restricted.
+    files are base names, pages an inclusive (first, last) range with
+    either end None, doc_types file extensions ('pdf', '.docx') and the
+    upload bounds epoch seconds (after inclusive, before exclusive),
+    compared with the document registry's indexed_at.
+    """
+    filters = {}
+    if files:
+        filters['files'] = frozenset(files)
+    if pages is not None and any(p is not None for p in pages):
+        first, last = pages
+        if first is not None and last is not None and first > last:
+            raise ValueError(f"Empty page range: {first}-{last}")
+        filters['pages'] = (first, last)
+    if doc_types:
+        filters['doc_types'] = frozenset('.' + t.lower().lstrip('.') for t in doc_types)
+    if uploaded_after is not None:
+        filters['uploaded_after'] = float(uploaded_after)
+    if uploaded_before is not None:
+        filters['uploaded_before'] = float(uploaded_before)
+    return filters or None
+
+def _no_hits(queries, top_k):
+    return np.full((queries, top_k), np.inf, dtype='float32'), np.full((queries, top_k), -1, dtype='int64')
+
+def _merge_hits(D1, I1, D2, I2, top_k):
+    """
+    Best top_k of two (distances, ids) result sets per query.
+    """
+    D, I = np.hstack([D1, D2]), np.hstack([I1, I2])
+    order = np.argsort(D, axis=1, kind='stable')[:, :top_k]
+    return np.take_along_axis(D, order, 1), np.take_along_axis(I, order, 1)
 
 class FaissIndex:
-    def __init__(self, dim, index_path='faiss.index', meta_path='faiss_meta.pkl'):
+    """
+    FAISS index persisted through a SegmentStore: add() appends a segment
+    instead of rewriting the whole index, and a background compactor merges
+    segments and refreshes the faiss snapshot. A legacy faiss.index /
+    faiss_meta.pkl pair is imported into the store on first open.
+
+    index_type (default FAISS_INDEX_TYPE) selects flat, ivf_flat, ivf_pq or
+    hnsw. Types that need training serve from an exact flat index until
+    enough vectors exist; the compactor then builds the target index from
+    the stored vectors and swaps it in.
+
+    With mmap=True (default FAISS_MMAP=0) the faiss snapshot and columnar
+    metadata are memory-mapped read-only, so startup does not copy the
+    corpus and uvicorn workers share the same pages. Rows added after the
+    snapshot live in a small in-memory delta index searched alongside it.
+
+    Deleting rows (delete_rows / delete_document) tombstones them: searches
+    exclude them through a faiss IDSelector, which works for every index
+    type including HNSW and read-only mapped snapshots, so nothing is
+    rebuilt. Once FAISS_VACUUM_RATIO of the rows are deleted the compactor
+    rewrites the segments without them and reloads.
+
+    codec (default FAISS_VECTOR_CODEC) float16 / int8 keeps scalar-quantized
+    codes in the index, and reduce_dim (default FAISS_REDUCE_DIM) indexes
+    vectors reduced by FAISS_REDUCTION (pca or truncate) to that many
+    dimensions. The segments always keep the full float32 vectors: with
+    FAISS_RESCORE_FACTOR > 1 a lossy index returns that many times top_k
+    candidates, which are re-ranked by exact distance to their stored
+    vectors. Layouts that need training are adopted like index types.
+
+    Searches take an optional search_filter() (files, page range, document
+    types, upload dates): the matching live rows become an ID selector
+    inside the index search, and every query gets min(top_k, matching rows)
+    hits; small filters are scanned exactly from the stored vectors.
+
+    read_only=True opens a view of a store that another process writes
+    (see CollectionManager): it never imports, compacts or writes, and
+    add/delete raise. Such views are immutable; readers pick up new data
+    by opening a fresh view.
+    """
+
+    def __init__(self, dim, index_path='faiss.index', meta_path='faiss_meta.pkl', store_path=None,
+                 index_type=None, mmap=None, read_only=False, codec=None, reduce_dim=None):
         self.dim = dim
+        self.index_type = index_type or get_index_type()
+        self.codec = codec or get_vector_codec()
+        self.reduction = get_reduction()
+        self.reduce_dim = get_env_int('FAISS_REDUCE_DIM', 0) if reduce_dim is None else reduce_dim
+        self.rescore_factor = get_env_int('FAISS_RESCORE_FACTOR', 0)
+        self.rescored = 0
+        self.rescore_skipped = 0
+        self.filtered = 0
+        self.filter_exact = 0
+        self.exhaustive_retries = 0
+        self.mmap = os.getenv('FAISS_MMAP', '0') == '1' if mmap is None else mmap
         self.index_path = index_path
         self.meta_path = meta_path
-        if os.path.exists(index_path) and os.path.exists(meta_path):
-            self.index = faiss.read_index(index_path)
-            with open(meta_path, 'rb') as f:
-                self.meta = pickle.load(f)
-        else:
-            self.index = faiss.IndexFlatL2(dim)
-            self.meta = []
+        self.read_only = read_only
+        self.store = SegmentStore(store_path or os.path.splitext(index_path)[0] + '_store', read_only=read_only)
+        self.lock = threading.RLock()
+        self._compactor = None
+        self._compact_lock = threading.Lock()
+        self._segments_owner = None
+        self.bm25 = None
+        self._selectors = None
+        self._filters = OrderedDict()
+        self._uid = uuid.uuid4().hex[:12]
+        self._mutations = 0
+        # The legacy pair is only imported into the store derived from index_path
+        if (store_path is None and not read_only and not self.store.exists
+                and os.path.exists(index_path) and os.path.exists(meta_path)):
+            self._import_legacy()
+        self._load()
+        # Pick up a changed index_type or an unfinished compaction from the last run
+        self._maybe_compact()
 
     @staticmethod
-    def load_or_create(dim, index_path='faiss.index', meta_path='faiss_meta.pkl'):
-        if os.path.exists(index_path) and os.path.exists(meta_path):
-            return FaissIndex(dim, index_path, meta_path)
-        else:
-            return FaissIndex(dim, index_path, meta_path)
+    def load_or_create(dim, index_path='faiss.index', meta_path='faiss_meta.pkl', store_path=None,
+                       index_type=None, mmap=None):
+        return FaissIndex(dim, index_path, meta_path, store_path, index_type, mmap)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"Index at {self.store.path} is a read-only view; writes go through the writer process")
+
+    def _import_legacy(self):
+        legacy = faiss.read_index(self.index_path)
+        with open(self.meta_path, 'rb') as f:
+            metas = pickle.load(f)
+        if legacy.ntotal:
+            self.store.append(legacy.reconstruct_n(0, legacy.ntotal), metas)
+
+    def _load(self):
+        if self.store.manifest['dim']:
+            self.dim = self.store.manifest['dim']
+        index, rows = self.store.load_snapshot(mmap=self.mmap)
+        self.base = None
+        if index is not None and self.mmap:
+            self.base = index
+            set_search_params(self.base)
+            index = empty_flat_like(self.base)
+        elif index is None:
+            # Untrained types start flat; so does existing data without a snapshot
+            if self.store.rows or self._target_needs_training():
+                index = faiss.IndexFlatL2(self.dim)
+            else:
+                index = self._build_target()
+        self.index = index
+        set_search_params(self.index)
+        for block in self.store.load_vectors(start=rows):
+            self.index.add(np.ascontiguousarray(block, dtype='float32'))
+        self.meta = self.store.load_metas(mmap=self.mmap)
+        self.deleted = self.store.load_deleted()
+        self.meta.discount(self.deleted)
+        self._reset_selectors()
+
+    def _remap(self):
+        """
+        mmap mode: map the newly published snapshot and rebuild the delta.
+        """
+        with self.lock:
+            base, rows = self.store.load_snapshot(mmap=True)
+            set_search_params(base)
+            delta = empty_flat_like(base)
+            for block in self.store.load_vectors(start=rows):
+                delta.add(np.ascontiguousarray(block, dtype='float32'))
+            self.base, self.index = base, delta
+            # Delta ids are offset by the snapshot size, which just changed
+            self._reset_selectors()
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal + (self.base.ntotal if self.base is not None else 0)
+
+    @property
+    def live_count(self):
+        return self.ntotal - len(self.deleted)
+
+    @property
+    def documents(self):
+        """
+        {file name: {"hash", "clauses", "indexed_at"}} for documents indexed through ingest.
+        """
+        return self.store.manifest['documents']
+
+    def document_hash(self, name):
+        entry = self.documents.get(name)
+        return entry['hash'] if entry else None
+
+    @property
+    def active_type(self):
+        return index_type_of(self.base if self.base is not None else self.index)
+
+    @property
+    def active_spec(self):
+        return spec_of(self.base if self.base is not None else self.index)
+
+    @property
+    def target_spec(self):
+        return index_spec(self.index_type, self.dim, self.codec, self.reduction, self.reduce_dim)
+
+    def _build_target(self, rows=0):
+        return build_index(self.index_type, self.dim, rows, self.codec, self.reduction, self.reduce_dim)
+
+    def _target_needs_training(self):
+        return needs_training(self.index_type, self.codec, self.reduction, self.reduce_dim, self.dim)
+
+    def _needs_migration(self):
+        rows = min_training_rows(self.index_type, self.codec, self.reduction, self.reduce_dim, self.dim)
+        return self.active_spec != self.target_spec and self.ntotal >= max(1, rows)
+
+    def _stored_rows(self, rows):
+        """
+        Gather the given sorted row numbers from the (memory-mapped) segments.
+        """
+        out, offset = [], 0
+        for block in self.store.load_vectors():
+            picks = rows[(rows >= offset) & (rows < offset + len(block))] - offset
+            if len(picks):
+                out.append(block[picks])
+            offset += len(block)
+        return np.concatenate(out).astype('float32')
+
+    def _migrate(self):
+        """
+        Build the configured index type from the stored vectors and swap it in.
+        Runs on the compactor thread; adds and searches continue on the old
+        index until the swap.
+        """
+        with self.lock:
+            rows = self.ntotal
+        new_index = self._build_target(rows)
+        if self._target_needs_training():
+            sample = min(rows, get_env_int('FAISS_TRAIN_SAMPLE', 100000))
+            picks = np.sort(np.random.default_rng(0).choice(rows, sample, replace=False))
+            train_index(new_index, self._stored_rows(picks))
+        for block in self.store.load_vectors(stop=rows):
+            new_index.add(np.ascontiguousarray(block, dtype='float32'))
+        set_search_params(new_index)
+        with self.lock:
+            # Catch up with rows appended while the new index was being built
+            for block in self.store.load_vectors(start=rows):
+                new_index.add(np.ascontiguousarray(block, dtype='float32'))
+            self.index, self.base = new_index, None
+            self._reset_selectors()
+            serialized = faiss.serialize_index(self.index)
+            rows = self.index.ntotal
+        self.store.write_snapshot(serialized, rows)
+        if self.mmap:
+            self._remap()
 
     def add(self, embeddings, metas):
-        self.index.add(np.array(embeddings).astype('float32'))
-        self.meta.extend(metas)
-        self.save()
+        self._check_writable()
+        vectors = np.ascontiguousarray(np.asarray(embeddings, dtype='float32'))
+        with span('index_add'), self.lock:
+            # Persist first so the in-memory index never gets ahead of disk
+            self.store.append(vectors, metas)
+            self.index.add(vectors)
+            self.meta.extend(metas)
+            self._filters.clear()
+            if self.bm25 is not None:
+                self.bm25.add(m['text'] for m in metas)
+            self._mutations += 1
+        self._maybe_compact()
+
+    def live_rows_for_file(self, name):
+        with self.lock:
+            return np.setdiff1d(self.meta.rows_for_file(name), self.deleted)
+
+    def previous_rows(self, name, keep):
+        """
+        Live rows of `name` except its newest `keep` (the version just
+        appended). Caller holds self.lock: a vacuum renumbers rows, so they
+        must be used before it is released.
+        """
+        rows = self.live_rows_for_file(name)
+        return rows[:max(len(rows) - keep, 0)]
+
+    def clause_hashes(self, name):
+        """
+        Content hashes of the live clauses of one file.
+        """
+        with self.lock:
+            return {self.meta[int(i)].get('hash') for i in self.live_rows_for_file(name)} - {None}
+
+    def vectors_for_hashes(self, name, hashes):
+        """
+        Stored vectors of live clauses of `name` whose content hash is in
+        `hashes`, as {hash: vector}. Hashes no longer indexed are left out.
+        """
+        # Merges and vacuums delete segment files and renumber rows, so
+        # resolve and read the rows while no compaction runs
+        with self._compact_lock:
+            with self.lock:
+                rows = {}
+                for row in self.live_rows_for_file(name):
+                    digest = self.meta[int(row)].get('hash')
+                    if digest in hashes:
+                        rows.setdefault(digest, int(row))
+            return dict(zip(rows, self._stored_rows_any_order(list(rows.values()))))
+
+    def _stored_rows_any_order(self, rows):
+        rows = np.asarray(rows, dtype='int64')
+        if not len(rows):
+            return np.zeros((0, self.dim), dtype='float32')
+        order = np.argsort(rows, kind='stable')
+        out = np.empty((len(rows), self.dim), dtype='float32')
+        out[order] = self._stored_rows(rows[order])
+        return out
+
+    def delete_rows(self, rows, documents=None):
+        """
+        Tombstone rows (and apply document registry changes, see
+        SegmentStore.delete). Returns the number of rows newly deleted.
+        """
+        self._check_writable()
+        with self.lock:
+            rows = np.setdiff1d(np.asarray(rows, dtype='int64'), self.deleted)
+            if not len(rows):
+                if documents:
+                    self.store.set_documents(documents)
+                return 0
+            self.store.delete(rows, documents)
+            self.deleted = np.union1d(self.deleted, rows)
+            self.meta.discount(rows)
+            self._reset_selectors()
+            self._mutations += 1
+        self._maybe_compact()
+        return len(rows)
+
+    def delete_document(self, name):
+        """
+        Remove every clause of one file. Returns the number of clauses
+        deleted, or None if the file is not indexed.
+        """
+        with self.lock:
+            rows = self.live_rows_for_file(name)
+            if not len(rows) and name not in self.documents:
+                return None
+            return self.delete_rows(rows, documents={name: None})
+
+    def finish_document(self, name, file_hash, clauses):
+        """
+        Record that `name` is now indexed from content `file_hash` (its newest
+        `clauses` rows) and retire the rows of its previous version.
+        """
+        entry = {"hash": file_hash, "clauses": clauses, "indexed_at": time.time()}
+        with self.lock:
+            return self.delete_rows(self.previous_rows(name, clauses), documents={name: entry})
+
+    @property
+    def generation(self):
+        """
+        Changes whenever the indexed content changes; caches derived from
+        search results use it to invalidate themselves.
+        """
+        return f"{self._uid}:{self._mutations}"
+
+    def vector_stats(self):
+        """
+        Index layout in use and configured, and rescoring / filtered
+        search counters.
+        """
+        return {
+            'active': self.active_spec,
+            'target': self.target_spec,
+            'rescore_factor': self.rescore_factor,
+            'rescored_searches': self.rescored,
+            'rescore_skipped': self.rescore_skipped,
+            'filtered_searches': self.filtered,
+            'filter_exact_searches': self.filter_exact,
+            'exhaustive_retries': self.exhaustive_retries,
+        }
+
+    def memory_bytes(self):
+        """
+        Approximate RAM this index holds: the in-memory faiss index (the
+        delta in mmap mode), clause metadata buffers and the BM25 index.
+        Memory-mapped snapshot and segment pages are not counted.
+        """
+        with self.lock:
+            total = index_memory_bytes(self.index) + self.meta.memory_bytes() + 8 * len(self.deleted)
+            if self.bm25 is not None:
+                total += self.bm25.memory_bytes()
+            return total
+
+    @property
+    def compacting(self):
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def _reset_selectors(self):
+        # Selectors address rows relative to the snapshot / delta split
+        self._selectors = None
+        self._filters.clear()
+
+    def _exclusions(self):
+        """
+        (delta/index selector, base selector) that reject deleted rows, or
+        Nones when nothing is deleted. Cached until the next delete.
+        """
+        if not len(self.deleted):
+            return None, None
+        if self._selectors is None:
+            offset = self.base.ntotal if self.base is not None else 0
+            keep = []
+            def exclude(ids):
+                # Keep the batch alive: IDSelectorNot only holds a pointer to it
+                batch = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype='int64'))
+                keep.append(batch)
+                return faiss.IDSelectorNot(batch)
+            index_sel = exclude(self.deleted[self.deleted >= offset] - offset)
+            base_sel = exclude(self.deleted[self.deleted < offset]) if self.base is not None else None
+            self._selectors = (index_sel, base_sel, keep)
+        return self._selectors[0], self._selectors[1]
+
+    def _inclusions(self, rows):
+        """
+        (delta/index selector, base selector, bitmaps) accepting only the
+        given live rows. The bitmaps must outlive the selectors.
+        """
+        offset = self.base.ntotal if self.base is not None else 0
+        keep = []
+        def include(ids, size):
+            mask = np.zeros(max(size, 1), dtype=bool)
+            mask[ids] = True
+            bitmap = np.packbits(mask, bitorder='little')
+            keep.append(bitmap)
+            return faiss.IDSelectorBitmap(bitmap)
+        index_sel = include(rows[rows >= offset] - offset, self.index.ntotal)
+        base_sel = include(rows[rows < offset], offset) if self.base is not None else None
+        return index_sel, base_sel, keep
+
+    def _matching_rows(self, filters):
+        names = set(self.meta.file_counts)
+        if 'files' in filters:
+            names &= filters['files']
+        if 'doc_types' in filters:
+            names = {n for n in names if os.path.splitext(n)[1].lower() in filters['doc_types']}
+        after, before = filters.get('uploaded_after'), filters.get('uploaded_before')
+        if after is not None or before is not None:
+            documents = self.documents
+            def uploaded(name):
+                # Files never registered (legacy imports) have no upload date
+                at = (documents.get(name) or {}).get('indexed_at')
+                return at is not None and (after is None or at >= after) and (before is None or at < before)
+            names = {n for n in names if uploaded(n)}
+        rows = self.meta.rows_matching(names, filters.get('pages'))
+        return np.setdiff1d(rows, self.deleted) if len(self.deleted) else rows
 
-    def search(self, embedding, top_k=5):
-        D, I = self.index.search(np.array([embedding]).astype('float32'), top_k)
+    def _filter_rows(self, filters):
+        """
+        (sorted live rows matching filters, index selector, base selector)
+        for a search_filter(). The most recent FAISS_FILTER_CACHE filters
+        are kept until rows are added, deleted or renumbered. Caller holds
+        self.lock.
+        """
+        key = tuple(sorted(filters.items(), key=lambda item: item[0]))
+        entry = self._filters.get(key)
+        if entry is None:
+            rows = self._matching_rows(filters)
+            entry = self._filters[key] = (rows,) + self._inclusions(rows)
+            while len(self._filters) > get_env_int('FAISS_FILTER_CACHE', 32):
+                self._filters.popitem(last=False)
+        else:
+            self._filters.move_to_end(key)
+        return entry[:3]
+
+    @contextmanager
+    def _segments(self):
+        """
+        Yield whether the segment files can be read now: True when no
+        compaction holds them (or this thread already does). Never waits.
+        """
+        if self._segments_owner == threading.get_ident():
+            yield True
+            return
+        acquired = self._compact_lock.acquire(blocking=False)
+        if acquired:
+            self._segments_owner = threading.get_ident()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._segments_owner = None
+                self._compact_lock.release()
+
+    def _lossy(self):
+        """
+        Whether the active index returns approximate distances (quantized
+        codes or reduced dimensions), so rescoring can change the order.
+        """
+        return self.active_type == 'ivf_pq' or self.active_spec != index_spec(self.active_type, self.dim)
+
+    def _search_vectors(self, queries, top_k, filters=None):
+        """
+        (distances, rows) of the top_k live rows, restricted to a
+        search_filter() when given. Every query gets min(top_k, matching
+        rows) hits: few matching rows are scanned exactly from the stored
+        vectors (FAISS_FILTER_EXACT_ROWS), otherwise the selector goes into
+        the index search and queries an approximate index left short are
+        searched again.
+        """
+        rows = None
+        if filters is None:
+            index_sel, base_sel = self._exclusions()
+        else:
+            self.filtered += 1
+            rows, index_sel, base_sel = self._filter_rows(filters)
+            if not len(rows):
+                return _no_hits(len(queries), top_k)
+            if len(rows) <= get_env_int('FAISS_FILTER_EXACT_ROWS', 4096):
+                found = self._exact_search(queries, rows, top_k)
+                if found is not None:
+                    self.filter_exact += 1
+                    return found
+        if self.rescore_factor > 1 and self._lossy():
+            D, I = self._index_search(queries, top_k * self.rescore_factor, index_sel, base_sel, rows)
+            return self._rescore(queries, D, I, top_k)
+        return self._index_search(queries, top_k, index_sel, base_sel, rows)
+
+    def _rescore(self, queries, D, I, top_k):
+        """
+        Re-rank candidates by exact L2 distance to their full-precision
+        stored vectors. While a compaction holds the segments the
+        approximate order is kept.
+        """
+        rows = np.unique(I[I >= 0])
+        with self._segments() as have_segments:
+            vectors = None
+            if have_segments and len(rows):
+                try:
+                    with span('rescore'):
+                        vectors = self._stored_rows(rows)
+                except OSError:
+                    vectors = None
+        if vectors is None:
+            self.rescore_skipped += 1
+            return D[:, :top_k], I[:, :top_k]
+        self.rescored += 1
+        candidates = vectors[np.searchsorted(rows, np.maximum(I, rows[0]))]
+        exact = ((candidates - queries[:, None, :]) ** 2).sum(axis=2)
+        exact[I < 0] = np.inf
+        order = np.argsort(exact, axis=1, kind='stable')[:, :top_k]
+        return np.take_along_axis(exact, order, 1).astype('float32'), np.take_along_axis(I, order, 1)
+
+    def _index_search(self, queries, top_k, index_sel, base_sel, rows=None):
+        D, I = self._search_parts(queries, top_k, index_sel, base_sel)
+        # nprobe / efSearch can stop before reaching enough accepted rows
+        available = self.live_count if rows is None else len(rows)
+        short = np.flatnonzero((I >= 0).sum(axis=1) < min(top_k, available))
+        if not len(short):
+            return D, I
+        self.exhaustive_retries += len(short)
+        found = self._exact_search(queries[short], rows, top_k) if rows is not None else None
+        if found is None:
+            with span('exhaustive_search'):
+                found = self._search_parts(queries[short], top_k, index_sel, base_sel, exhaustive=True)
+        D[short], I[short] = found
+        return D, I
+
+    def _search_parts(self, queries, top_k, index_sel, base_sel, exhaustive=False):
+        D, I = self.index.search(queries, top_k, params=search_params(self.index, index_sel, exhaustive))
+        if self.base is None:
+            return D, I
+        # Merge hits from the mapped snapshot and the delta (ids offset past it)
+        Db, Ib = self.base.search(queries, top_k, params=search_params(self.base, base_sel, exhaustive))
+        I = np.where(I >= 0, I + self.base.ntotal, -1)
+        return _merge_hits(Db, Ib, D, I, top_k)
+
+    def _exact_search(self, queries, rows, top_k):
+        """
+        Exact L2 search over the stored full-precision vectors of the given
+        sorted rows, in blocks. None while a compaction holds the segments.
+        """
+        with self._segments() as have_segments:
+            if not have_segments:
+                return None
+            D, I = _no_hits(len(queries), top_k)
+            block_rows = get_env_int('FAISS_EXACT_BLOCK', 65536)
+            try:
+                with span('exact_search'):
+                    for start in range(0, len(rows), block_rows):
+                        block = rows[start:start + block_rows]
+                        flat = faiss.IndexFlatL2(self.dim)
+                        flat.add(self._stored_rows(block))
+                        Db, Ib = flat.search(queries, top_k)
+                        D, I = _merge_hits(D, I, Db, np.where(Ib >= 0, block[np.maximum(Ib, 0)], -1), top_k)
+            except OSError:
+                return None
+            return D, I
+
+    def search(self, embedding, top_k=5, filters=None):
+        return self.search_batch([embedding], top_k, filters)[0]
+
+    def search_batch(self, embeddings, top_k=5, filters=None):
+        """
+        Vector search for several queries with one matrix index.search.
+        Returns one list of clauses per row of embeddings, in order.
+        filters is a search_filter() applied inside the search.
+        """
+        with span('search'), self.lock:
+            return [[self.meta[i] for i in rows] for rows in self._search_rows(embeddings, top_k, filters)]
+
+    def _search_rows(self, embeddings, top_k, filters=None):
+        D, I = self._search_vectors(np.atleast_2d(np.asarray(embeddings, dtype='float32')), top_k, filters)
+        return [[int(i) for i in row if i >= 0] for row in I]
+
+    def _lexical_index(self):
+        """
+        BM25 index over clause texts, built on first use and then kept up to
+        date by add(). Caller holds self.lock.
+        """
+        if self.bm25 is None:
+            self.bm25 = BM25Index()
+            self.bm25.add(self.meta.texts())
+        return self.bm25
+
+    def build_lexical_index(self):
+        """
+        Build the BM25 index now rather than on the first lexical query.
+        """
+        with self.lock:
+            self._lexical_index()
+
+    def lexical_search(self, query, top_k=5, filters=None):
+        with span('search'), self.lock:
+            return [self.meta[i] for i in self._lexical_rows(query, top_k, filters)]
+
+    def _lexical_matches(self, query, top_k, filters):
+        include = None if filters is None else self._filter_rows(filters)[0]
+        return self._lexical_index().search(query, top_k, exclude=self.deleted, include=include)
+
+    def _lexical_rows(self, query, top_k, filters=None):
+        return [idx for idx, _ in self._lexical_matches(query, top_k, filters)]
+
+    def retrieve(self, query, embedding=None, top_k=5, mode=None, vector_weight=1.0, lexical_weight=1.0, fusion=None,
+                 filters=None):
+        """
+        Dispatch on mode ('vector', 'lexical' or 'hybrid', default SEARCH_MODE).
+        filters (a search_filter()) restricts every mode to matching clauses.
+        """
+        embeddings = None if embedding is None else [embedding]
+        return self.retrieve_batch([query], embeddings, top_k, mode, vector_weight, lexical_weight, fusion,
+                                   filters)[0]
+
+    def retrieve_batch(self, queries, embeddings=None, top_k=5, mode=None, vector_weight=1.0, lexical_weight=1.0,
+                       fusion=None, filters=None):
+        """
+        retrieve() for several queries at once: the vector side of 'vector'
+        and 'hybrid' runs as one matrix search. Results are in query order.
+        """
+        with span('search'), self.lock:
+            rows = self._retrieve_rows(queries, embeddings, top_k, mode, vector_weight, lexical_weight, fusion,
+                                       filters)
+            return [[self.meta[i] for i in r] for r in rows]
+
+    def retrieve_candidates(self, queries, embeddings=None, top_k=5, mode=None, vector_weight=1.0,
+                            lexical_weight=1.0, fusion=None, filters=None):
+        """
+        retrieve_batch() plus the stored vectors of each query's clauses, for
+        re-ranking. Returns (clause lists, vector matrices); the matrices are
+        None while a compaction holds the segments (or, in a read-only view,
+        the writer has removed them), rather than waiting for it.
+        """
+        with self._segments() as have_segments:
+            with span('search'), self.lock:
+                rows = self._retrieve_rows(queries, embeddings, top_k, mode, vector_weight, lexical_weight, fusion,
+                                           filters)
+                clauses = [[self.meta[i] for i in r] for r in rows]
+            vectors = None
+            if have_segments:
+                try:
+                    with span('load_vectors'):
+                        vectors = [self._stored_rows_any_order(r) for r in rows]
+                except OSError:
+                    vectors = None
+            return clauses, vectors
+
+    def _retrieve_rows(self, queries, embeddings, top_k, mode, vector_weight, lexical_weight, fusion, filters=None):
+        mode = (mode or get_search_mode()).lower()
+        if mode == 'lexical':
+            return [self._lexical_rows(query, top_k, filters) for query in queries]
+        if mode == 'hybrid':
+            return self._hybrid_rows(queries, embeddings, top_k, vector_weight, lexical_weight, fusion, filters)
+        if mode == 'vector':
+            return self._search_rows(embeddings, top_k, filters)
+        raise ValueError(f"Unsupported search mode: {mode}")
+
+    def hybrid_search(self, query, embedding, top_k=5, vector_weight=1.0, lexical_weight=1.0, fusion=None,
+                      filters=None):
+        """
+        Fuse vector and BM25 results. fusion is 'linear' (weighted sum of
+        min-max normalised scores) or 'rrf' (weighted reciprocal rank fusion),
+        default HYBRID_FUSION. Each side is over-fetched so exact-term matches
+        that rank low on vector distance can still make the final top_k.
+        """
+        embeddings = None if embedding is None else [embedding]
+        return self.hybrid_search_batch([query], embeddings, top_k, vector_weight, lexical_weight, fusion,
+                                        filters)[0]
+
+    def hybrid_search_batch(self, queries, embeddings, top_k=5, vector_weight=1.0, lexical_weight=1.0, fusion=None,
+                            filters=None):
+        with span('search'), self.lock:
+            rows = self._hybrid_rows(queries, embeddings, top_k, vector_weight, lexical_weight, fusion, filters)
+            return [[self.meta[i] for i in r] for r in rows]
+
+    def _hybrid_rows(self, queries, embeddings, top_k, vector_weight, lexical_weight, fusion, filters=None):
+        fusion = (fusion or os.getenv('HYBRID_FUSION', 'linear')).lower()
+        if fusion not in ('linear', 'rrf'):
+            raise ValueError(f"Unsupported fusion: {fusion}")
+        candidates = max(top_k * 4, get_env_int('HYBRID_CANDIDATES', 50))
+        weights = [vector_weight, lexical_weight]
+        if vector_weight:
+            D, I = self._search_vectors(np.atleast_2d(np.asarray(embeddings, dtype='float32')), candidates, filters)
         results = []
-        for idx in I[0]:
-            if idx < len(self.meta):
-                results.append(self.meta[idx])
+        for n, query in enumerate(queries):
+            vector_hits = {}
+            if vector_weight:
+                # Negate L2 distance so that higher is better on both sides
+                vector_hits = {int(i): -float(d) for d, i in zip(D[n], I[n]) if i >= 0}
+            lexical_hits = {}
+            if lexical_weight:
+                lexical_hits = dict(self._lexical_matches(query, candidates, filters))
+            if fusion == 'rrf':
+                fused = reciprocal_rank_fusion([list(vector_hits), list(lexical_hits)], weights)
+            else:
+                fused = linear_fusion([vector_hits, lexical_hits], weights)
+            results.append(fused[:top_k])
         return results
 
     def save(self):
-        faiss.write_index(self.index, self.index_path)
-        with open(self.meta_path, 'wb') as f:
-            pickle.dump(self.meta, f)
+        """
+        Checkpoint: merge all segments and write a fresh faiss snapshot.
+        Not needed for durability, since add() already persists its segment.
+        """
+        self.wait_for_compaction()
+        self.compact(force=True)
+
+    def _snapshot_stale(self, force=False):
+        snapshot = self.store.manifest['snapshot']
+        covered = snapshot['rows'] if snapshot else 0
+        behind = self.ntotal - covered
+        if force:
+            return behind > 0
+        return behind > max(get_env_int('FAISS_SNAPSHOT_MIN_ROWS', 10000), covered)
+
+    def _maybe_compact(self):
+        if self.read_only:
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        if self._needs_compaction():
+            self._compactor = threading.Thread(target=self._compact_until_done, daemon=True)
+            self._compactor.start()
+
+    def _needs_compaction(self):
+        return (bool(self.store.plan_merge(get_env_int('FAISS_COMPACT_SEGMENTS', 8)))
+                or self._snapshot_stale() or self._needs_migration() or self._needs_vacuum())
+
+    def _needs_vacuum(self):
+        return len(self.deleted) > 0 and len(self.deleted) >= get_env_float('FAISS_VACUUM_RATIO', 0.2) * self.ntotal
+
+    def _vacuum(self):
+        """
+        Rewrite all segments without the deleted rows, then reload. Rows are
+        renumbered, so the commit and reload happen under self.lock.
+        """
+        with self.lock:
+            names = [s['name'] for s in self.store.manifest['segments']]
+            deleted = self.deleted.copy()
+        pending = self.store.prepare_merge(names, drop=deleted)
+        with self.lock:
+            self.store.commit_merge(pending)
+            self._load()
+            self.bm25 = None
+            self._mutations += 1
+
+    def _compact_until_done(self):
+        # Adds that land while a pass runs are picked up by the next pass
+        while self._needs_compaction():
+            self.compact()
+
+    def wait_for_compaction(self):
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def compact(self, force=False):
+        """
+        Merge segments (size-tiered, or all of them when force=True) and
+        refresh the faiss snapshot once enough rows are not covered by it.
+        Heavy I/O runs outside self.lock so add() and search() are not blocked.
+        """
+        self._check_writable()
+        with span('compact'), self._compact_lock:
+            if self._needs_vacuum():
+                self._vacuum()
+            if force:
+                names = [s['name'] for s in self.store.manifest['segments']]
+            else:
+                names = self.store.plan_merge(get_env_int('FAISS_COMPACT_SEGMENTS', 8))
+            self.store.merge(names)
+            if self._needs_migration():
+                self._migrate()
+                return
+            with self.lock:
+                if not self._snapshot_stale(force):
+                    return
+                if self.base is None:
+                    serialized = faiss.serialize_index(self.index)
+                rows = self.ntotal
+            if self.base is not None:
+                # The mapped snapshot is read-only: extend an owned copy instead
+                full, covered = self.store.load_snapshot()
+                for block in self.store.load_vectors(start=covered, stop=rows):
+                    full.add(np.ascontiguousarray(block, dtype='float32'))
+                serialized = faiss.serialize_index(full)
+                del full
+            self.store.write_snapshot(serialized, rows)
+            if self.mmap:
+                self._remap()
+
+EMBEDDING_MODEL = 'models/embedding-001'
+LOCAL_EMBEDDING_DIM = 768
+
+def embedding_model_name():
+    # Cache keys include the model so switching backends never mixes vectors
+    if get_embedding_backend() == 'local':
+        return f"local-{get_env_int('LOCAL_EMBEDDING_DIM', LOCAL_EMBEDDING_DIM)}"
+    return EMBEDDING_MODEL
 
 # Gemini Embedding API (simulate, as official endpoint may differ)
-def get_gemini_embedding(text: str) -> np.ndarray:
-    api_key = get_gemini_api_key()
-    url = 'https://generativelanguage.googleapis.com/v1beta/models/embedding-001:embedContent?key=' + api_key
-    headers = {'Content-Type': 'application/json'}
+def get_gemini_embedding(text: str, use_cache=True) -> np.ndarray:
+    cache = get_embedding_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get_many(embedding_model_name(), [text])[0]
+        if cached is not None:
+            return cached
+    with span('embed'):
+        embedding = _embed_single(text)
+    if cache is not None:
+        cache.put_many(embedding_model_name(), [text], [embedding])
+    return embedding
+
+def _embed_single(text):
+    if get_embedding_backend() == 'local':
+        return get_local_embeddings([text])[0]
     data = {
-        "model": "models/embedding-001",
+        "model": EMBEDDING_MODEL,
         "content": {"parts": [{"text": text}]}
     }
-    response = requests.post(url, headers=headers, json=data)
-    response.raise_for_status()
-    embedding = response.json()['embedding']['values']
-    return np.array(embedding)
\ No newline at end of file
+    embedding = get_gemini_client().post(EMBEDDING_MODEL, 'embedContent', data)['embedding']['values']
+    return np.array(embedding)
+
+def iter_embedding_batches(texts, batch_size=None, max_batch_tokens=None):
+    """
+    Split texts into (start, end) ranges that respect both the request size
+    limit and the approximate token budget of a single batch call.
+    """
+    batch_size = batch_size or get_env_int('EMBED_BATCH_SIZE', 100)
+    max_batch_tokens = max_batch_tokens or get_env_int('EMBED_BATCH_TOKENS', 20000)
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if i > start and (i - start >= batch_size or tokens + cost > max_batch_tokens):
+            yield start, i
+            start, tokens = i, 0
+        tokens += cost
+    if start < len(texts):
+        yield start, len(texts)
+
+def _batch_request(texts):
+    return {
+        "requests": [
+            {"model": EMBEDDING_MODEL, "content": {"parts": [{"text": text}]}}
+            for text in texts
+        ]
+    }
+
+def _post_batch_embeddings(texts):
+    response = get_gemini_client().post(EMBEDDING_MODEL, 'batchEmbedContents', _batch_request(texts))
+    return [e['values'] for e in response['embeddings']]
+
+def get_gemini_embeddings(texts, batch_size=None, max_batch_tokens=None, use_cache=True) -> np.ndarray:
+    """
+    Embed many texts with as few API calls as possible.
+    Returns a float32 matrix with one row per input text; texts already in
+    the embedding cache are not sent to the API.
+    """
+    texts = list(texts)
+    cache = get_embedding_cache() if use_cache else None
+    if cache is None or not texts:
+        with span('embed'):
+            return _embed_uncached(texts, batch_size, max_batch_tokens)
+    model = embedding_model_name()
+    cached = cache.get_many(model, texts)
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    if missing:
+        with span('embed'):
+            fresh = _embed_uncached([texts[i] for i in missing], batch_size, max_batch_tokens)
+        cache.put_many(model, [texts[i] for i in missing], fresh)
+        for i, vector in zip(missing, fresh):
+            cached[i] = vector
+    return np.vstack(cached).astype('float32')
+
+def _embed_uncached(texts, batch_size=None, max_batch_tokens=None):
+    if get_embedding_backend() == 'local':
+        return get_local_embeddings(texts)
+    rows = []
+    for start, end in iter_embedding_batches(texts, batch_size, max_batch_tokens):
+        rows.extend(_post_batch_embeddings(texts[start:end]))
+    if not rows:
+        return np.zeros((0, 0), dtype='float32')
+    return np.asarray(rows, dtype='float32')
+
+async def _apost_batch_embeddings(texts):
+    response = await get_gemini_client().apost(EMBEDDING_MODEL, 'batchEmbedContents', _batch_request(texts),
+                                                max_concurrency=get_env_int('EMBED_CONCURRENCY', 4))
+    return [e['values'] for e in response['embeddings']]
+
+async def aget_gemini_embeddings(texts, batch_size=None, max_batch_tokens=None, use_cache=True) -> np.ndarray:
+    """
+    Async variant of get_gemini_embeddings: batches are sent concurrently
+    (bounded by EMBED_CONCURRENCY) and retried with backoff on 429/5xx.
+    """
+    texts = list(texts)
+    cache = get_embedding_cache() if use_cache else None
+    model = embedding_model_name()
+    if cache is not None and texts:
+        rows = await asyncio.to_thread(cache.get_many, model, texts)
+    else:
+        rows = [None] * len(texts)
+    missing = [i for i, vector in enumerate(rows) if vector is None]
+    if missing:
+        pending = [texts[i] for i in missing]
+        with span('embed'):
+            if get_embedding_backend() == 'local':
+                fresh = await asyncio.to_thread(get_local_embeddings, pending)
+            else:
+                batches = await asyncio.gather(*[
+                    _apost_batch_embeddings(pending[start:end])
+                    for start, end in iter_embedding_batches(pending, batch_size, max_batch_tokens)
+                ])
+                fresh = np.asarray([v for batch in batches for v in batch], dtype='float32')
+        if cache is not None:
+            await asyncio.to_thread(cache.put_many, model, pending, fresh)
+        for i, vector in zip(missing, fresh):
+            rows[i] = vector
+    if not rows:
+        return np.zeros((0, 0), dtype='float32')
+    return np.vstack(rows).astype('float32')
+
+def get_local_embeddings(texts, dim=None) -> np.ndarray:
+    """
+    Offline stand-in for the Gemini embedding API: signed feature hashing of
+    lowercase word tokens, L2-normalised. Deterministic across processes so it
+    can be used to benchmark ingestion without network access.
+    """
+    dim = dim or get_env_int('LOCAL_EMBEDDING_DIM', LOCAL_EMBEDDING_DIM)
+    matrix = np.zeros((len(texts), dim), dtype='float32')
+    for row, text in enumerate(texts):
+        for token in re.findall(r'\w+', text.lower()):
+            h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            matrix[row, h % dim] += 1.0 if (h >> 63) else -1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
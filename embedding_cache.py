@@ -0,0 +1,130 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import get_env_int
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFC', text)
+    return ' '.join(text.split())
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache: an in-memory LRU in front of a SQLite
+    table that survives restarts. Keys are sha256(model, normalized text), so
+    the same clause in a re-uploaded document never hits the API twice.
+    """
+
+    def __init__(self, path='embedding_cache.sqlite', max_items=50000):
+        self.path = path
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)'
+            )
+            self.conn.commit()
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def get_many(self, model, texts):
+        """
+        Return a list aligned with texts holding cached vectors or None.
+        """
+        keys = [cache_key(model, t) for t in texts]
+        results = [None] * len(keys)
+        with self.lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    results[i] = vector
+                    self.hits_memory += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+            if missing and self.conn is not None:
+                found = list(missing)
+                for chunk_start in range(0, len(found), 500):
+                    chunk = found[chunk_start:chunk_start + 500]
+                    rows = self.conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype='float32')
+                        self._remember(key, vector)
+                        for i in missing.pop(key):
+                            results[i] = vector
+                            self.hits_disk += 1
+            self.misses += sum(len(v) for v in missing.values())
+        return results
+
+    def put_many(self, model, texts, vectors):
+        vectors = np.asarray(vectors, dtype='float32')
+        rows = []
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, text)
+                vector = np.array(vector, dtype='float32')
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+            if rows and self.conn is not None:
+                self.conn.executemany('INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)', rows)
+                self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": round((self.hits_memory + self.hits_disk) / lookups, 4) if lookups else None,
+                "memory_items": len(self.memory),
+            }
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                self.conn.execute('DELETE FROM embeddings')
+                self.conn.commit()
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def get_embedding_cache():
+    """
+    Process-wide cache configured from EMBEDDING_CACHE_PATH / EMBEDDING_CACHE_SIZE.
+    Returns None when EMBEDDING_CACHE=0.
+    """
+    global _default_cache
+    if os.getenv('EMBEDDING_CACHE', '1') == '0':
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache.sqlite'),
+                get_env_int('EMBEDDING_CACHE_SIZE', 50000)
+            )
+        return _default_cache
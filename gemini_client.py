@@ -0,0 +1,374 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import observe
+from utils import get_env_float, get_env_int, get_gemini_api_base, get_gemini_api_key
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised without calling the API while the circuit breaker is open.
+    """
+
+class TokenBucket:
+    """
+    Requests-per-minute limiter shared by sync and async callers.
+    reserve() takes a token and returns how long the caller must wait for
+    it, so waiting happens outside the lock (time.sleep or asyncio.sleep).
+    """
+
+    def __init__(self, rpm, burst=None):
+        self.rate = rpm / 60.0
+        self.capacity = float(burst or max(1, rpm // 10))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failed attempts and fails calls fast
+    for `cooldown` seconds; then lets one trial request through (half-open)
+    and closes again on its success.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half_open' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError while open. Returns True if this call is the
+        half-open trial, which the caller must end with record() or end_trial().
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial:
+                raise CircuitOpenError("Gemini API circuit breaker is open; failing fast")
+            self.trial = True
+            return True
+
+    def end_trial(self):
+        # A trial cancelled before its outcome was recorded lets the next call try
+        with self.lock:
+            self.trial = False
+
+    def record(self, ok):
+        with self.lock:
+            self.trial = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+class CallMetrics:
+    """
+    Per-method call counts and a window of recent latencies.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.methods = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, seconds, ok, retries):
+        with self.lock:
+            m = self.methods.get(method)
+            if m is None:
+                m = self.methods[method] = {'calls': 0, 'errors': 0, 'retries': 0, 'latencies': deque(maxlen=self.window)}
+            m['calls'] += 1
+            m['errors'] += 0 if ok else 1
+            m['retries'] += retries
+            m['latencies'].append(seconds)
+        observe('lexiq_gemini_call_duration_seconds', seconds, 'Gemini API call duration, including retries',
+                method=method, outcome='ok' if ok else 'error')
+
+    def snapshot(self):
+        with self.lock:
+            report = {}
+            for method, m in self.methods.items():
+                latencies = sorted(m['latencies'])
+                pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+                report[method] = {
+                    'calls': m['calls'],
+                    'errors': m['errors'],
+                    'retries': m['retries'],
+                    'latency_ms_p50': pick(0.5) if latencies else None,
+                    'latency_ms_p95': pick(0.95) if latencies else None,
+                    'latency_ms_max': round(latencies[-1] * 1000, 1) if latencies else None,
+                }
+            return report
+
+def _retry_delay(attempt, retry_after=None):
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+def _sse_payload(line):
+    """
+    JSON payload of one `data:` line of an alt=sse stream, else None.
+    """
+    if not line or not line.startswith('data:'):
+        return None
+    return json.loads(line[5:])
+
+class GeminiClient:
+    """
+    The one way this app talks to the Gemini REST API.
+
+    A keep-alive requests.Session (sync) and httpx.AsyncClient (async) pool
+    connections; every call goes through a per-model token bucket
+    (GEMINI_RPM), is retried with jittered backoff on 429/5xx and transport
+    errors, trips a shared circuit breaker on repeated failures and records
+    its latency. Streams are retried only until the first byte arrives and
+    their latency is time to response headers.
+    """
+
+    def __init__(self, api_base=None, api_key=None):
+        self.api_base = api_base or get_gemini_api_base()
+        self.api_key = api_key or get_gemini_api_key()
+        connect = get_env_float('GEMINI_CONNECT_TIMEOUT', 10.0)
+        read = get_env_float('GEMINI_TIMEOUT', 60.0)
+        self.timeout = (connect, read)
+        self.pool_size = get_env_int('GEMINI_POOL_SIZE', 10)
+        self.max_retries = get_env_int('GEMINI_MAX_RETRIES', 5)
+        self.rpm = get_env_int('GEMINI_RPM', 0)
+        self.buckets = {}
+        self.breaker = CircuitBreaker(get_env_int('GEMINI_BREAKER_FAILURES', 5),
+                                      get_env_float('GEMINI_BREAKER_COOLDOWN', 30.0))
+        self.metrics = CallMetrics()
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Content-Type'] = 'application/json'
+        self._async_client = None
+        self._async_loop = None
+        self._semaphores = {}
+
+    def url(self, model, method, **params):
+        query = ''.join(f"&{k}={v}" for k, v in params.items())
+        return f"{self.api_base}/{model}:{method}?key={self.api_key}{query}"
+
+    def _wait_for_token(self, model):
+        if not self.rpm:
+            return 0.0
+        with self.lock:
+            bucket = self.buckets.get(model)
+            if bucket is None:
+                bucket = self.buckets[model] = TokenBucket(self.rpm, get_env_int('GEMINI_BURST', 0))
+        return bucket.reserve()
+
+    def async_client(self):
+        """
+        Shared httpx.AsyncClient for the running event loop (recreated if a
+        new loop starts, e.g. a second asyncio.run()).
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_keepalive_connections=self.pool_size),
+                headers={'Content-Type': 'application/json'}
+            )
+            self._async_loop = loop
+            self._semaphores = {}
+        return self._async_client
+
+    def _semaphore(self, name, size):
+        semaphore = self._semaphores.get(name)
+        if semaphore is None:
+            semaphore = self._semaphores[name] = asyncio.Semaphore(size)
+        return semaphore
+
+    def _attempts(self, method, start):
+        """
+        Yield (attempt number, whether it is the breaker's half-open trial);
+        the caller returns on success.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                trial = self.breaker.before_call()
+            except CircuitOpenError:
+                self._finish(method, start, False, attempt)
+                raise
+            yield attempt, trial
+
+    def _finish(self, method, start, ok, retries):
+        self.metrics.record(method, time.perf_counter() - start, ok, retries)
+
+    def _open_sync(self, model, method, body, stream=False, **params):
+        start = time.perf_counter()
+        url = self.url(model, method, **params)
+        for attempt, trial in self._attempts(method, start):
+            response = None
+            try:
+                time.sleep(self._wait_for_token(model))
+                try:
+                    response = self.session.post(url, json=body, timeout=self.timeout, stream=stream)
+                except (requests.ConnectionError, requests.Timeout):
+                    self.breaker.record(False)
+                    if attempt == self.max_retries:
+                        self._finish(method, start, False, attempt)
+                        raise
+                except Exception:
+                    self.breaker.record(False)
+                    self._finish(method, start, False, attempt)
+                    raise
+                else:
+                    retryable = response.status_code in RETRY_STATUS_CODES
+                    self.breaker.record(not retryable)
+                    if not retryable or attempt == self.max_retries:
+                        self._finish(method, start, response.ok, attempt)
+                        if not response.ok:
+                            response.close()
+                        response.raise_for_status()
+                        return response
+                    response.close()
+            finally:
+                # Interrupted before an outcome was recorded
+                if trial:
+                    self.breaker.end_trial()
+            time.sleep(_retry_delay(attempt, response.headers.get('Retry-After') if response is not None else None))
+
+    def post(self, model, method, body):
+        """
+        Blocking call; returns the decoded JSON response.
+        """
+        return self._open_sync(model, method, body).json()
+
+    def stream(self, model, method, body):
+        """
+        Blocking server-sent-events call; yields each decoded payload.
+        """
+        with self._open_sync(model, method, body, stream=True, alt='sse') as response:
+            for line in response.iter_lines(decode_unicode=True):
+                payload = _sse_payload(line)
+                if payload is not None:
+                    yield payload
+
+    async def _open_async(self, model, method, body, stream=False, max_concurrency=None, **params):
+        client = self.async_client()
+        start = time.perf_counter()
+        url = self.url(model, method, **params)
+        semaphore = self._semaphore(method, max_concurrency) if max_concurrency else None
+        for attempt, trial in self._attempts(method, start):
+            response = None
+            try:
+                await asyncio.sleep(self._wait_for_token(model))
+                try:
+                    # Only the request itself holds a concurrency slot; backoff sleeps do not
+                    if semaphore is not None:
+                        await semaphore.acquire()
+                    try:
+                        request = client.build_request('POST', url, json=body)
+                        response = await client.send(request, stream=stream)
+                    finally:
+                        if semaphore is not None:
+                            semaphore.release()
+                except httpx.TransportError:
+                    self.breaker.record(False)
+                    if attempt == self.max_retries:
+                        self._finish(method, start, False, attempt)
+                        raise
+                except Exception:
+                    self.breaker.record(False)
+                    self._finish(method, start, False, attempt)
+                    raise
+                else:
+                    retryable = response.status_code in RETRY_STATUS_CODES
+                    self.breaker.record(not retryable)
+                    if not retryable or attempt == self.max_retries:
+                        self._finish(method, start, response.is_success, attempt)
+                        if not response.is_success:
+                            await response.aclose()
+                        response.raise_for_status()
+                        return response
+                    await response.aclose()
+            finally:
+                # Cancelled (e.g. the client disconnected) before an outcome was recorded
+                if trial:
+                    self.breaker.end_trial()
+            await asyncio.sleep(_retry_delay(attempt, response.headers.get('Retry-After') if response is not None else None))
+
+    async def apost(self, model, method, body, max_concurrency=None):
+        """
+        Async call; at most max_concurrency requests of this method are in flight.
+        """
+        response = await self._open_async(model, method, body, max_concurrency=max_concurrency)
+        return response.json()
+
+    async def astream(self, model, method, body):
+        """
+        Async server-sent-events call; yields each decoded payload.
+        """
+        response = await self._open_async(model, method, body, stream=True, alt='sse')
+        try:
+            async for line in response.aiter_lines():
+                payload = _sse_payload(line)
+                if payload is not None:
+                    yield payload
+        finally:
+            await response.aclose()
+
+    def stats(self):
+        return {'circuit': self.breaker.state, 'rpm_limit': self.rpm or None, 'methods': self.metrics.snapshot()}
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+        self._async_client = None
+        self._async_loop = None
+        self.session.close()
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def get_gemini_client():
+    """
+    Process-wide GeminiClient configured from GEMINI_* settings.
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = GeminiClient()
+        return _default_client
+
+async def close_gemini_client():
+    global _default_client
+    with _default_lock:
+        client, _default_client = _default_client, None
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,53 @@
+from gemini_client import get_gemini_client
+from utils import get_env_int
+
+GENERATION_MODEL = 'models/gemini-1.5-flash-latest'
+GENERATION_CONFIG = {"temperature": 0.2, "maxOutputTokens": 512}
+
+def max_output_tokens():
+    return get_env_int('GENERATION_MAX_OUTPUT_TOKENS', GENERATION_CONFIG['maxOutputTokens'])
+
+def build_prompt(question, clauses):
+    context = "\n\n".join([c['text'] for c in clauses])
+    return f"Context:\n{context}\n\nQuestion: {question}\n\nAnswer with rationale and cite relevant clauses."
+
+def _request_body(prompt):
+    return {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": dict(GENERATION_CONFIG, maxOutputTokens=max_output_tokens())
+    }
+
+def _candidate_text(payload):
+    candidates = payload.get('candidates') or []
+    if not candidates:
+        return ''
+    parts = candidates[0].get('content', {}).get('parts', [])
+    return ''.join(p.get('text', '') for p in parts)
+
+def generate_answer(prompt):
+    """
+    Blocking generateContent call; returns the whole answer.
+    """
+    return _candidate_text(get_gemini_client().post(GENERATION_MODEL, 'generateContent', _request_body(prompt)))
+
+async def agenerate_answer(prompt):
+    payload = await get_gemini_client().apost(GENERATION_MODEL, 'generateContent', _request_body(prompt))
+    return _candidate_text(payload)
+
+def stream_answer_sync(prompt):
+    """
+    Yield answer text chunks as streamGenerateContent produces them.
+    """
+    for payload in get_gemini_client().stream(GENERATION_MODEL, 'streamGenerateContent', _request_body(prompt)):
+        text = _candidate_text(payload)
+        if text:
+            yield text
+
+async def stream_answer(prompt):
+    """
+    Async variant of stream_answer_sync.
+    """
+    async for payload in get_gemini_client().astream(GENERATION_MODEL, 'streamGenerateContent', _request_body(prompt)):
+        text = _candidate_text(payload)
+        if text:
+            yield text
@@ -0,0 +1,248 @@
+import math
+import os
+
+import faiss
+import numpy as np
+
+from utils import get_env_int
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+VECTOR_CODECS = ('float32', 'float16', 'int8')
+REDUCTIONS = ('pca', 'truncate')
+
+def get_index_type():
+    index_type = os.getenv('FAISS_INDEX_TYPE', 'flat').lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported FAISS_INDEX_TYPE: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+    return index_type
+
+def get_vector_codec():
+    codec = os.getenv('FAISS_VECTOR_CODEC', 'float32').lower()
+    if codec not in VECTOR_CODECS:
+        raise ValueError(f"Unsupported FAISS_VECTOR_CODEC: {codec} (expected one of {', '.join(VECTOR_CODECS)})")
+    return codec
+
+def get_reduction():
+    reduction = os.getenv('FAISS_REDUCTION', 'pca').lower()
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unsupported FAISS_REDUCTION: {reduction} (expected one of {', '.join(REDUCTIONS)})")
+    return reduction
+
+def reduced_dim(dim, reduce_dim):
+    """
+    Dimension vectors are indexed at: reduce_dim when it is set and smaller than dim.
+    """
+    return reduce_dim if reduce_dim and 0 < reduce_dim < dim else dim
+
+def index_spec(index_type, dim, codec='float32', reduction='pca', reduce_dim=0):
+    """
+    Short description of an index layout, e.g. 'hnsw', 'flat,float16' or
+    'pca256,ivf_flat,int8'. spec_of(index) describes a built index the same
+    way, so the two can be compared to decide whether to rebuild.
+    """
+    parts = [index_type]
+    if codec != 'float32' and index_type != 'ivf_pq':
+        # PQ codes are already compressed
+        parts.append(codec)
+    d = reduced_dim(dim, reduce_dim)
+    if d < dim:
+        parts.insert(0, f"{reduction}{d}")
+    return ','.join(parts)
+
+def _codec_of(index):
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    sq = getattr(index, 'sq', None)
+    qtype = sq.qtype if sq is not None else None
+    if qtype == faiss.ScalarQuantizer.QT_fp16:
+        return 'float16'
+    if qtype == faiss.ScalarQuantizer.QT_8bit:
+        return 'int8'
+    return 'float32'
+
+def spec_of(index):
+    if not isinstance(index, faiss.IndexPreTransform):
+        return index_spec(index_type_of(index), index.d, _codec_of(index))
+    first = faiss.downcast_VectorTransform(index.chain.at(0))
+    reduction = 'pca' if isinstance(first, faiss.PCAMatrix) else 'truncate'
+    inner = faiss.downcast_index(index.index)
+    return index_spec(index_type_of(inner), index.d, _codec_of(inner), reduction, inner.d)
+
+def needs_training(index_type, codec='float32', reduction='pca', reduce_dim=0, dim=None):
+    """
+    Whether the index must be trained before vectors can be added: IVF
+    types, int8 codes (value ranges) and PCA reduction.
+    """
+    reduced = dim is not None and reduced_dim(dim, reduce_dim) < dim
+    return (index_type in ('ivf_flat', 'ivf_pq') or (codec == 'int8' and index_type != 'ivf_pq')
+            or (reduced and reduction == 'pca'))
+
+def min_training_rows(index_type, codec='float32', reduction='pca', reduce_dim=0, dim=None):
+    """
+    Rows required before an index of this type is built. Until then the
+    corpus is served from an exact flat index.
+    """
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        return get_env_int('FAISS_TRAIN_MIN_ROWS', 20000)
+    if needs_training(index_type, codec, reduction, reduce_dim, dim):
+        return max(get_env_int('FAISS_COMPRESS_MIN_ROWS', 1000), reduced_dim(dim or 0, reduce_dim))
+    return 0
+
+def default_nlist(rows):
+    nlist = get_env_int('FAISS_NLIST', 0) or int(4 * math.sqrt(rows))
+    # faiss wants ~39 training points per centroid
+    return max(1, min(nlist, rows // 39, 65536))
+
+def default_pq_m(dim):
+    m = get_env_int('FAISS_PQ_M', 0)
+    if m:
+        return m
+    # Largest divisor of dim giving sub-vectors of at least 8 dimensions
+    for m in range(dim // 8, 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+SQ_TYPES = {'float16': faiss.ScalarQuantizer.QT_fp16, 'int8': faiss.ScalarQuantizer.QT_8bit}
+
+def _build_inner(index_type, dim, rows, codec):
+    qtype = SQ_TYPES.get(codec)
+    if index_type == 'flat':
+        return faiss.IndexFlatL2(dim) if qtype is None else faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+    if index_type == 'hnsw':
+        M = get_env_int('FAISS_HNSW_M', 32)
+        index = faiss.IndexHNSWFlat(dim, M) if qtype is None else faiss.IndexHNSWSQ(dim, qtype, M)
+        index.hnsw.efConstruction = get_env_int('FAISS_EF_CONSTRUCTION', 80)
+        return index
+    quantizer = faiss.IndexFlatL2(dim)
+    nlist = default_nlist(rows)
+    if index_type == 'ivf_flat':
+        if qtype is not None:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, faiss.METRIC_L2)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist)
+    if index_type == 'ivf_pq':
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, default_pq_m(dim), 8)
+    raise ValueError(f"Unsupported index type: {index_type}")
+
+def _reduction_transforms(reduction, dim, d):
+    if reduction == 'pca':
+        return [faiss.PCAMatrix(dim, d)]
+    # Matryoshka-style: keep the leading dimensions and re-normalise
+    return [faiss.RemapDimensionsTransform(dim, d, False), faiss.NormalizationTransform(d, 2.0)]
+
+def _wrap(transforms, inner):
+    index = faiss.IndexPreTransform(inner)
+    for transform in reversed(transforms):
+        index.prepend_transform(transform)
+    return index
+
+def build_index(index_type, dim, rows=0, codec='float32', reduction='pca', reduce_dim=0):
+    """
+    Create an empty (possibly untrained) index of the given type.
+    rows is the expected corpus size, used to size IVF coarse quantizers.
+    codec float16 / int8 stores scalar-quantized codes instead of float32
+    (ignored for ivf_pq); reduce_dim below dim indexes vectors projected by
+    PCA or truncated to their leading dimensions (reduction), wrapped in an
+    IndexPreTransform so callers keep adding and searching full vectors.
+    """
+    d = reduced_dim(dim, reduce_dim)
+    inner = _build_inner(index_type, d, rows, codec)
+    if d == dim:
+        return inner
+    return _wrap(_reduction_transforms(reduction, dim, d), inner)
+
+def _copy_transform(transform):
+    transform = faiss.downcast_VectorTransform(transform)
+    if isinstance(transform, faiss.NormalizationTransform):
+        return faiss.NormalizationTransform(transform.d_in, transform.norm)
+    if isinstance(transform, faiss.RemapDimensionsTransform):
+        # Only built by _reduction_transforms, which keeps the leading dimensions
+        return faiss.RemapDimensionsTransform(transform.d_in, transform.d_out, False)
+    return faiss.Cloner().clone_VectorTransform(transform)
+
+def empty_flat_like(index):
+    """
+    Exact flat index over the same space as index: full vectors, or the
+    reduced vectors behind the same (trained) transforms. Serves rows added
+    after a memory-mapped snapshot so their distances compare with its hits.
+    """
+    if not isinstance(index, faiss.IndexPreTransform):
+        return faiss.IndexFlatL2(index.d)
+    transforms = [_copy_transform(index.chain.at(i)) for i in range(index.chain.size())]
+    return _wrap(transforms, faiss.IndexFlatL2(index.index.d))
+
+def train_index(index, vectors):
+    """
+    Train on a random sample of at most FAISS_TRAIN_SAMPLE rows.
+    vectors may be a memory-mapped array.
+    """
+    if index.is_trained:
+        return
+    sample = get_env_int('FAISS_TRAIN_SAMPLE', 100000)
+    if len(vectors) > sample:
+        rows = np.sort(np.random.default_rng(0).choice(len(vectors), sample, replace=False))
+        vectors = vectors[rows]
+    index.train(np.ascontiguousarray(vectors, dtype='float32'))
+
+def _unwrap(index):
+    # Indexes here are already concrete types; only the wrapped one needs a downcast
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+
+def set_search_params(index):
+    """
+    Apply query-time knobs (nprobe / efSearch) after building or loading.
+    """
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = get_env_int('FAISS_EF_SEARCH', 64)
+        return
+    try:
+        faiss.extract_index_ivf(index).nprobe = get_env_int('FAISS_NPROBE', 16)
+    except RuntimeError:
+        pass
+
+def search_params(index, selector, exhaustive=False):
+    """
+    SearchParameters restricting a search to the ids accepted by selector,
+    carrying over the index's own nprobe / efSearch (the parameter objects
+    would otherwise reset them to faiss defaults). exhaustive=True probes
+    every IVF list and widens HNSW to the whole graph, so a restricted
+    search returns every accepted id it can. None when unrestricted.
+    """
+    if selector is None and not exhaustive:
+        return None
+    if isinstance(index, faiss.IndexPreTransform):
+        inner = search_params(faiss.downcast_index(index.index), selector, exhaustive)
+        params = faiss.SearchParametersPreTransform()
+        params.index_params = inner
+        # Keep the inner parameters alive: the wrapper only holds a pointer
+        params.referenced_objects = [inner]
+        return params
+    if isinstance(index, faiss.IndexHNSW):
+        ef = max(index.hnsw.efSearch, index.ntotal) if exhaustive else index.hnsw.efSearch
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nlist if exhaustive else index.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+def index_type_of(index):
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf_flat'
+    return 'flat'
+
+def index_memory_bytes(index):
+    """
+    Approximate RAM held by an in-memory index: vector codes plus HNSW
+    links or IVF list ids (transforms of reduced indexes are not counted).
+    """
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return index.ntotal * (faiss.downcast_index(index.storage).sa_code_size() + 4 * index.hnsw.nb_neighbors(0))
+    if isinstance(index, faiss.IndexIVF):
+        return index.ntotal * (index.code_size + 8)
+    return index.ntotal * index.sa_code_size()
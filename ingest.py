@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from chunker import get_chunker
+from embedding import aget_gemini_embeddings
+from embedding_cache import normalize_text
+from metrics import span
+from parser import page_ranges, parse_file, parse_pdf_pages, pdf_page_count
+from utils import get_env_int
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.eml')
+
+_parse_pool = None
+
+def get_parse_pool():
+    """
+    Shared process pool for CPU-bound parsing. Uses spawn so workers do not
+    inherit the server's threads, sockets or SQLite handles.
+    """
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=get_env_int('PARSE_WORKERS', os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+    _parse_pool = None
+
+class IndexWriter:
+    """
+    Single writer task that owns all FaissIndex mutations. Ingestion tasks
+    submit (embeddings, clauses), document commits and deletes, and await
+    them; they run one at a time in a worker thread so the event loop keeps
+    serving requests.
+    """
+
+    def __init__(self, get_index):
+        # get_index(dim) returns the FaissIndex to write to, creating it if
+        # needed; get_index(None) returns it only if it already exists
+        self.get_index = get_index
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.document_locks = {}
+        self.running = False
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def document_lock(self, name):
+        """
+        Serializes ingestion of the same file name, so concurrent uploads of
+        one document cannot both append a new version.
+        """
+        return self.document_locks.setdefault(name, asyncio.Lock())
+
+    @property
+    def busy(self):
+        """
+        True while a write is queued or a document is being ingested.
+        """
+        return self.running or not self.queue.empty() or any(lock.locked() for lock in self.document_locks.values())
+
+    async def _enqueue(self, dim, operation):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((dim, operation, future))
+        return await future
+
+    async def submit(self, embeddings, clauses):
+        def add(index):
+            index.add(embeddings, clauses)
+            return len(clauses)
+        return await self._enqueue(embeddings.shape[1], add)
+
+    async def finish_document(self, name, file_hash, clauses):
+        return await self._enqueue(None, lambda index: index.finish_document(name, file_hash, clauses))
+
+    async def delete_document(self, name):
+        return await self._enqueue(None, lambda index: index.delete_document(name))
+
+    async def _run(self):
+        while True:
+            dim, operation, future = await self.queue.get()
+            self.running = True
+            try:
+                index = self.get_index(dim)
+                result = None if index is None else await asyncio.to_thread(operation, index)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.running = False
+                self.queue.task_done()
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def clause_hash(text):
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()[:16]
+
+async def parse_file_async(path):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_parse_pool(), parse_file, path)
+
+async def iter_clause_batches(path):
+    """
+    Yield lists of clauses in document order while later parts are still
+    being parsed. PDFs are split into page ranges spread across the parse
+    pool (two ranges per worker in flight); other formats are one batch.
+    """
+    if not path.lower().endswith('.pdf'):
+        yield await parse_file_async(path)
+        return
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    ahead = 2 * get_env_int('PARSE_WORKERS', os.cpu_count() or 1)
+    in_flight = deque()
+    try:
+        for start, end in page_ranges(await asyncio.to_thread(pdf_page_count, path)):
+            in_flight.append(loop.run_in_executor(pool, parse_pdf_pages, path, start, end))
+            if len(in_flight) >= ahead:
+                yield await in_flight.popleft()
+        while in_flight:
+            yield await in_flight.popleft()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+async def _timed(batches, stage):
+    """
+    Re-yield an async iterator, timing each wait for its next item as stage.
+    """
+    iterator = batches.__aiter__()
+    while True:
+        with span(stage):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
+
+async def ingest_file(path, writer, on_progress=None):
+    """
+    Parse, chunk, embed and index one file. Returns the number of chunks
+    indexed (0 when the file is unchanged since it was last indexed).
+
+    A changed file is indexed as a new version: chunks whose content hash
+    matches a chunk of the previous version reuse its stored vector instead
+    of being re-embedded, and the previous version's rows are deleted once
+    the new one is written. Chunks are embedded and written in slices as
+    soon as their pages are parsed, so a large PDF starts indexing before
+    parsing finishes. on_progress(chunks_embedded, chunks_parsed) is called
+    after each slice.
+    """
+    name = os.path.basename(path)
+    async with writer.document_lock(name):
+        with span('hash'):
+            file_hash = await asyncio.to_thread(file_digest, path)
+        index = writer.get_index(None)
+        if index is not None and index.document_hash(name) == file_hash:
+            if on_progress:
+                on_progress(0, 0)
+            return 0
+        # Only hashes are kept across awaits: a vacuum may renumber rows meanwhile
+        reusable = await asyncio.to_thread(index.clause_hashes, name) if index is not None else set()
+
+        step = get_env_int('EMBED_BATCH_SIZE', 100) * get_env_int('EMBED_CONCURRENCY', 4)
+        pending, parsed, indexed = [], 0, 0
+
+        async def flush(clauses):
+            for c in clauses:
+                c['hash'] = clause_hash(c['text'])
+            reused = {}
+            wanted = {c['hash'] for c in clauses} & reusable
+            if wanted:
+                with span('reuse_vectors'):
+                    reused = await asyncio.to_thread(index.vectors_for_hashes, name, wanted)
+            if not reused:
+                embeddings = await aget_gemini_embeddings([c['text'] for c in clauses])
+            else:
+                embeddings = np.empty((len(clauses), index.dim), dtype='float32')
+                fresh = []
+                for i, c in enumerate(clauses):
+                    if c['hash'] in reused:
+                        embeddings[i] = reused[c['hash']]
+                    else:
+                        fresh.append(i)
+                if fresh:
+                    embeddings[fresh] = await aget_gemini_embeddings([clauses[i]['text'] for i in fresh])
+            with span('index_write'):
+                return await writer.submit(embeddings, clauses)
+
+        chunker = get_chunker()
+        async for batch in _timed(iter_clause_batches(path), 'parse'):
+            if chunker:
+                with span('chunk'):
+                    batch = chunker.feed(batch)
+            parsed += len(batch)
+            pending.extend(batch)
+            while len(pending) >= step:
+                indexed += await flush(pending[:step])
+                pending = pending[step:]
+                if on_progress:
+                    on_progress(indexed, parsed)
+        if chunker:
+            with span('chunk'):
+                tail = chunker.finish()
+            parsed += len(tail)
+            pending.extend(tail)
+        while pending:
+            indexed += await flush(pending[:step])
+            pending = pending[step:]
+        with span('index_write'):
+            await writer.finish_document(name, file_hash, indexed)
+        if on_progress:
+            on_progress(indexed, parsed)
+        return indexed
+
+async def ingest_files(paths, writer):
+    """
+    Ingest several files concurrently. Returns one result per path, either a
+    clause count or the exception raised for that file.
+    """
+    return await asyncio.gather(*[ingest_file(p, writer) for p in paths], return_exceptions=True)
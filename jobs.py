@@ -0,0 +1,304 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from ingest import ingest_file
+from utils import get_env_float, get_env_int
+
+DOCUMENT_NOT_INDEXED = "Document not indexed"
+
+class JobStore:
+    """
+    SQLite-backed record of ingestion jobs and their per-file progress, so
+    jobs can be polled by id and resumed after a restart. WAL mode lets the
+    query workers of a multi-process server submit jobs that the writer
+    process picks up.
+    """
+
+    def __init__(self, path='ingest_jobs.sqlite'):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    collection TEXT NOT NULL DEFAULT 'default',
+                    operation TEXT NOT NULL DEFAULT 'ingest'
+                );
+                CREATE TABLE IF NOT EXISTS job_files (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    clauses_total INTEGER,
+                    clauses_embedded INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    started_at REAL,
+                    finished_at REAL,
+                    PRIMARY KEY (job_id, idx)
+                );
+            ''')
+            # Databases created before collections / operations existed
+            columns = [r[1] for r in self.conn.execute('PRAGMA table_info(jobs)')]
+            if 'collection' not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN collection TEXT NOT NULL DEFAULT 'default'")
+            if 'operation' not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN operation TEXT NOT NULL DEFAULT 'ingest'")
+            self.conn.commit()
+
+    def create(self, job_id, files, collection='default', operation='ingest'):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO jobs (id, status, created_at, updated_at, collection, operation) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, 'queued', now, now, collection, operation)
+            )
+            self.conn.executemany(
+                'INSERT INTO job_files (job_id, idx, filename, path, status) VALUES (?, ?, ?, ?, ?)',
+                [(job_id, i, name, path, 'queued') for i, (name, path) in enumerate(files)]
+            )
+            self.conn.commit()
+
+    def update_file(self, job_id, idx, **fields):
+        columns = ', '.join(f"{k} = ?" for k in fields)
+        with self.lock:
+            self.conn.execute(
+                f"UPDATE job_files SET {columns} WHERE job_id = ? AND idx = ?",
+                (*fields.values(), job_id, idx)
+            )
+            self.conn.commit()
+
+    def refresh_status(self, job_id):
+        with self.lock:
+            statuses = [r[0] for r in self.conn.execute(
+                'SELECT status FROM job_files WHERE job_id = ?', (job_id,)
+            )]
+            if all(s in ('done', 'failed') for s in statuses):
+                status = 'failed' if all(s == 'failed' for s in statuses) else (
+                    'completed_with_errors' if 'failed' in statuses else 'completed')
+            elif any(s != 'queued' for s in statuses):
+                status = 'running'
+            else:
+                status = 'queued'
+            self.conn.execute('UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?', (status, time.time(), job_id))
+            self.conn.commit()
+            return status
+
+    def pending_files(self):
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(
+                "SELECT f.job_id, f.idx, f.filename, f.path, j.collection, j.operation "
+                "FROM job_files f JOIN jobs j ON j.id = f.job_id "
+                "WHERE f.status IN ('queued', 'running') ORDER BY f.rowid"
+            )]
+
+    def file_status(self, job_id, idx):
+        with self.lock:
+            row = self.conn.execute('SELECT status FROM job_files WHERE job_id = ? AND idx = ?', (job_id, idx)).fetchone()
+            return row[0] if row else None
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = [dict(r) for r in self.conn.execute(
+                'SELECT * FROM job_files WHERE job_id = ? ORDER BY idx', (job_id,)
+            )]
+        return _job_report(dict(job), files)
+
+    def list(self, limit=50):
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(
+                'SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,)
+            )]
+
+def _job_report(job, files):
+    now = time.time()
+    report_files = []
+    for f in files:
+        elapsed = (f['finished_at'] or now) - f['started_at'] if f['started_at'] else None
+        report_files.append({
+            "file": f['filename'],
+            "status": f['status'],
+            "clauses_total": f['clauses_total'],
+            "clauses_embedded": f['clauses_embedded'],
+            "progress": round(f['clauses_embedded'] / f['clauses_total'], 4) if f['clauses_total'] else None,
+            "clauses_per_second": round(f['clauses_embedded'] / elapsed, 2) if elapsed else None,
+            "error": f['error'],
+        })
+    embedded = sum(f['clauses_embedded'] for f in files)
+    started = [f['started_at'] for f in files if f['started_at']]
+    elapsed = (max(f['finished_at'] or now for f in files) - min(started)) if started else None
+    return {
+        "job_id": job['id'],
+        "collection": job['collection'],
+        "operation": job['operation'],
+        "status": job['status'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at'],
+        "clauses_embedded": embedded,
+        "clauses_per_second": round(embedded / elapsed, 2) if elapsed else None,
+        "errors": [{"file": f['filename'], "error": f['error']} for f in files if f['error']],
+        "files": report_files,
+    }
+
+class JobManager:
+    """
+    Background ingestion: uploads are spooled to disk, recorded in the
+    JobStore and processed by a fixed pool of asyncio workers, each file
+    written through its collection's IndexWriter. Besides 'ingest', a job
+    can be a 'delete_document', 'create_collection', 'drop_collection',
+    'clear_collection' or 'import_collection' operation.
+
+    With run_workers=False (query workers of a multi-process server) jobs
+    are only recorded; the writer process runs a manager with
+    poll_interval set, which picks up jobs submitted by other processes.
+    """
+
+    def __init__(self, collections, store=None, spool_dir=None, workers=None, run_workers=True,
+                 poll_interval=None):
+        self.collections = collections
+        self.store = store or JobStore(os.getenv('JOBS_DB_PATH', 'ingest_jobs.sqlite'))
+        self.spool_dir = spool_dir or os.getenv('JOBS_SPOOL_DIR', 'ingest_jobs')
+        self.num_workers = workers or get_env_int('INGEST_WORKERS', 2)
+        self.run_workers = run_workers
+        self.poll_interval = poll_interval
+        self.queue = asyncio.Queue()
+        self.enqueued = set()
+        self.tasks = []
+
+    def start(self):
+        """
+        Start workers and re-enqueue files left unfinished by a previous run.
+        Clauses embedded before the crash come back from the embedding cache.
+        """
+        if self.tasks or not self.run_workers:
+            return
+        for f in self.store.pending_files():
+            self.store.update_file(f['job_id'], f['idx'], status='queued', clauses_embedded=0)
+            self._enqueue(f)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        if self.poll_interval:
+            self.tasks.append(asyncio.create_task(self._poll()))
+
+    def _enqueue(self, f):
+        self.enqueued.add((f['job_id'], f['idx']))
+        self.queue.put_nowait(f)
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for f in await asyncio.to_thread(self.store.pending_files):
+                if (f['job_id'], f['idx']) not in self.enqueued:
+                    self._enqueue(f)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, uploads, collection='default'):
+        """
+        uploads is a list of (filename, bytes). Returns the new job id.
+        """
+        self.start()
+        job_id = uuid.uuid4().hex
+        files = await asyncio.to_thread(self._spool, job_id, uploads)
+        return self._record(job_id, files, collection, 'ingest')
+
+    async def submit_operation(self, operation, target, collection='default'):
+        """
+        Queue a 'delete_document' (target is the file name),
+        'create_collection' (target is its settings as JSON),
+        'drop_collection', 'clear_collection' or 'import_collection' (target
+        is the bulk_ingest build directory) job. Returns the new job id.
+        """
+        self.start()
+        return self._record(uuid.uuid4().hex, [(target, '')], collection, operation)
+
+    def _record(self, job_id, files, collection, operation):
+        self.store.create(job_id, files, collection, operation)
+        if self.run_workers:
+            for i, (name, path) in enumerate(files):
+                self._enqueue({'job_id': job_id, 'idx': i, 'filename': name, 'path': path,
+                               'collection': collection, 'operation': operation})
+        return job_id
+
+    async def wait(self, job_id, interval=None):
+        """
+        Wait until a job has finished (in this or another process) and return its report.
+        """
+        interval = interval or get_env_float('JOBS_POLL_INTERVAL', 0.2)
+        while True:
+            report = await asyncio.to_thread(self.store.get, job_id)
+            if report['status'] not in ('queued', 'running'):
+                return report
+            await asyncio.sleep(interval)
+
+    def _spool(self, job_id, uploads):
+        files = []
+        for i, (name, content) in enumerate(uploads):
+            path = os.path.join(self.spool_dir, job_id, str(i), os.path.basename(name))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            files.append((name, path))
+        return files
+
+    async def _worker(self):
+        while True:
+            f = await self.queue.get()
+            try:
+                await self._process(f)
+            finally:
+                self.enqueued.discard((f['job_id'], f['idx']))
+                self.queue.task_done()
+
+    async def _process(self, f):
+        job_id, idx, collection = f['job_id'], f['idx'], f['collection']
+        if self.store.file_status(job_id, idx) in ('done', 'failed'):
+            # A poll read it as pending just before it finished
+            return
+        self.store.update_file(job_id, idx, status='running', started_at=time.time(), error=None)
+        self.store.refresh_status(job_id)
+
+        def on_progress(embedded, total):
+            self.store.update_file(job_id, idx, clauses_embedded=embedded, clauses_total=total)
+
+        try:
+            if f['operation'] == 'delete_document':
+                with self.collections.using(collection):
+                    deleted = await self.collections.writer(collection).delete_document(f['filename'])
+                if deleted is None:
+                    raise LookupError(f"{DOCUMENT_NOT_INDEXED}: {f['filename']}")
+                on_progress(deleted, deleted)
+            elif f['operation'] == 'create_collection':
+                await asyncio.to_thread(self.collections.create, collection, **json.loads(f['filename']))
+            elif f['operation'] == 'drop_collection':
+                await asyncio.to_thread(self.collections.drop, collection)
+            elif f['operation'] == 'clear_collection':
+                await asyncio.to_thread(self.collections.clear, collection)
+            elif f['operation'] == 'import_collection':
+                index = await asyncio.to_thread(self.collections.import_build, collection, f['filename'])
+                on_progress(index.live_count, index.live_count)
+            else:
+                with self.collections.using(collection):
+                    await ingest_file(f['path'], self.collections.writer(collection), on_progress)
+            self.store.update_file(job_id, idx, status='done', finished_at=time.time())
+        except Exception as e:
+            self.store.update_file(job_id, idx, status='failed', finished_at=time.time(), error=str(e))
+        if self.store.refresh_status(job_id) in ('completed', 'completed_with_errors', 'failed'):
+            shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
@@ -0,0 +1,221 @@
+"""
+Process-wide metrics for the query and ingestion pipelines.
+
+span(stage) times one stage of work: the duration is observed in the
+lexiq_stage_duration_seconds histogram and, inside track_timings() (one per
+HTTP request), added to that request's per-stage timings. Stages that run
+concurrently for one request, such as the files of one upload, are summed.
+render() returns every histogram plus the collectors' current values in the
+Prometheus text format. Each process keeps its own metrics.
+"""
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import get_env_float
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+_timings = contextvars.ContextVar('lexiq_timings', default=None)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def lines(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets + (float('inf'),), series['buckets'] + [series['count']]):
+                    out.append(f"{self.name}_bucket{_labels(key + (('le', _number(bound)),))} {count}")
+                out.append(f"{self.name}_sum{_labels(key)} {series['sum']!r}")
+                out.append(f"{self.name}_count{_labels(key)} {series['count']}")
+        return out
+
+class Registry:
+    """
+    Histograms observed as work happens, plus collectors: callables run at
+    scrape time that return (name, type, help, [(labels dict, value), ...])
+    tuples for counters and gauges kept elsewhere (caches, client, indexes).
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, help, buckets)
+            return self.histograms[name]
+
+    def add_collector(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self):
+        with self.lock:
+            histograms, collectors = list(self.histograms.values()), list(self.collectors)
+        lines = []
+        for histogram in histograms:
+            lines.extend(histogram.lines())
+        for collector in collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_labels(sorted(labels.items()))} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('lexiq_stage_duration_seconds', 'Duration of pipeline stages')
+REQUEST_SECONDS = REGISTRY.histogram('lexiq_http_request_duration_seconds', 'HTTP request duration by route')
+
+def observe(name, value, help='', buckets=LATENCY_BUCKETS, **labels):
+    REGISTRY.histogram(name, help, buckets).observe(value, **labels)
+
+@contextmanager
+def track_timings():
+    """
+    Collect the spans of the enclosed work (including tasks and threads it
+    starts) into a {stage: ms} dict.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def current_timings():
+    """
+    The enclosing track_timings() dict with values rounded to 0.1 ms, or None.
+    """
+    timings = _timings.get()
+    return None if timings is None else {stage: round(ms, 1) for stage, ms in timings.items()}
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+_profile_lock = threading.Lock()
+_profile_ids = itertools.count(1)
+
+def _profile_path(directory, name, suffix):
+    slug = ''.join(c if c.isalnum() else '_' for c in name).strip('_')
+    return os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_ids)}-{slug}{suffix}")
+
+@contextmanager
+def profile_slow(name):
+    """
+    Opt-in (PROFILE_SLOW_MS > 0): profile the enclosed block and write the
+    trace to PROFILE_DIR when it took longer than PROFILE_SLOW_MS. Uses
+    pyinstrument (HTML, follows awaits) when installed, otherwise cProfile
+    (.prof for pstats / snakeviz, which also samples other requests running
+    on the event loop meanwhile). One block per process is profiled at a
+    time; others run unprofiled.
+    """
+    threshold_ms = get_env_float('PROFILE_SLOW_MS', 0.0)
+    if threshold_ms <= 0 or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        try:
+            from pyinstrument import Profiler
+            profiler = Profiler(async_mode='enabled')
+            profiler.start()
+        except ImportError:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if hasattr(profiler, 'output_html'):
+                profiler.stop()
+            else:
+                profiler.disable()
+            if (time.perf_counter() - start) * 1000 >= threshold_ms:
+                directory = os.getenv('PROFILE_DIR', 'profiles')
+                os.makedirs(directory, exist_ok=True)
+                if hasattr(profiler, 'output_html'):
+                    with open(_profile_path(directory, name, '.html'), 'w', encoding='utf-8') as f:
+                        f.write(profiler.output_html())
+                else:
+                    profiler.dump_stats(_profile_path(directory, name, '.prof'))
+    finally:
+        _profile_lock.release()
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: per-request stage timings, the request duration
+    histogram (by route template) and the slow-request profiler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        with track_timings(), profile_slow(f"{scope['method']} {scope['path']}"):
+            try:
+                await self.app(scope, receive, send_status)
+            finally:
+                route = scope.get('route')
+                REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope['method'],
+                                        route=getattr(route, 'path', 'unmatched'), status=status)
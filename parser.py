@@ -1,58 +1,122 @@
 import fitz  # PyMuPDF
 import docx
 from mailparser import parse_from_file
+import multiprocessing
 import os
-from typing import List, Dict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List
 
-def parse_pdf(file_path: str) -> List[Dict]:
+from utils import get_env_int
+
+def iter_pdf(file_path: str, start_page: int = 1, end_page: int = None) -> Iterator[Dict]:
+    """
+    Yield clauses page by page; only the current page is held in memory.
+    start_page/end_page (1-based, inclusive) restrict parsing to a page range.
+    """
     doc = fitz.open(file_path)
-    results = []
-    for page_num, page in enumerate(doc, 1):
-        text = page.get_text('blocks')
-        for i, block in enumerate(text):
-            if block[4].strip():
-                results.append({
-                    'text': block[4].strip(),
-                    'clause_id': f"{os.path.basename(file_path)}_p{page_num}_b{i}",
-                    'page': page_num,
-                    'file': os.path.basename(file_path)
-                })
-    return results
+    try:
+        end_page = min(end_page or doc.page_count, doc.page_count)
+        for page_num in range(start_page, end_page + 1):
+            text = doc[page_num - 1].get_text('blocks')
+            for i, block in enumerate(text):
+                if block[4].strip():
+                    yield {
+                        'text': block[4].strip(),
+                        'clause_id': f"{os.path.basename(file_path)}_p{page_num}_b{i}",
+                        'page': page_num,
+                        'file': os.path.basename(file_path)
+                    }
+    finally:
+        doc.close()
 
-def parse_docx(file_path: str) -> List[Dict]:
+def parse_pdf(file_path: str) -> List[Dict]:
+    return list(iter_pdf(file_path))
+
+def parse_pdf_pages(file_path: str, start_page: int, end_page: int) -> List[Dict]:
+    # Top-level so process pool workers can run it
+    return list(iter_pdf(file_path, start_page, end_page))
+
+def pdf_page_count(file_path: str) -> int:
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+def page_ranges(page_count: int, pages_per_task: int = None):
+    """
+    Split 1..page_count into (start, end) ranges of PARSE_PAGES_PER_TASK pages.
+    """
+    pages_per_task = pages_per_task or get_env_int('PARSE_PAGES_PER_TASK', 50)
+    for start in range(1, page_count + 1, pages_per_task):
+        yield start, min(start + pages_per_task - 1, page_count)
+
+def iter_pdf_parallel(file_path: str, executor=None, pages_per_task: int = None) -> Iterator[Dict]:
+    """
+    Multi-process iter_pdf: page ranges are parsed across the executor's
+    workers (a spawn-based pool of PARSE_WORKERS processes if none is given)
+    and yielded in page order as soon as each range is done. Only a few
+    ranges per worker are in flight, so memory stays bounded.
+    """
+    workers = get_env_int('PARSE_WORKERS', os.cpu_count() or 1)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    in_flight = deque()
+    ahead = 2 * workers
+    try:
+        for start, end in page_ranges(pdf_page_count(file_path), pages_per_task):
+            in_flight.append(executor.submit(parse_pdf_pages, file_path, start, end))
+            if len(in_flight) >= ahead:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def iter_docx(file_path: str) -> Iterator[Dict]:
     doc = docx.Document(file_path)
-    results = []
     for i, para in enumerate(doc.paragraphs):
         if para.text.strip():
-            results.append({
+            yield {
                 'text': para.text.strip(),
                 'clause_id': f"{os.path.basename(file_path)}_para{i}",
                 'page': None,
                 'file': os.path.basename(file_path)
-            })
-    return results
+            }
 
-def parse_eml(file_path: str) -> List[Dict]:
+def parse_docx(file_path: str) -> List[Dict]:
+    return list(iter_docx(file_path))
+
+def iter_eml(file_path: str) -> Iterator[Dict]:
     mail = parse_from_file(file_path)
     body = mail.body or ''
-    results = []
     for i, para in enumerate(body.split('\n\n')):
         if para.strip():
-            results.append({
+            yield {
                 'text': para.strip(),
                 'clause_id': f"{os.path.basename(file_path)}_eml{i}",
                 'page': None,
                 'file': os.path.basename(file_path)
-            })
-    return results
+            }
 
-def parse_file(file_path: str) -> List[Dict]:
+def parse_eml(file_path: str) -> List[Dict]:
+    return list(iter_eml(file_path))
+
+def iter_file(file_path: str) -> Iterator[Dict]:
+    """
+    Streaming parse_file: yields clauses as they are extracted.
+    """
     ext = os.path.splitext(file_path)[1].lower()
     if ext == '.pdf':
-        return parse_pdf(file_path)
+        return iter_pdf(file_path)
     elif ext == '.docx':
-        return parse_docx(file_path)
+        return iter_docx(file_path)
     elif ext == '.eml':
-        return parse_eml(file_path)
+        return iter_eml(file_path)
     else:
-        raise ValueError(f"Unsupported file type: {ext}")
\ No newline at end of file
+        raise ValueError(f"Unsupported file type: {ext}")
+
+def parse_file(file_path: str) -> List[Dict]:
+    return list(iter_file(file_path))
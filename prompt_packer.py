@@ -0,0 +1,164 @@
+"""
+Prompt assembly under an input token budget.
+
+Clauses arrive best first (retrieval / re-ranking order). The packer drops
+sentences already in the prompt (chunk overlap, repeated boilerplate), cuts
+clauses longer than PROMPT_CLAUSE_TOKENS down to an extractive summary (their
+sentences sharing most words with the question), and stops adding context at
+PROMPT_BUDGET_TOKENS, still fitting smaller clauses that come later. Token
+counts use the same ~4 characters per token estimate as embedding batching.
+"""
+import re
+import threading
+from collections import deque
+
+from chunker import SENTENCE_RE
+from embedding_cache import normalize_text
+from generation import build_prompt, max_output_tokens
+from metrics import TOKEN_BUCKETS, observe, span
+from utils import estimate_tokens, get_env_int
+
+WORD_RE = re.compile(r'\w+')
+GAP = ' … '
+
+def _sentences(text):
+    return [s for s in SENTENCE_RE.split(text.strip()) if s]
+
+def _sentence_key(sentence):
+    return normalize_text(sentence).lower()
+
+def _extract(sentences, terms, budget):
+    """
+    At most budget tokens of the sentences: those sharing most words with
+    the question, in their original order, with gaps marked.
+    """
+    overlap = [len(terms & set(WORD_RE.findall(s.lower()))) for s in sentences]
+    chosen, used = [], 0
+    for i in sorted(range(len(sentences)), key=lambda i: (-overlap[i], i)):
+        cost = estimate_tokens(sentences[i])
+        if used + cost <= budget:
+            chosen.append(i)
+            used += cost
+    if not chosen:
+        # One sentence longer than the whole allowance: keep its beginning
+        best = max(range(len(sentences)), key=lambda i: (overlap[i], -i))
+        return sentences[best][:budget * 4].rsplit(' ', 1)[0] + GAP.rstrip()
+    chosen.sort()
+    text = sentences[chosen[0]]
+    for prev, i in zip(chosen, chosen[1:]):
+        text += (' ' if i == prev + 1 else GAP) + sentences[i]
+    return text
+
+class PromptPacker:
+    """
+    Builds the generation prompt for a question and its ranked clauses within
+    budget_tokens, and keeps per-endpoint prompt size statistics.
+    """
+
+    def __init__(self, budget_tokens=3000, clause_tokens=800, min_fragment_tokens=40, window=1000):
+        self.budget_tokens = budget_tokens
+        self.clause_tokens = clause_tokens
+        self.min_fragment_tokens = min_fragment_tokens
+        self.window = window
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def pack(self, question, clauses):
+        """
+        Return (prompt, usage); usage holds the estimated token counts and
+        what happened to the clauses.
+        """
+        remaining = self.budget_tokens - estimate_tokens(build_prompt(question, []))
+        terms = set(WORD_RE.findall(question.lower()))
+        seen = set()
+        packed, truncated, dropped, duplicate_tokens = [], 0, 0, 0
+        for clause in clauses:
+            sentences = []
+            for sentence in _sentences(clause['text']):
+                key = _sentence_key(sentence)
+                if key in seen:
+                    duplicate_tokens += estimate_tokens(sentence)
+                else:
+                    seen.add(key)
+                    sentences.append(sentence)
+            if not sentences:
+                dropped += 1
+                continue
+            text = ' '.join(sentences)
+            limit = min(self.clause_tokens, remaining)
+            if estimate_tokens(text) > limit:
+                if limit < self.min_fragment_tokens:
+                    dropped += 1
+                    continue
+                text = _extract(sentences, terms, limit)
+                truncated += 1
+            packed.append(dict(clause, text=text))
+            remaining -= estimate_tokens(text) + 1
+        prompt = build_prompt(question, packed)
+        return prompt, {
+            "prompt_tokens": estimate_tokens(prompt),
+            "budget_tokens": self.budget_tokens,
+            "max_output_tokens": max_output_tokens(),
+            "clauses_packed": len(packed),
+            "clauses_truncated": truncated,
+            "clauses_dropped": dropped,
+            "duplicate_tokens_removed": duplicate_tokens,
+        }
+
+    def record(self, endpoint, usage):
+        with self.lock:
+            e = self.endpoints.get(endpoint)
+            if e is None:
+                e = self.endpoints[endpoint] = {'prompts': 0, 'truncated': 0, 'dropped': 0,
+                                                'tokens': deque(maxlen=self.window)}
+            e['prompts'] += 1
+            e['truncated'] += usage['clauses_truncated']
+            e['dropped'] += usage['clauses_dropped']
+            e['tokens'].append(usage['prompt_tokens'])
+
+    def stats(self):
+        with self.lock:
+            report = {}
+            for endpoint, e in self.endpoints.items():
+                tokens = sorted(e['tokens'])
+                pick = lambda q: tokens[min(len(tokens) - 1, int(q * len(tokens)))]
+                report[endpoint] = {
+                    'prompts': e['prompts'],
+                    'clauses_truncated': e['truncated'],
+                    'clauses_dropped': e['dropped'],
+                    'prompt_tokens_p50': pick(0.5) if tokens else None,
+                    'prompt_tokens_p95': pick(0.95) if tokens else None,
+                    'prompt_tokens_max': tokens[-1] if tokens else None,
+                }
+            return {'budget_tokens': self.budget_tokens, 'max_output_tokens': max_output_tokens(),
+                    'endpoints': report}
+
+_default_packer = None
+_default_lock = threading.Lock()
+
+def get_prompt_packer():
+    """
+    Process-wide PromptPacker configured from PROMPT_* settings.
+    """
+    global _default_packer
+    with _default_lock:
+        if _default_packer is None:
+            _default_packer = PromptPacker(
+                budget_tokens=get_env_int('PROMPT_BUDGET_TOKENS', 3000),
+                clause_tokens=get_env_int('PROMPT_CLAUSE_TOKENS', 800),
+                min_fragment_tokens=get_env_int('PROMPT_MIN_FRAGMENT_TOKENS', 40)
+            )
+        return _default_packer
+
+def pack_prompt(question, clauses, endpoint=None):
+    """
+    Pack a prompt with the process-wide packer, counting it under endpoint.
+    """
+    packer = get_prompt_packer()
+    with span('pack_prompt'):
+        prompt, usage = packer.pack(question, clauses)
+    if endpoint is not None:
+        packer.record(endpoint, usage)
+        observe('lexiq_prompt_tokens', usage['prompt_tokens'], 'Estimated prompt tokens per generation',
+                TOKEN_BUCKETS, endpoint=endpoint)
+    return prompt, usage
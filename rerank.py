@@ -0,0 +1,232 @@
+"""
+Post-retrieval re-ranking between FaissIndex retrieval and prompt assembly.
+
+Retrieval over-fetches RERANK_CANDIDATES clauses; this stage drops
+near-identical ones, picks a diverse top_k with maximal marginal relevance
+(MMR) over the stored clause vectors and, in 'cross-encoder' mode, re-orders
+them with a small local CPU cross-encoder (sentence-transformers). The
+cross-encoder is skipped when the request would overrun RERANK_BUDGET_MS.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from metrics import span
+from utils import get_env_float, get_env_int, get_search_mode
+
+RERANK_MODES = ('none', 'mmr', 'cross-encoder')
+DEFAULT_CROSS_ENCODER = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+def get_rerank_mode(mode=None):
+    mode = (mode or os.getenv('RERANK', 'none')).lower()
+    if mode not in RERANK_MODES:
+        raise ValueError(f"Unsupported rerank mode: {mode}")
+    return mode
+
+def _normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def duplicate_mask(clauses, similarity=None, threshold=0.95):
+    """
+    Boolean mask of clauses to keep, in retrieval order: a clause is dropped
+    when its normalised text matches, or its cosine similarity to the vector
+    of an earlier kept clause reaches threshold.
+    """
+    keep = np.ones(len(clauses), dtype=bool)
+    seen = set()
+    for n, clause in enumerate(clauses):
+        key = clause.get('hash') or normalize_text(clause['text']).lower()
+        if key in seen:
+            keep[n] = False
+        seen.add(key)
+    if similarity is not None:
+        duplicates = np.triu(similarity >= threshold, 1)
+        for n in range(len(clauses)):
+            if keep[n]:
+                keep[duplicates[n]] = False
+    return keep
+
+def mmr(relevance, similarity, top_k, lambda_=0.7):
+    """
+    Maximal marginal relevance: greedily pick the candidate maximising
+    lambda_ * relevance - (1 - lambda_) * (max similarity to those picked).
+    Each pick is one vectorised update over the candidate similarity matrix.
+    Returns candidate positions in pick order.
+    """
+    relevance = np.asarray(relevance, dtype='float32')
+    penalty = np.zeros(len(relevance), dtype='float32')
+    available = np.ones(len(relevance), dtype=bool)
+    picks = []
+    for _ in range(min(top_k, len(relevance))):
+        scores = np.where(available, lambda_ * relevance - (1 - lambda_) * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        picks.append(best)
+        available[best] = False
+        penalty = np.maximum(penalty, similarity[best])
+    return picks
+
+class Reranker:
+    """
+    Configured from RERANK_* settings; one instance per process. The latency
+    budget compares the time a request has already spent plus the expected
+    cross-encoder cost (moving average, scaled by the calls already running)
+    with budget_ms, so under load the cross-encoder is skipped and MMR's order
+    is used instead.
+    """
+
+    def __init__(self, candidates=20, lambda_=0.7, dedupe_similarity=0.95, model_name=DEFAULT_CROSS_ENCODER,
+                 budget_ms=250.0):
+        self.candidates = candidates
+        self.lambda_ = lambda_
+        self.dedupe_similarity = dedupe_similarity
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.model = None
+        self.model_error = None
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.inflight = 0
+        self.cost_ms = None
+        self.reranked = 0
+        self.duplicates_dropped = 0
+        self.cross_encoded = 0
+        self.skipped_budget = 0
+        self.vectors_missing = 0
+
+    def fetch_k(self, top_k):
+        return max(top_k, self.candidates)
+
+    def _cross_encoder(self):
+        with self.load_lock:
+            if self.model is None and self.model_error is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    self.model = CrossEncoder(self.model_name, device='cpu')
+                except Exception as e:  # optional dependency or model download failed
+                    self.model_error = f"{type(e).__name__}: {e}"
+            return self.model
+
+    def _within_budget(self, started):
+        if not self.budget_ms:
+            return True
+        with self.lock:
+            expected = (self.cost_ms or 0.0) * (self.inflight + 1)
+        return (time.perf_counter() - started) * 1000 + expected <= self.budget_ms
+
+    def _cross_encode(self, question, clauses):
+        model = self._cross_encoder()
+        if model is None:
+            return None
+        with self.lock:
+            self.inflight += 1
+        start = time.perf_counter()
+        try:
+            scores = model.predict([(question, c['text']) for c in clauses])
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.inflight -= 1
+                self.cost_ms = elapsed if self.cost_ms is None else 0.8 * self.cost_ms + 0.2 * elapsed
+                self.cross_encoded += 1
+        return np.argsort(-np.asarray(scores), kind='stable')
+
+    def rerank(self, question, query_embedding, clauses, vectors, top_k=5, mode=None, started=None):
+        """
+        Reduce over-fetched clauses (in retrieval order, with their stored
+        vectors or None) to top_k. MMR relevance is the cosine to
+        query_embedding, or the retrieval rank when it is None. started is
+        the request's perf_counter() start, for the latency budget.
+        """
+        mode = get_rerank_mode(mode)
+        if mode == 'none' or not clauses:
+            return clauses[:top_k]
+        started = started or time.perf_counter()
+        similarity = None
+        if vectors is not None:
+            unit = _normalize_rows(vectors)
+            similarity = unit @ unit.T
+        keep = duplicate_mask(clauses, similarity, self.dedupe_similarity)
+        positions = np.flatnonzero(keep)
+        if similarity is None:
+            # No vectors to diversify with: dedupe only, keep retrieval order
+            picks = positions[:top_k]
+        else:
+            if query_embedding is not None:
+                relevance = unit[positions] @ _normalize_rows(query_embedding)
+            else:
+                # Lexical or hybrid retrieval: relevance falls off linearly with the fused/BM25 rank
+                relevance = 1.0 - np.arange(len(positions), dtype='float32') / len(positions)
+            picks = positions[mmr(relevance, similarity[np.ix_(positions, positions)], top_k, self.lambda_)]
+        picked = [clauses[i] for i in picks]
+        if mode == 'cross-encoder' and len(picked) > 1:
+            if self._within_budget(started):
+                order = self._cross_encode(question, picked)
+                if order is not None:
+                    picked = [picked[i] for i in order]
+            else:
+                with self.lock:
+                    self.skipped_budget += 1
+        with self.lock:
+            self.reranked += 1
+            self.duplicates_dropped += int(len(clauses) - keep.sum())
+            self.vectors_missing += vectors is None
+        return picked
+
+    def stats(self):
+        with self.lock:
+            return {
+                "reranked": self.reranked,
+                "duplicates_dropped": self.duplicates_dropped,
+                "cross_encoded": self.cross_encoded,
+                "skipped_budget": self.skipped_budget,
+                "vectors_missing": self.vectors_missing,
+                "cross_encoder_ms": round(self.cost_ms, 1) if self.cost_ms is not None else None,
+                "cross_encoder_error": self.model_error,
+            }
+
+def retrieve_reranked(index, queries, embeddings=None, top_k=5, rerank=None, started=None, **search):
+    """
+    FaissIndex.retrieve_batch(); unless rerank (default RERANK) is 'none',
+    over-fetch candidates with their stored vectors and let the reranker
+    dedupe and diversify them down to top_k. search holds the retrieval
+    options (mode, weights, fusion, filters).
+    """
+    rerank = get_rerank_mode(rerank)
+    if rerank == 'none':
+        return index.retrieve_batch(queries, embeddings, top_k=top_k, **search)
+    reranker = get_reranker()
+    clause_lists, vectors = index.retrieve_candidates(queries, embeddings, top_k=reranker.fetch_k(top_k), **search)
+    # Only pure vector retrieval is ranked by query similarity: re-scoring
+    # lexical or hybrid results that way would undo their BM25 / fused order
+    ranked_by = embeddings if (search.get('mode') or get_search_mode()).lower() == 'vector' else None
+    with span('rerank'):
+        return [
+            reranker.rerank(query, None if ranked_by is None else ranked_by[n], clause_lists[n],
+                            None if vectors is None else vectors[n], top_k, rerank, started)
+            for n, query in enumerate(queries)
+        ]
+
+_default_reranker = None
+_default_lock = threading.Lock()
+
+def get_reranker():
+    """
+    Process-wide Reranker configured from RERANK_* settings.
+    """
+    global _default_reranker
+    with _default_lock:
+        if _default_reranker is None:
+            _default_reranker = Reranker(
+                candidates=get_env_int('RERANK_CANDIDATES', 20),
+                lambda_=get_env_float('RERANK_MMR_LAMBDA', 0.7),
+                dedupe_similarity=get_env_float('RERANK_DEDUPE_SIMILARITY', 0.95),
+                model_name=os.getenv('RERANK_MODEL', DEFAULT_CROSS_ENCODER),
+                budget_ms=get_env_float('RERANK_BUDGET_MS', 250.0)
+            )
+        return _default_reranker
@@ -0,0 +1,341 @@
+import json
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from clause_store import ClauseColumns, ClauseStore, write_clause_columns
+
+MANIFEST = 'MANIFEST.json'
+# Zero-copy mapping of the snapshot's vector codes (read-only). IVF inverted
+# lists cannot be read through it and are mapped with IO_FLAG_MMAP alone.
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+
+def _fsync_write(path, data, mode='wb'):
+    with open(path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class SegmentStore:
+    """
+    Append-only on-disk layout for FaissIndex.
+
+    Every add() becomes an immutable segment: <name>.npy holds the float32
+    vectors and <name>.jsonl the clause metadata log; merged segments keep
+    their metadata in the memory-mappable columnar <name>.cols format.
+    MANIFEST.json lists the live segments plus an optional faiss snapshot
+    covering the first `rows` vectors, and is replaced atomically (write
+    temp + fsync + rename), so a crash at any point leaves the previous
+    manifest and its files intact.
+    Deleted rows are tombstoned (a sorted .npy of row numbers) until a merge
+    with drop= rewrites them away; `documents` maps each file name to the
+    content hash it was last indexed from.
+    Files not referenced by the manifest are garbage and removed on open.
+    A read_only store (another process is the writer) never creates,
+    removes or rewrites files.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"version": 0, "dim": None, "segments": [], "snapshot": None, "next_id": 1}
+        self.manifest.setdefault('deleted', None)
+        self.manifest.setdefault('documents', {})
+        if not read_only:
+            self._remove_unreferenced()
+
+    @property
+    def exists(self):
+        return self.manifest['version'] > 0
+
+    @property
+    def rows(self):
+        return sum(s['rows'] for s in self.manifest['segments'])
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @staticmethod
+    def _meta_name(seg):
+        return seg['name'] + '.' + seg.get('meta', 'jsonl')
+
+    def _read_metas(self, seg, mmap=False):
+        path = self._file(self._meta_name(seg))
+        if seg.get('meta') == 'cols':
+            return ClauseColumns(path, mmap=mmap)
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _referenced(self):
+        names = {MANIFEST}
+        for seg in self.manifest['segments']:
+            names.update((seg['name'] + '.npy', self._meta_name(seg)))
+        if self.manifest['snapshot']:
+            names.add(self.manifest['snapshot']['file'])
+        if self.manifest['deleted']:
+            names.add(self.manifest['deleted'])
+        return names
+
+    def _remove_unreferenced(self):
+        referenced = self._referenced()
+        for name in os.listdir(self.path):
+            if name not in referenced:
+                try:
+                    os.remove(self._file(name))
+                except OSError:
+                    pass
+
+    def _commit(self, manifest):
+        """
+        Atomically publish a new manifest. Caller holds self.lock.
+        """
+        manifest = dict(manifest, version=self.manifest['version'] + 1)
+        tmp = self._file(MANIFEST + '.tmp')
+        _fsync_write(tmp, json.dumps(manifest).encode('utf-8'))
+        os.replace(tmp, self._file(MANIFEST))
+        _fsync_dir(self.path)
+        self.manifest = manifest
+
+    def _allocate_name(self):
+        name = f"seg-{self.manifest['next_id']:08d}"
+        self.manifest['next_id'] += 1
+        return name
+
+    def _write_segment(self, name, vectors, metas, columnar=False):
+        with open(self._file(name + '.npy'), 'wb') as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype='float32'))
+            f.flush()
+            os.fsync(f.fileno())
+        if columnar:
+            write_clause_columns(self._file(name + '.cols'), metas)
+            return 'cols'
+        payload = ''.join(json.dumps(m, ensure_ascii=False) + '\n' for m in metas)
+        _fsync_write(self._file(name + '.jsonl'), payload.encode('utf-8'))
+        return 'jsonl'
+
+    def append(self, vectors, metas):
+        """
+        Persist one batch as a new segment. Cost is proportional to the batch,
+        not to the size of the corpus.
+        """
+        with self.lock:
+            name = self._allocate_name()
+            self._write_segment(name, vectors, metas)
+            segments = self.manifest['segments'] + [{"name": name, "rows": len(metas)}]
+            self._commit(dict(self.manifest, dim=int(vectors.shape[1]), segments=segments))
+
+    def load_deleted(self):
+        """
+        Sorted int64 array of tombstoned row numbers.
+        """
+        if not self.manifest['deleted']:
+            return np.zeros(0, dtype='int64')
+        return np.load(self._file(self.manifest['deleted']))
+
+    def _write_deleted(self, deleted):
+        """
+        Write a tombstone file and return its name (None when empty). Caller holds self.lock.
+        """
+        if not len(deleted):
+            return None
+        name = f"deleted-{self._allocate_name()[4:]}.npy"
+        with open(self._file(name), 'wb') as f:
+            np.save(f, np.asarray(deleted, dtype='int64'))
+            f.flush()
+            os.fsync(f.fileno())
+        return name
+
+    def delete(self, rows, documents=None):
+        """
+        Tombstone row numbers and optionally apply document registry changes
+        ({name: entry, or None to remove}) in the same commit.
+        """
+        with self.lock:
+            old = self.manifest['deleted']
+            deleted = np.union1d(self.load_deleted(), np.asarray(rows, dtype='int64'))
+            name = self._write_deleted(deleted)
+            self._commit(dict(self.manifest, deleted=name, documents=self._documents(documents)))
+            if old and old != name:
+                os.remove(self._file(old))
+
+    def _documents(self, changes):
+        documents = dict(self.manifest['documents'])
+        for name, entry in (changes or {}).items():
+            if entry is None:
+                documents.pop(name, None)
+            else:
+                documents[name] = entry
+        return documents
+
+    def set_documents(self, documents):
+        with self.lock:
+            self._commit(dict(self.manifest, documents=self._documents(documents)))
+
+    def load_vectors(self, start=0, stop=None, mmap=True):
+        """
+        Yield float32 vector blocks for rows in [start, stop), in insertion order.
+        """
+        offset = 0
+        for seg in self.manifest['segments']:
+            end = offset + seg['rows']
+            if stop is not None and offset >= stop:
+                break
+            if end > start:
+                vectors = np.load(self._file(seg['name'] + '.npy'), mmap_mode='r' if mmap else None)
+                yield vectors[max(0, start - offset):(stop - offset) if stop is not None else None]
+            offset = end
+
+    def load_metas(self, mmap=False):
+        """
+        Return a ClauseStore over all segments. Columnar segments are
+        memory-mapped when mmap=True instead of being read into RAM.
+        """
+        return ClauseStore([self._read_metas(seg, mmap) for seg in self.manifest['segments']])
+
+    def load_snapshot(self, mmap=False):
+        """
+        Return (faiss index, rows covered) or (None, 0) when there is no snapshot.
+        With mmap=True the index is mapped read-only and must not be added to.
+        """
+        snapshot = self.manifest['snapshot']
+        if not snapshot:
+            return None, 0
+        path = self._file(snapshot['file'])
+        if not mmap:
+            return faiss.read_index(path), snapshot['rows']
+        try:
+            return faiss.read_index(path, MMAP_FLAGS), snapshot['rows']
+        except RuntimeError:
+            if MMAP_FLAGS == faiss.IO_FLAG_MMAP:
+                raise
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP), snapshot['rows']
+
+    def write_snapshot(self, serialized, rows):
+        """
+        Publish a serialized faiss index (faiss.serialize_index output) that
+        covers the first `rows` vectors. Older snapshots are deleted.
+        """
+        with self.lock:
+            name = f"index-{self._allocate_name()[4:]}.faiss"
+        _fsync_write(self._file(name), serialized.tobytes())
+        with self.lock:
+            old = self.manifest['snapshot']
+            if old and old['rows'] > rows:
+                os.remove(self._file(name))
+                return
+            self._commit(dict(self.manifest, snapshot={"file": name, "rows": rows}))
+            if old:
+                os.remove(self._file(old['file']))
+
+    def plan_merge(self, max_segments):
+        """
+        Size-tiered merge plan: the newest run of segments whose older
+        neighbour is no bigger than everything after it. Keeps the number of
+        segments logarithmic in corpus size while rewriting each row only
+        O(log n) times.
+        """
+        segments = self.manifest['segments']
+        if len(segments) <= max_segments:
+            return []
+        start = len(segments) - 1
+        tail_rows = segments[start]['rows']
+        while start > 0 and segments[start - 1]['rows'] <= tail_rows:
+            start -= 1
+            tail_rows += segments[start]['rows']
+        if len(segments) - start < 2:
+            start = len(segments) - 2
+        return [s['name'] for s in segments[start:]]
+
+    def prepare_merge(self, names, drop=None):
+        """
+        Write the merged segment for the given adjacent segments and return
+        a pending merge for commit_merge(). drop lists global row numbers
+        inside those segments to leave out (a vacuum): rows after them are
+        renumbered, so callers must reload row-addressed state on commit.
+        """
+        if not names or (len(names) < 2 and drop is None):
+            return None
+        by_name = {s['name']: s for s in self.manifest['segments']}
+        offset = 0
+        for seg in self.manifest['segments']:
+            if seg['name'] == names[0]:
+                break
+            offset += seg['rows']
+        vectors = np.concatenate([np.load(self._file(n + '.npy')) for n in names])
+        metas = []
+        for n in names:
+            metas.extend(self._read_metas(by_name[n]))
+        dropped = np.zeros(0, dtype='int64')
+        if drop is not None and len(drop):
+            dropped = np.asarray(drop, dtype='int64')
+            dropped = dropped[(dropped >= offset) & (dropped < offset + len(metas))]
+            keep = np.ones(len(metas), dtype=bool)
+            keep[dropped - offset] = False
+            vectors = vectors[keep]
+            metas = [m for m, k in zip(metas, keep) if k]
+        with self.lock:
+            merged = self._allocate_name()
+        meta_format = self._write_segment(merged, vectors, metas, columnar=True)
+        return {"names": names, "dropped": dropped, "by_name": by_name,
+                "entry": {"name": merged, "rows": len(metas), "meta": meta_format}}
+
+    def commit_merge(self, pending):
+        """
+        Publish a prepared merge. Segments appended while it was written are
+        kept after the merged one; tombstones are renumbered past dropped rows.
+        """
+        if pending is None:
+            return
+        names, dropped = pending['names'], pending['dropped']
+        with self.lock:
+            segments = self.manifest['segments']
+            current = [s['name'] for s in segments]
+            first = current.index(names[0])
+            assert current[first:first + len(names)] == names
+            segments = segments[:first] + [pending['entry']] + segments[first + len(names):]
+            manifest = dict(self.manifest, segments=segments)
+            old_deleted = self.manifest['deleted']
+            if len(dropped):
+                deleted = self.load_deleted()
+                deleted = deleted[~np.isin(deleted, dropped)]
+                deleted = deleted - np.searchsorted(dropped, deleted)
+                # The snapshot's row numbering no longer matches the segments
+                manifest.update(deleted=self._write_deleted(deleted), snapshot=None)
+            old_snapshot = self.manifest['snapshot']
+            self._commit(manifest)
+            for n in names:
+                os.remove(self._file(n + '.npy'))
+                os.remove(self._file(self._meta_name(pending['by_name'][n])))
+            if len(dropped):
+                if old_deleted:
+                    os.remove(self._file(old_deleted))
+                if old_snapshot:
+                    os.remove(self._file(old_snapshot['file']))
+
+    def merge(self, names, drop=None):
+        """
+        Rewrite the given adjacent segments as one (see prepare_merge).
+        """
+        self.commit_merge(self.prepare_merge(names, drop))
@@ -1,5 +1,6 @@
 import os
 import json
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,5 +8,43 @@ load_dotenv()
 def get_gemini_api_key():
     return os.getenv('GEMINI_API_KEY')
 
+def get_gemini_api_base():
+    # Point at a local mock server (benchmarks/mock_gemini.py) for offline runs
+    return os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta').rstrip('/')
+
+def get_env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+def get_env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value not in (None, '') else default
+
+def get_embedding_backend():
+    # 'gemini' calls the real API, 'local' is an offline stand-in for benchmarks
+    return os.getenv('EMBEDDING_BACKEND', 'gemini').lower()
+
+def get_search_mode():
+    # 'vector', 'lexical' (BM25) or 'hybrid' (both, fused by HYBRID_FUSION: min-max
+    # normalised linear fusion by default, reciprocal rank fusion with 'rrf')
+    return os.getenv('SEARCH_MODE', 'vector').lower()
+
+def estimate_tokens(text):
+    # Rough heuristic (~4 characters per token) used for batching budgets
+    return max(1, len(text) // 4)
+
+def parse_date(value, end=False):
+    """
+    Epoch seconds of an ISO 8601 date or date-time, UTC unless it carries
+    an offset. With end=True a bare date means the end of that day, so a
+    range up to it includes the whole day.
+    """
+    moment = datetime.fromisoformat(value)
+    if end and len(value.strip()) == 10:
+        moment += timedelta(days=1)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
 def format_json_response(response_dict):
-    return json.dumps(response_dict, indent=2, ensure_ascii=False)
\ No newline at end of file
+    return json.dumps(response_dict, indent=2, ensure_ascii=False)
@@ -1,17 +1,54 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import argparse
+import asyncio
 import tempfile
+import shutil
 import os
 import json
+import subprocess
+import sys
+import time
 from typing import List, Optional
 import uvicorn
-from parser import parse_file
-from embedding import FaissIndex, get_gemini_embedding
-from utils import get_gemini_api_key
-import requests
+from embedding import SEARCH_MODES, aget_gemini_embeddings, search_filter
+from answer_cache import get_answer_cache
+from collection_manager import (COLLECTION_BUSY, COLLECTION_EXISTS, CollectionManager, DEFAULT_COLLECTION,
+                                validate_collection_name)
+from embedding_cache import get_embedding_cache
+from ingest import SUPPORTED_EXTENSIONS, ingest_files, shutdown_parse_pool
+from gemini_client import CircuitOpenError, close_gemini_client, get_gemini_client
+from generation import agenerate_answer, stream_answer
+from jobs import DOCUMENT_NOT_INDEXED, JobManager
+from metrics import REGISTRY, MetricsMiddleware, current_timings, span
+from prompt_packer import get_prompt_packer, pack_prompt
+from rerank import get_rerank_mode, get_reranker, retrieve_reranked
+from utils import get_env_int, get_search_mode, parse_date
 
-app = FastAPI(title="LexIQ Webhook API", version="1.0.0")
+# 'standalone': this process reads and writes the indexes (single worker).
+# 'reader': a query worker of `python webhook_api.py --workers N`; uploads and
+# deletes are handed to the writer process (writer_service.py) as jobs.
+INDEX_ROLE = os.getenv('INDEX_ROLE', 'standalone')
+READER = INDEX_ROLE == 'reader'
+
+@asynccontextmanager
+async def lifespan(app):
+    if READER:
+        collections.start_watcher()
+    else:
+        # Fails fast if another process (e.g. a second plain uvicorn worker) already writes
+        collections.acquire_writer_lock()
+        # Resume background jobs interrupted by a previous shutdown or crash
+        get_job_manager().start()
+    yield
+    await get_job_manager().stop()
+    await collections.stop()
+    await close_gemini_client()
+    shutdown_parse_pool()
+
+app = FastAPI(title="LexIQ Webhook API", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -22,116 +59,458 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global storage for the FAISS index
-global_index = None
+# Per-stage timings, request latency histograms and the slow-request profiler
+app.add_middleware(MetricsMiddleware)
+
+# Named collections, each with its own FAISS index, loaded on demand
+collections = CollectionManager(read_only=READER)
+job_manager = None
+
+def get_job_manager():
+    global job_manager
+    if job_manager is None:
+        job_manager = JobManager(collections, run_workers=not READER)
+    return job_manager
+
+def _debug_timings(debug):
+    """
+    Per-stage timings of this request when ?debug=true or DEBUG_TIMINGS=1, else None.
+    """
+    if debug or os.getenv('DEBUG_TIMINGS', '0') == '1':
+        return current_timings()
+    return None
+
+def _with_timings(result, debug):
+    timings = _debug_timings(debug)
+    if timings is not None:
+        result = dict(result, timings=dict(result.get('timings') or {}, stages=timings))
+    return result
+
+def _collection_name(name):
+    try:
+        return validate_collection_name(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/upload")
-async def upload_documents(files: List[UploadFile] = File(...)):
+async def upload_documents(files: List[UploadFile] = File(...), background: bool = False,
+                           collection: str = DEFAULT_COLLECTION, debug: bool = False):
     """
-    Upload and index documents (PDF, DOCX, EML)
+    Upload and index documents (PDF, DOCX, EML) into a collection (created if new)
+    With ?background=true the files are queued and a job id is returned immediately.
     """
-    global global_index
+    collection = _collection_name(collection)
+    for file in files:
+        if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.filename}")
     
+    if background or READER:
+        uploads = [(file.filename, await file.read()) for file in files]
+        job_id = await get_job_manager().submit(uploads, collection)
+        if not background:
+            # Query workers hand files to the writer process and wait for it
+            return await _wait_for_upload(job_id, collection)
+        return JSONResponse({
+            "status": "queued",
+            "job_id": job_id,
+            "collection": collection,
+            "files": [file.filename for file in files]
+        }, status_code=202)
+    
+    tmp_dir = tempfile.mkdtemp()
     try:
-        uploaded_files = []
+        # Save uploads under their original names so clause ids reference the real file
+        paths = []
         for file in files:
-            if file.filename.lower().endswith(('.pdf', '.docx', '.eml')):
-                # Save uploaded file temporarily
-                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-                    content = await file.read()
-                    tmp.write(content)
-                    tmp_path = tmp.name
-                
-                # Parse the file
-                clauses = parse_file(tmp_path)
-                embeddings = []
-                
-                for clause in clauses:
-                    emb = get_gemini_embedding(clause['text'])
-                    embeddings.append(emb)
-                
-                if embeddings:
-                    if global_index is None:
-                        global_index = FaissIndex(dim=len(embeddings[0]))
-                    global_index.add(embeddings, clauses)
-                
-                uploaded_files.append(file.filename)
-                os.remove(tmp_path)
-            else:
-                raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.filename}")
+            path = os.path.join(tmp_dir, os.path.basename(file.filename))
+            content = await file.read()
+            await asyncio.to_thread(_write_file, path, content)
+            paths.append(path)
         
-        return JSONResponse({
+        # Parse, embed and index all files concurrently
+        with collections.using(collection):
+            results = await ingest_files(paths, collections.writer(collection))
+        errors = {f.filename: str(r) for f, r in zip(files, results) if isinstance(r, Exception)}
+        if errors:
+            raise HTTPException(status_code=500, detail=f"Error processing files: {errors}")
+        
+        uploaded_files = [f.filename for f in files]
+        return JSONResponse(_with_timings({
             "status": "success",
             "message": f"Successfully indexed {len(uploaded_files)} documents",
-            "files": uploaded_files
-        })
+            "collection": collection,
+            "files": uploaded_files,
+            "clauses": dict(zip(uploaded_files, results))
+        }, debug))
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing files: {str(e)}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
-@app.post("/query")
-async def ask_question(question: str = Form(...)):
+async def _wait_for_upload(job_id, collection):
+    report = await get_job_manager().wait(job_id)
+    errors = {f['file']: f['error'] for f in report['files'] if f['status'] == 'failed'}
+    if errors:
+        raise HTTPException(status_code=500, detail=f"Error processing files: {errors}")
+    # Make the new version visible to this worker's next query right away
+    await asyncio.to_thread(collections.refresh, collection)
+    uploaded_files = [f['file'] for f in report['files']]
+    return JSONResponse({
+        "status": "success",
+        "message": f"Successfully indexed {len(uploaded_files)} documents",
+        "collection": collection,
+        "files": uploaded_files,
+        "clauses": {f['file']: f['clauses_embedded'] for f in report['files']}
+    })
+
+async def _run_on_writer(operation, target, collection):
     """
-    Ask a question about the uploaded documents
+    Reader workers: run a create, delete, drop, clear or import in the writer process and return its job report.
     """
-    global global_index
-    
-    if global_index is None:
+    job_manager = get_job_manager()
+    report = await job_manager.wait(await job_manager.submit_operation(operation, target, collection))
+    await asyncio.to_thread(collections.refresh, collection)
+    return report
+
+def _write_file(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def _clause_json(clauses):
+    return [
+        {
+            "text": c['text'],
+            "clause_id": c['clause_id'],
+            "page": c['page'],
+            "file": c['file']
+        } for c in clauses
+    ]
+
+def _query_result(question, answer, clauses, cache_hit, usage=None):
+    return {
+        "query": question,
+        "answer": answer,
+        "relevant_clauses": _clause_json(clauses),
+        "confidence_score": None,
+        "rationale": answer,
+        "cache_hit": cache_hit,
+        "usage": usage
+    }
+
+NO_MATCH_RESULT = {
+    "answer": "No relevant information found in the uploaded documents.",
+    "relevant_clauses": [],
+    "confidence_score": None,
+    "rationale": "No matching clauses found."
+}
+
+def _get_index(collection):
+    index = collections.get(_collection_name(collection))
+    if index is None:
         raise HTTPException(status_code=400, detail="No documents indexed. Please upload documents first.")
+    return index
+
+def _search_filter(file, page_from, page_to, doc_type, uploaded_after, uploaded_before):
+    """
+    search_filter() from the /query filter fields, or a 400.
+    """
+    try:
+        for t in doc_type or []:
+            if '.' + t.lower().lstrip('.') not in SUPPORTED_EXTENSIONS:
+                raise ValueError(f"Unsupported document type: {t}")
+        return search_filter(
+            file, (page_from, page_to), doc_type,
+            parse_date(uploaded_after) if uploaded_after else None,
+            parse_date(uploaded_before, end=True) if uploaded_before else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _retrieve(collection, question, mode, vector_weight, lexical_weight, fusion, rerank=None, filters=None):
+    """
+    Validate the request and return (index, clauses, query embedding, cached answer, cache hit).
+    """
+    started = time.perf_counter()
+    index = _get_index(collection)
+    mode = _search_mode(collection, mode)
+    rerank = _rerank_mode(collection, rerank)
+    
+    # Get query embedding (not needed for pure lexical search)
+    query_emb = (await aget_gemini_embeddings([question]))[0] if mode != 'lexical' else None
+    
+    # Search and re-rank (a cross-encoder predicts synchronously) off the event loop
+    relevant_clauses = (await asyncio.to_thread(
+        retrieve_reranked,
+        index, [question], None if query_emb is None else [query_emb], top_k=5, rerank=rerank, started=started,
+        mode=mode, vector_weight=vector_weight, lexical_weight=lexical_weight, fusion=fusion, filters=filters
+    ))[0]
     
+    answer, cache_hit = _cached_answer(collection, index, question, relevant_clauses, query_emb)
+    return index, relevant_clauses, query_emb, answer, cache_hit
+
+def _search_mode(collection, mode):
+    mode = (mode or collections.config(collection).get('search_mode') or get_search_mode()).lower()
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Unsupported search mode: {mode}")
+    return mode
+
+def _rerank_mode(collection, rerank):
     try:
-        # Get query embedding
-        query_emb = get_gemini_embedding(question)
-        
-        # Search for relevant clauses
-        relevant_clauses = global_index.search(query_emb, top_k=5)
+        return get_rerank_mode(rerank or collections.config(collection).get('rerank'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _cached_answer(collection, index, question, clauses, query_emb):
+    """
+    Reuse a cached answer for the same (or a near-identical) question over the same clauses.
+    """
+    answer_cache = get_answer_cache()
+    if clauses and answer_cache is not None:
+        return answer_cache.get(question, clauses, index.generation, query_emb, scope=collection)
+    return None, None
+
+def _cache_answer(collection, index, question, clauses, answer, query_emb):
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.put(question, clauses, index.generation, answer, query_emb, scope=collection)
+
+@app.post("/query")
+async def ask_question(
+    question: str = Form(...),
+    mode: Optional[str] = Form(None),
+    vector_weight: float = Form(1.0),
+    lexical_weight: float = Form(1.0),
+    fusion: Optional[str] = Form(None),
+    rerank: Optional[str] = Form(None),
+    collection: str = Form(DEFAULT_COLLECTION),
+    file: Optional[List[str]] = Form(None),
+    page_from: Optional[int] = Form(None),
+    page_to: Optional[int] = Form(None),
+    doc_type: Optional[List[str]] = Form(None),
+    uploaded_after: Optional[str] = Form(None),
+    uploaded_before: Optional[str] = Form(None),
+    debug: bool = False
+):
+    """
+    Ask a question about the uploaded documents
+    mode selects 'vector', 'lexical' or 'hybrid' retrieval (default SEARCH_MODE);
+    the weights and fusion ('linear' or 'rrf') apply to hybrid retrieval;
+    rerank ('none', 'mmr' or 'cross-encoder', default RERANK) re-ranks an
+    over-fetched candidate set before the prompt is built.
+    file (repeatable), page_from / page_to, doc_type (pdf, docx, eml;
+    repeatable) and uploaded_after / uploaded_before (ISO 8601 dates, UTC)
+    restrict retrieval to matching clauses inside the index search.
+    """
+    collection = _collection_name(collection)
+    filters = _search_filter(file, page_from, page_to, doc_type, uploaded_after, uploaded_before)
+    try:
+        with collections.using(collection):
+            index, relevant_clauses, query_emb, answer, cache_hit = await _retrieve(
+                collection, question, mode, vector_weight, lexical_weight, fusion, rerank, filters)
         
         if not relevant_clauses:
-            return JSONResponse({
-                "query": question,
-                "answer": "No relevant information found in the uploaded documents.",
-                "relevant_clauses": [],
-                "confidence_score": None,
-                "rationale": "No matching clauses found."
-            })
+            return JSONResponse(_with_timings(dict(NO_MATCH_RESULT, query=question), debug))
         
-        # Compose prompt for Gemini
-        context = "\n\n".join([c['text'] for c in relevant_clauses])
-        prompt = f"Context:\n{context}\n\nQuestion: {question}\n\nAnswer with rationale and cite relevant clauses."
-        
-        # Call Gemini for answer
-        api_key = get_gemini_api_key()
-        url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key=' + api_key
-        headers = {'Content-Type': 'application/json'}
-        data = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {"temperature": 0.2, "maxOutputTokens": 512}
-        }
-        
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        answer = response.json()['candidates'][0]['content']['parts'][0]['text']
-        
-        # Compose response
-        result = {
-            "query": question,
-            "answer": answer,
-            "relevant_clauses": [
-                {
-                    "text": c['text'],
-                    "clause_id": c['clause_id'],
-                    "page": c['page'],
-                    "file": c['file']
-                } for c in relevant_clauses
-            ],
-            "confidence_score": None,
-            "rationale": answer
-        }
+        usage = None
+        if answer is None:
+            # Call Gemini for answer
+            prompt, usage = pack_prompt(question, relevant_clauses, endpoint='query')
+            with span('generate'):
+                answer = await agenerate_answer(prompt)
+            _cache_answer(collection, index, question, relevant_clauses, answer, query_emb)
         
-        return JSONResponse(result)
+        return JSONResponse(_with_timings(_query_result(question, answer, relevant_clauses, cache_hit, usage), debug))
+    
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+@app.post("/query/batch")
+async def ask_questions(
+    questions: List[str] = Form(...),
+    mode: Optional[str] = Form(None),
+    vector_weight: float = Form(1.0),
+    lexical_weight: float = Form(1.0),
+    fusion: Optional[str] = Form(None),
+    rerank: Optional[str] = Form(None),
+    collection: str = Form(DEFAULT_COLLECTION),
+    file: Optional[List[str]] = Form(None),
+    page_from: Optional[int] = Form(None),
+    page_to: Optional[int] = Form(None),
+    doc_type: Optional[List[str]] = Form(None),
+    uploaded_after: Optional[str] = Form(None),
+    uploaded_before: Optional[str] = Form(None),
+    debug: bool = False
+):
+    """
+    Ask several questions about the same collection (repeat the 'questions' field)
+    All questions are embedded in one batched call and searched with one
+    matrix FAISS search; answers are generated concurrently, at most
+    QUERY_BATCH_CONCURRENCY at a time. Results come back in question order,
+    each with its own timings; a failed generation is reported on its
+    question instead of failing the batch. The /query filters apply to
+    every question.
+    """
+    collection = _collection_name(collection)
+    filters = _search_filter(file, page_from, page_to, doc_type, uploaded_after, uploaded_before)
+    max_questions = get_env_int('QUERY_BATCH_MAX', 100)
+    if len(questions) > max_questions:
+        raise HTTPException(status_code=400, detail=f"At most {max_questions} questions per batch")
+    start = time.perf_counter()
+    try:
+        with collections.using(collection):
+            index = _get_index(collection)
+            mode = _search_mode(collection, mode)
+            rerank = _rerank_mode(collection, rerank)
+            embeddings = await aget_gemini_embeddings(questions) if mode != 'lexical' else None
+            embedded = time.perf_counter()
+            clause_lists = await asyncio.to_thread(
+                retrieve_reranked,
+                index, questions, embeddings, top_k=5, rerank=rerank, started=start,
+                mode=mode, vector_weight=vector_weight, lexical_weight=lexical_weight, fusion=fusion, filters=filters
+            )
+            searched = time.perf_counter()
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    
+    semaphore = asyncio.Semaphore(get_env_int('QUERY_BATCH_CONCURRENCY', 8))
     
+    async def answer_one(n, question, clauses):
+        query_emb = embeddings[n] if embeddings is not None else None
+        started = time.perf_counter()
+        timings = {"queued_ms": 0.0, "generation_ms": 0.0}
+        if not clauses:
+            return dict(NO_MATCH_RESULT, query=question, timings=timings)
+        answer, cache_hit = _cached_answer(collection, index, question, clauses, query_emb)
+        usage = None
+        if answer is None:
+            prompt, usage = pack_prompt(question, clauses, endpoint='query/batch')
+            async with semaphore:
+                generating = time.perf_counter()
+                timings["queued_ms"] = _ms(generating - started)
+                try:
+                    with span('generate'):
+                        answer = await agenerate_answer(prompt)
+                except Exception as e:
+                    timings["generation_ms"] = _ms(time.perf_counter() - generating)
+                    return {"query": question, "error": f"Error generating answer: {str(e)}",
+                            "relevant_clauses": _clause_json(clauses), "usage": usage, "timings": timings}
+                timings["generation_ms"] = _ms(time.perf_counter() - generating)
+            _cache_answer(collection, index, question, clauses, answer, query_emb)
+        return dict(_query_result(question, answer, clauses, cache_hit, usage), timings=timings)
+    
+    results = await asyncio.gather(*[
+        answer_one(n, question, clauses) for n, (question, clauses) in enumerate(zip(questions, clause_lists))
+    ])
+    finished = time.perf_counter()
+    return JSONResponse(_with_timings({
+        "collection": collection,
+        "results": results,
+        "timings": {
+            "embedding_ms": _ms(embedded - start),
+            "search_ms": _ms(searched - embedded),
+            "generation_ms": _ms(finished - searched),
+            "total_ms": _ms(finished - start)
+        }
+    }, debug))
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/query/stream")
+async def ask_question_stream(
+    question: str = Form(...),
+    mode: Optional[str] = Form(None),
+    vector_weight: float = Form(1.0),
+    lexical_weight: float = Form(1.0),
+    fusion: Optional[str] = Form(None),
+    rerank: Optional[str] = Form(None),
+    collection: str = Form(DEFAULT_COLLECTION),
+    file: Optional[List[str]] = Form(None),
+    page_from: Optional[int] = Form(None),
+    page_to: Optional[int] = Form(None),
+    doc_type: Optional[List[str]] = Form(None),
+    uploaded_after: Optional[str] = Form(None),
+    uploaded_before: Optional[str] = Form(None),
+    debug: bool = False
+):
+    """
+    Same as /query, streamed as Server-Sent Events:
+    'clauses' (retrieved clauses), then 'token' events with answer text as
+    Gemini generates it, then 'result' with the full /query JSON.
+    An 'error' event replaces the rest of the stream if generation fails.
+    """
+    collection = _collection_name(collection)
+    filters = _search_filter(file, page_from, page_to, doc_type, uploaded_after, uploaded_before)
+    try:
+        with collections.using(collection):
+            index, relevant_clauses, query_emb, answer, cache_hit = await _retrieve(
+                collection, question, mode, vector_weight, lexical_weight, fusion, rerank, filters)
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    
+    async def events():
+        yield _sse("clauses", {"query": question, "relevant_clauses": _clause_json(relevant_clauses)})
+        if not relevant_clauses:
+            yield _sse("result", _with_timings(dict(NO_MATCH_RESULT, query=question), debug))
+            return
+        final_answer, usage = answer, None
+        if final_answer is None:
+            parts = []
+            prompt, usage = pack_prompt(question, relevant_clauses, endpoint='query/stream')
+            try:
+                with span('generate'):
+                    async for text in stream_answer(prompt):
+                        parts.append(text)
+                        yield _sse("token", {"text": text})
+            except Exception as e:
+                yield _sse("error", {"detail": f"Error generating answer: {str(e)}"})
+                return
+            final_answer = ''.join(parts)
+            _cache_answer(collection, index, question, relevant_clauses, final_answer, query_emb)
+        else:
+            # Cached answers arrive in one piece
+            yield _sse("token", {"text": final_answer})
+        yield _sse("result", _with_timings(
+            _query_result(question, final_answer, relevant_clauses, cache_hit, usage), debug))
+    
+    # X-Accel-Buffering stops nginx-style proxies from holding back events
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs")
+async def list_jobs(limit: int = 50):
+    """
+    List recent background ingestion jobs
+    """
+    return {"jobs": get_job_manager().store.list(limit)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Per-file progress, clauses embedded, throughput and errors of a background job
+    """
+    report = get_job_manager().store.get(job_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return report
 
 @app.get("/health")
 async def health_check():
@@ -141,28 +520,249 @@ async def health_check():
     return {"status": "healthy", "service": "LexIQ Webhook API"}
 
 @app.get("/status")
-async def get_status():
+async def get_status(collection: str = DEFAULT_COLLECTION):
     """
-    Get current status (number of indexed documents)
+    Get current status (number of indexed documents in a collection, loaded collections)
     """
-    global global_index
-    
-    if global_index is None:
-        return {"indexed_documents": 0, "total_clauses": 0}
+    cache = get_embedding_cache()
+    cache_stats = cache.stats() if cache is not None else None
+    answer_cache = get_answer_cache()
+    answer_stats = answer_cache.stats() if answer_cache is not None else None
+    index = collections.get(_collection_name(collection))
+    return {
+        "collection": collection,
+        "indexed_documents": index.meta.document_count if index is not None else 0,
+        "total_clauses": index.live_count if index is not None else 0,
+        "vectors": index.vector_stats() if index is not None else None,
+        "collections": collections.stats(),
+        "embedding_cache": cache_stats,
+        "answer_cache": answer_stats,
+        "rerank": get_reranker().stats(),
+        "prompts": get_prompt_packer().stats(),
+        "gemini": get_gemini_client().stats()
+    }
+
+def _resident_memory_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _metric_samples():
+    """
+    Counters and gauges read at scrape time from the Gemini client, the
+    caches, the reranker and the loaded collections.
+    """
+    gemini = get_gemini_client().stats()
+    methods = gemini['methods'].items()
+    samples = [
+        ('lexiq_gemini_calls_total', 'counter', 'Gemini API calls by method',
+         [({'method': m}, s['calls']) for m, s in methods]),
+        ('lexiq_gemini_errors_total', 'counter', 'Gemini API calls that failed after retries',
+         [({'method': m}, s['errors']) for m, s in methods]),
+        ('lexiq_gemini_retries_total', 'counter', 'Gemini API call retries',
+         [({'method': m}, s['retries']) for m, s in methods]),
+        ('lexiq_gemini_circuit_open', 'gauge', '1 while the circuit breaker rejects Gemini calls',
+         [({}, int(gemini['circuit'] == 'open'))]),
+    ]
+    cache = get_embedding_cache()
+    if cache is not None:
+        stats = cache.stats()
+        samples += [
+            ('lexiq_embedding_cache_hits_total', 'counter', 'Embedding cache hits',
+             [({'tier': 'memory'}, stats['hits_memory']), ({'tier': 'disk'}, stats['hits_disk'])]),
+            ('lexiq_embedding_cache_misses_total', 'counter', 'Embedding cache misses', [({}, stats['misses'])]),
+            ('lexiq_embedding_cache_hit_ratio', 'gauge', 'Embedding cache hit rate', [({}, stats['hit_rate'])]),
+        ]
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        stats = answer_cache.stats()
+        samples += [
+            ('lexiq_answer_cache_hits_total', 'counter', 'Answer cache hits',
+             [({'kind': 'exact'}, stats['hits_exact']), ({'kind': 'semantic'}, stats['hits_semantic'])]),
+            ('lexiq_answer_cache_misses_total', 'counter', 'Answer cache misses', [({}, stats['misses'])]),
+            ('lexiq_answer_cache_hit_ratio', 'gauge', 'Answer cache hit rate', [({}, stats['hit_rate'])]),
+        ]
+    rerank = get_reranker().stats()
+    loaded = collections.loaded_indexes()
+    samples += [
+        ('lexiq_rerank_duplicates_dropped_total', 'counter', 'Near-duplicate clauses dropped by re-ranking',
+         [({}, rerank['duplicates_dropped'])]),
+        ('lexiq_rerank_budget_skips_total', 'counter', 'Cross-encoder runs skipped for the latency budget',
+         [({}, rerank['skipped_budget'])]),
+        ('lexiq_index_clauses', 'gauge', 'Live clauses in loaded collections',
+         [({'collection': name}, index.live_count) for name, index in loaded]),
+        ('lexiq_index_memory_bytes', 'gauge', 'Estimated RAM of loaded collections',
+         [({'collection': name}, index.memory_bytes()) for name, index in loaded]),
+        ('lexiq_process_resident_memory_bytes', 'gauge', 'Resident memory of this process',
+         [({}, _resident_memory_bytes())]),
+    ]
+    return samples
+
+REGISTRY.add_collector(_metric_samples)
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics of this process: stage, request and Gemini call
+    latency histograms, API call counts, cache hit rates, index size and memory
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/collections")
+async def list_collections():
+    """
+    List collections with their config and whether they are loaded
+    """
+    return {"collections": await asyncio.to_thread(collections.list), "memory": collections.stats()}
+
+@app.post("/collections")
+async def create_collection(
+    name: str = Form(...),
+    index_type: Optional[str] = Form(None),
+    search_mode: Optional[str] = Form(None),
+    rerank: Optional[str] = Form(None),
+    mmap: Optional[bool] = Form(None),
+    codec: Optional[str] = Form(None),
+    reduce_dim: Optional[int] = Form(None)
+):
+    """
+    Create a collection with its own index settings (defaults come from the environment)
+    """
+    settings = {'index_type': index_type, 'mmap': mmap, 'search_mode': search_mode, 'rerank': rerank,
+                'codec': codec, 'reduce_dim': reduce_dim}
+    if READER:
+        report = await _run_on_writer('create_collection', json.dumps(settings), _collection_name(name))
+        if report['errors']:
+            error = report['errors'][0]['error']
+            raise HTTPException(status_code=409 if error.startswith(COLLECTION_EXISTS) else 400, detail=error)
+        return JSONResponse({"status": "success", "collection": name, "config": collections.config(name)},
+                            status_code=201)
+    try:
+        config = collections.create(name, **settings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return JSONResponse({"status": "success", "collection": name, "config": config}, status_code=201)
+
+@app.delete("/collections/{name}")
+async def delete_collection(name: str):
+    """
+    Delete a collection and all of its indexed data
+    """
+    name = _collection_name(name)
+    if not collections.exists(name):
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {name}")
+    if READER:
+        report = await _run_on_writer('drop_collection', name, name)
+        if report['errors']:
+            raise HTTPException(status_code=409, detail=report['errors'][0]['error'])
+        return {"status": "success", "collection": name}
+    try:
+        await asyncio.to_thread(collections.drop, name)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "success", "collection": name}
+
+@app.post("/collections/{name}/import")
+async def import_collection(name: str, path: str = Form(...)):
+    """
+    Hot-load an index built offline by bulk_ingest.py (a directory on this server) as the collection's data
+    """
+    name = _collection_name(name)
+    if READER:
+        report = await _run_on_writer('import_collection', path, name)
+        if report['errors']:
+            error = report['errors'][0]['error']
+            raise HTTPException(status_code=409 if error.startswith(COLLECTION_BUSY) else 400, detail=error)
+        index = collections.get(name)
     else:
-        return {
-            "indexed_documents": len(set([meta['file'] for meta in global_index.meta])),
-            "total_clauses": len(global_index.meta)
-        }
+        try:
+            index = await asyncio.to_thread(collections.import_build, name, path)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "success", "collection": name, "documents": len(index.documents),
+            "clauses": index.live_count}
+
+@app.get("/documents")
+async def list_documents(collection: str = DEFAULT_COLLECTION):
+    """
+    Indexed documents of a collection with their content hash and clause count
+    """
+    index = collections.get(_collection_name(collection))
+    if index is None:
+        return {"collection": collection, "documents": []}
+    return {"collection": collection, "documents": [
+        dict(entry, file=name, clauses=index.meta.file_counts.get(name, 0))
+        for name, entry in sorted(index.documents.items())
+    ]}
+
+@app.delete("/documents/{name}")
+async def delete_document(name: str, collection: str = DEFAULT_COLLECTION):
+    """
+    Remove one document from a collection without touching the others
+    """
+    collection = _collection_name(collection)
+    if READER:
+        report = await _run_on_writer('delete_document', name, collection)
+        if report['errors']:
+            error = report['errors'][0]['error']
+            raise HTTPException(status_code=404 if error.startswith(DOCUMENT_NOT_INDEXED) else 500, detail=error)
+        deleted = report['files'][0]['clauses_embedded']
+    else:
+        with collections.using(collection):
+            deleted = await collections.writer(collection).delete_document(name)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail=f"Document not indexed: {name}")
+    return {"status": "success", "collection": collection, "file": name, "deleted_clauses": deleted}
 
 @app.delete("/clear")
-async def clear_index():
+async def clear_index(collection: str = DEFAULT_COLLECTION):
     """
-    Clear all indexed documents
+    Delete every indexed document of a collection (its settings are kept;
+    DELETE /collections/{name} removes the collection itself)
     """
-    global global_index
-    global_index = None
+    collection = _collection_name(collection)
+    if READER:
+        report = await _run_on_writer('clear_collection', collection, collection)
+        if report['errors']:
+            raise HTTPException(status_code=409, detail=report['errors'][0]['error'])
+        # Other workers notice the removed store through the watcher
+        collections.unload(collection)
+    else:
+        try:
+            await asyncio.to_thread(collections.clear, collection)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
     return {"status": "success", "message": "Index cleared successfully"}
 
+def serve_workers(host, port, workers):
+    """
+    One writer process owns all index writes; `workers` uvicorn processes
+    serve queries from memory-mapped read-only views.
+    """
+    writer = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'writer_service.py')],
+                              env=dict(os.environ, INDEX_ROLE='writer'))
+    os.environ['INDEX_ROLE'] = 'reader'
+    try:
+        uvicorn.run("webhook_api:app", host=host, port=port, workers=workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    finally:
+        writer.terminate()
+        writer.wait()
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='query worker processes; more than 1 adds a separate writer process')
+    args = parser.parse_args()
+    if args.workers > 1:
+        serve_workers(args.host, args.port, args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port) 
\ No newline at end of file
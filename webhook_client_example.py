@@ -4,26 +4,53 @@ import json
 # Base URL for the webhook API
 BASE_URL = "http://localhost:8000"
 
-def upload_documents(file_paths):
+def upload_documents(file_paths, collection="default"):
     """
-    Upload documents to the webhook API
+    Upload documents to a collection via the webhook API
     """
     files = []
     for file_path in file_paths:
         with open(file_path, 'rb') as f:
             files.append(('files', (file_path.split('/')[-1], f.read(), 'application/octet-stream')))
     
-    response = requests.post(f"{BASE_URL}/upload", files=files)
+    response = requests.post(f"{BASE_URL}/upload", params={'collection': collection}, files=files)
     return response.json()
 
-def ask_question(question):
+def upload_documents_background(file_paths, collection="default"):
+    """
+    Queue documents for background indexing; returns a job id
+    """
+    files = []
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            files.append(('files', (file_path.split('/')[-1], f.read(), 'application/octet-stream')))
+    
+    response = requests.post(f"{BASE_URL}/upload", params={'background': 'true', 'collection': collection}, files=files)
+    return response.json()['job_id']
+
+def get_job(job_id):
+    """
+    Get progress of a background indexing job
+    """
+    response = requests.get(f"{BASE_URL}/jobs/{job_id}")
+    return response.json()
+
+def ask_question(question, collection="default"):
     """
     Ask a question via the webhook API
     """
-    data = {'question': question}
+    data = {'question': question, 'collection': collection}
     response = requests.post(f"{BASE_URL}/query", data=data)
     return response.json()
 
+def ask_questions(questions, collection="default"):
+    """
+    Ask several questions in one request; results come back in the same order
+    """
+    data = {'questions': questions, 'collection': collection}
+    response = requests.post(f"{BASE_URL}/query/batch", data=data)
+    return response.json()
+
 def get_status():
     """
     Get the current status of indexed documents
@@ -33,7 +60,7 @@ def get_status():
 
 def clear_index():
     """
-    Clear all indexed documents
+    Delete all indexed documents (the collection's settings are kept)
     """
     response = requests.delete(f"{BASE_URL}/clear")
     return response.json()
@@ -78,8 +105,10 @@ if __name__ == "__main__":
     print()
     
     print("=== API Endpoints ===")
-    print("POST /upload - Upload and index documents")
+    print("POST /upload - Upload and index documents (?background=true for a job id)")
+    print("GET /jobs/{job_id} - Background job progress")
     print("POST /query - Ask a question")
+    print("POST /query/batch - Ask several questions at once")
     print("GET /status - Get current status")
     print("GET /health - Health check")
     print("DELETE /clear - Clear all indexed documents")
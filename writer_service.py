@@ -0,0 +1,46 @@
+"""
+Writer process for multi-worker serving.
+
+`python webhook_api.py --workers N` starts this next to N query workers.
+It is the only process that writes the indexes: it holds the writer lock,
+runs every ingestion, delete and collection drop that the workers record
+in the job store, and compacts the segment stores. Workers map the
+published snapshots read-only and swap to new versions as manifests change.
+
+    INDEX_ROLE=writer python writer_service.py
+"""
+import asyncio
+import signal
+
+from collection_manager import CollectionManager
+from gemini_client import close_gemini_client
+from ingest import shutdown_parse_pool
+from jobs import JobManager
+from utils import get_env_float
+
+async def run_writer(stop=None):
+    stop = stop or asyncio.Event()
+    collections = CollectionManager()
+    collections.acquire_writer_lock()
+    jobs = JobManager(collections, poll_interval=get_env_float('JOBS_POLL_INTERVAL', 0.2))
+    jobs.start()
+    try:
+        await stop.wait()
+    finally:
+        await jobs.stop()
+        await collections.stop()
+        await close_gemini_client()
+        shutdown_parse_pool()
+
+def main():
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await run_writer(stop)
+
+    asyncio.run(serve())
+
+if __name__ == '__main__':
+    main()